@@ -1,192 +1,1990 @@
 # Advanced Features Module for Ghana AI Hackathon Transport Optimizer
+import bisect
 import hashlib
+import heapq
+import math
+import struct
 import time
 import threading
+import weakref
+import zlib
 from datetime import datetime, timedelta
 import json
 import uuid
 import random
 import numpy as np
-from collections import defaultdict
+from collections import defaultdict, deque
 
-# Conditional imports with fallbacks
-try:
-    from sklearn.neural_network import MLPRegressor
-    HAS_ADVANCED_ML = True
-except ImportError:
-    HAS_ADVANCED_ML = False
+from demand_forecast import DemandForecaster
+from feature_store import DAILY_PROFILE
+from iot_stream import QuantileSketch, WindowAggregate, WindowTable, bucket_cells, bucket_stats, numeric_fields
+from lazy_imports import is_available
+from leaderboard import Leaderboard
+from ledger_store import LedgerConflict
+import metrics
+
+# Conditional imports with fallbacks (scikit-learn is loaded on first use)
+HAS_ADVANCED_ML = is_available('sklearn')
+
+# Fixed-size block header: index, timestamp, difficulty, previous hash,
+# merkle root. The 8-byte nonce is appended when hashing.
+BLOCK_HEADER = struct.Struct('<QdI32s32s')
+
+def _hash_to_bytes(hex_hash):
+    return bytes.fromhex(hex_hash.rjust(64, '0'))
+
+def merkle_root(transactions):
+    """Merkle root of a transaction list (hex), Bitcoin-style odd-leaf duplication"""
+    level = [
+        hashlib.sha256(json.dumps(tx, sort_keys=True).encode()).digest()
+        for tx in transactions
+    ]
+    if not level:
+        return hashlib.sha256(b'').hexdigest()
+    
+    while len(level) > 1:
+        if len(level) % 2:
+            level.append(level[-1])
+        level = [
+            hashlib.sha256(level[i] + level[i + 1]).digest()
+            for i in range(0, len(level), 2)
+        ]
+    return level[0].hex()
+
+def meets_difficulty(digest, difficulty):
+    """Check that a raw sha256 digest starts with ``difficulty`` zero hex digits"""
+    full_bytes, half_byte = divmod(difficulty, 2)
+    if digest[:full_bytes] != bytes(full_bytes):
+        return False
+    return not half_byte or digest[full_bytes] < 0x10
 
 class BlockchainLedger:
     """Blockchain implementation for transparent transport operations"""
     
-    def __init__(self):
-        self.chain = []
-        self.pending_transactions = []
-        self.create_genesis_block()
+    MAX_DIFFICULTY = 8
+    
+    def __init__(self, difficulty=2, block_size=3, block_interval=2.0, store=None):
+        # With a LedgerStore the chain lives on disk behind a list-like view
+        self.store = store
+        self.chain = store.chain() if store is not None else []
+        self._tx_locations = {}
+        self._block_heights = {}
+        self.pending_transactions = deque()
+        self.difficulty = difficulty
+        # Seal a block once this many transactions are pending, or once the
+        # oldest pending transaction has waited block_interval seconds
+        self.block_size = block_size
+        self.block_interval = block_interval
+        self.block_listeners = []
+        self._pending_ready = threading.Condition()
+        self._mining_lock = threading.Lock()
+        self._miner = None
+        self._miner_stop = threading.Event()
+        if not self.chain:
+            self.create_genesis_block()
     
     def create_genesis_block(self):
         genesis_block = {
             'index': 0,
             'timestamp': time.time(),
             'transactions': [],
-            'previous_hash': '0',
+            'merkle_root': merkle_root([]),
+            'previous_hash': '0' * 64,
+            'difficulty': 0,
             'nonce': 0
         }
         genesis_block['hash'] = self.calculate_hash(genesis_block)
-        self.chain.append(genesis_block)
+        try:
+            self._append_block(genesis_block)
+        except LedgerConflict:
+            # Another process sharing the store created it first
+            pass
+    
+    def _append_block(self, block):
+        self.chain.append(block)
+        if self.store is None:
+            self._block_heights[block['hash']] = block['index']
+            for position, transaction in enumerate(block['transactions']):
+                self._tx_locations[transaction['id']] = (block['index'], position)
+    
+    def find_transaction(self, transaction_id):
+        """Locate a mined transaction: (block index, position, transaction) or None"""
+        if self.store is not None:
+            return self.store.find_transaction(transaction_id)
+        location = self._tx_locations.get(transaction_id)
+        if location is None:
+            return None
+        height, position = location
+        return height, position, self.chain[height]['transactions'][position]
+    
+    def find_block(self, block_hash):
+        """Block with the given hash, or None"""
+        if self.store is not None:
+            height = self.store.find_block(block_hash)
+        else:
+            height = self._block_heights.get(block_hash)
+        return self.chain[height] if height is not None else None
+    
+    def storage_stats(self):
+        if self.store is None:
+            return {'backend': 'memory', 'blocks': len(self.chain)}
+        return dict(self.store.stats(), backend='disk')
+    
+    def block_header(self, block):
+        """Packed header bytes without the nonce"""
+        return BLOCK_HEADER.pack(
+            block['index'],
+            block['timestamp'],
+            block.get('difficulty', 0),
+            _hash_to_bytes(block['previous_hash']),
+            _hash_to_bytes(block['merkle_root'])
+        )
     
     def calculate_hash(self, block):
-        block_string = json.dumps(block, sort_keys=True)
-        return hashlib.sha256(block_string.encode()).hexdigest()
+        """Hash of the block header; transactions only enter through the merkle root"""
+        header = self.block_header(block) + block['nonce'].to_bytes(8, 'little')
+        return hashlib.sha256(header).hexdigest()
     
     def add_transaction(self, transaction_type, data):
+        """Queue a transaction for the next block; never waits for mining"""
         transaction = {
             'id': str(uuid.uuid4()),
             'type': transaction_type,
             'data': data,
             'timestamp': time.time()
         }
-        self.pending_transactions.append(transaction)
+        with self._pending_ready:
+            self.pending_transactions.append(transaction)
+            # Wake the miner to start the block_interval timer or to seal a full block
+            pending = len(self.pending_transactions)
+            if pending == 1 or pending >= self.block_size:
+                self._pending_ready.notify()
         return transaction['id']
     
-    def mine_block(self):
+    def configure(self, difficulty=None, block_size=None, block_interval=None):
+        """Change mining parameters at runtime; applies from the next block"""
+        if difficulty is not None:
+            difficulty = int(difficulty)
+            if not 0 <= difficulty <= self.MAX_DIFFICULTY:
+                raise ValueError(f'difficulty must be between 0 and {self.MAX_DIFFICULTY}')
+            self.difficulty = difficulty
+        if block_size is not None:
+            block_size = int(block_size)
+            if block_size < 1:
+                raise ValueError('block_size must be at least 1')
+            self.block_size = block_size
+        if block_interval is not None:
+            block_interval = float(block_interval)
+            if block_interval <= 0:
+                raise ValueError('block_interval must be positive')
+            self.block_interval = block_interval
+        with self._pending_ready:
+            self._pending_ready.notify()
+        return self.mining_status()
+    
+    def mining_status(self):
+        return {
+            'difficulty': self.difficulty,
+            'block_size': self.block_size,
+            'block_interval': self.block_interval,
+            'pending_transactions': len(self.pending_transactions),
+            'miner_running': self.miner_running()
+        }
+    
+    def add_block_listener(self, callback):
+        """Call ``callback(block)`` after every mined block"""
+        self.block_listeners.append(callback)
+    
+    def proof_of_work(self, block):
+        """Find a nonce for the block; only the fixed-size header is rehashed"""
+        prefix = hashlib.sha256(self.block_header(block))
+        difficulty = block['difficulty']
+        nonce = 0
+        while True:
+            candidate = prefix.copy()
+            candidate.update(nonce.to_bytes(8, 'little'))
+            digest = candidate.digest()
+            if meets_difficulty(digest, difficulty):
+                block['nonce'] = nonce
+                block['hash'] = digest.hex()
+                return block
+            nonce += 1
+    
+    def _take_pending(self, max_transactions=None):
+        with self._pending_ready:
+            count = len(self.pending_transactions)
+            if max_transactions is not None:
+                count = min(count, max_transactions)
+            return [self.pending_transactions.popleft() for _ in range(count)]
+    
+    def mine_block(self, max_transactions=None):
+        """Seal pending transactions (up to ``max_transactions``) into a new block"""
+        with self._mining_lock:
+            transactions = self._take_pending(max_transactions)
+            if not transactions:
+                return None
+            
+            try:
+                root = merkle_root(transactions)
+                while True:
+                    tip = self.chain[-1]
+                    new_block = {
+                        'index': tip['index'] + 1,
+                        'timestamp': time.time(),
+                        'transactions': transactions,
+                        'merkle_root': root,
+                        'previous_hash': tip['hash'],
+                        'difficulty': self.difficulty,
+                        'nonce': 0
+                    }
+                    
+                    # Proof of work over the header only, so cost does not grow with block size
+                    with metrics.BLOCKCHAIN_MINING_SECONDS.time():
+                        self.proof_of_work(new_block)
+                    
+                    try:
+                        self._append_block(new_block)
+                        break
+                    except LedgerConflict:
+                        # Another process sharing the store extended the chain; mine on its tip
+                        continue
+            except BaseException:
+                # Nothing was stored; the transactions go back to the front of the queue
+                with self._pending_ready:
+                    self.pending_transactions.extendleft(reversed(transactions))
+                raise
+            metrics.BLOCKCHAIN_BLOCKS.inc()
+        
+        for listener in list(self.block_listeners):
+            try:
+                listener(new_block)
+            except Exception as e:
+                print(f"⚠️  Block listener failed: {e}")
+        return new_block
+    
+    def _block_due(self):
+        """Seconds until the pending queue should be sealed (0 = now, None = empty)"""
         if not self.pending_transactions:
             return None
+        if len(self.pending_transactions) >= self.block_size:
+            return 0
+        age = time.time() - self.pending_transactions[0]['timestamp']
+        return max(0.0, self.block_interval - age)
+    
+    def _mine_forever(self):
+        while not self._miner_stop.is_set():
+            with self._pending_ready:
+                wait = self._block_due()
+                while wait != 0 and not self._miner_stop.is_set():
+                    self._pending_ready.wait(wait)
+                    wait = self._block_due()
+            if self._miner_stop.is_set():
+                break
+            try:
+                self.mine_block(self.block_size)
+            except Exception as e:
+                print(f"⚠️  Background mining failed: {e}")
+                # The transactions are back in the queue; do not spin on a failing store
+                self._miner_stop.wait(1.0)
+    
+    def start_miner(self):
+        """Mine pending transactions in a background thread"""
+        if self.miner_running():
+            return False
+        self._miner_stop.clear()
+        self._miner = threading.Thread(target=self._mine_forever, name='block-miner', daemon=True)
+        self._miner.start()
+        return True
+    
+    def stop_miner(self, timeout=None):
+        """Stop the background miner after the block it is working on"""
+        self._miner_stop.set()
+        with self._pending_ready:
+            self._pending_ready.notify_all()
+        if self._miner is not None:
+            self._miner.join(timeout)
+        self._miner = None
+    
+    def miner_running(self):
+        # A thread started before os.fork() is not alive in the child
+        return self._miner is not None and self._miner.is_alive()
+
+class TwinAggregates:
+    """Per-route and network-wide vehicle aggregates of one twin tick
+    
+    Sums, maxima and threshold breach counts are computed once when the twin
+    publishes a tick, so summaries and insights read O(routes) arrays instead
+    of walking the fleet. Streaks count consecutive ticks in which the
+    network average has been above a threshold.
+    """
+    
+    CROWDED_UTILIZATION = 0.85
+    LATE_MINUTES = 5.0
+    
+    def __init__(self, topology, utilization, delay, previous=None):
+        route_count = len(topology['route_ids'])
+        vehicle_route = topology['vehicle_route']
+        self.counts = np.diff(topology['route_offsets'])
+        self.utilization_sum = np.bincount(vehicle_route, weights=utilization, minlength=route_count)
+        self.delay_sum = np.bincount(vehicle_route, weights=delay, minlength=route_count)
+        self.crowded = np.bincount(vehicle_route, weights=utilization > self.CROWDED_UTILIZATION,
+                                   minlength=route_count).astype(np.int64)
+        self.late = np.bincount(vehicle_route, weights=delay > self.LATE_MINUTES,
+                                minlength=route_count).astype(np.int64)
+        self.max_delay = np.full(route_count, -np.inf)
+        if len(vehicle_route):
+            # Vehicles are sorted by route, so each route is one contiguous run
+            served = self.counts > 0
+            self.max_delay[served] = np.maximum.reduceat(delay, topology['route_offsets'][:-1][served])
         
-        new_block = {
-            'index': len(self.chain),
-            'timestamp': time.time(),
-            'transactions': self.pending_transactions.copy(),
-            'previous_hash': self.chain[-1]['hash'],
-            'nonce': 0
+        self.vehicles = int(self.counts.sum())
+        vehicles = max(self.vehicles, 1)
+        self.avg_utilization = float(self.utilization_sum.sum()) / vehicles
+        self.avg_delay = float(self.delay_sum.sum()) / vehicles
+        self.network_max_delay = float(self.max_delay.max()) if self.vehicles else 0.0
+        capacity = self.vehicles > 0 and self.avg_utilization > self.CROWDED_UTILIZATION
+        delayed = self.vehicles > 0 and self.avg_delay > self.LATE_MINUTES
+        self.capacity_streak = (previous.capacity_streak + 1 if previous else 1) if capacity else 0
+        self.delay_streak = (previous.delay_streak + 1 if previous else 1) if delayed else 0
+    
+    def route_means(self):
+        """Per-route arrays: vehicle count, mean utilization, mean and max delay"""
+        safe = np.maximum(self.counts, 1)
+        return self.counts, self.utilization_sum / safe, self.delay_sum / safe, self.max_delay
+    
+    def network(self):
+        return {
+            'vehicles': self.vehicles,
+            'avg_utilization': round(self.avg_utilization, 3),
+            'avg_delay_minutes': round(self.avg_delay, 2),
+            'max_delay_minutes': round(self.network_max_delay, 2),
+            'crowded_vehicles': int(self.crowded.sum()),
+            'late_vehicles': int(self.late.sum()),
+            'capacity_streak': self.capacity_streak,
+            'delay_streak': self.delay_streak
         }
+
+
+class TwinSnapshot:
+    """Frozen digital twin state after one completed tick
+    
+    Arrays are read-only and stay valid for as long as the snapshot is
+    referenced. The nested-dict and JSON forms are built at most once per
+    snapshot, however many readers ask for them.
+    """
+    
+    FIELDS = ('vehicle_direction', 'vehicle_position', 'vehicle_utilization', 'vehicle_delay',
+              'stop_waiting', 'stop_boarding_rate')
+    
+    def __init__(self, epoch, version, timestamp, topology, arrays, aggregates=None):
+        self.epoch = epoch
+        self.version = version
+        self.timestamp = timestamp
+        self.topology = topology
+        for name, array in arrays.items():
+            setattr(self, name, array)
+        self._aggregates = aggregates
+        self._state = None
+        self._json = None
+        self._lock = threading.Lock()
+    
+    @property
+    def vehicle_count(self):
+        return len(self.topology['vehicle_route'])
+    
+    def aggregates(self):
+        """TwinAggregates of this tick; computed here only for snapshots rebuilt from history"""
+        if self._aggregates is None:
+            with self._lock:
+                if self._aggregates is None:
+                    self._aggregates = TwinAggregates(self.topology, self.vehicle_utilization, self.vehicle_delay)
+        return self._aggregates
+    
+    def route_aggregates(self):
+        """Per-route arrays: vehicle count, mean utilization, mean and max delay"""
+        return self.aggregates().route_means()
+    
+    def route_summary(self):
+        """Per-route vehicle count, mean utilization and mean/max delay"""
+        return [
+            {
+                'route_id': route_id,
+                'vehicles': int(count),
+                'avg_utilization': round(float(util), 3),
+                'avg_delay_minutes': round(float(avg_delay), 2),
+                'max_delay_minutes': round(float(worst), 2) if count else None
+            }
+            for route_id, count, util, avg_delay, worst
+            in zip(self.topology['route_ids'], *self.route_aggregates())
+        ]
+    
+    def to_state(self):
+        """Nested dicts: vehicles grouped by route, passenger flow per stop (shared, do not modify)"""
+        with self._lock:
+            if self._state is None:
+                self._state = self._build_state()
+            return self._state
+    
+    def to_json(self):
+        """Serialized ``to_state()`` as UTF-8 bytes"""
+        state = self.to_state()
+        with self._lock:
+            if self._json is None:
+                self._json = json.dumps(state, separators=(',', ':')).encode()
+            return self._json
+    
+    def _build_state(self):
+        topology = self.topology
+        # float64 first so that rounded values serialize as short decimals
+        positions = self.vehicle_position.astype(np.float64).round(2).tolist()
+        utilization = self.vehicle_utilization.astype(np.float64).round(3).tolist()
+        delays = self.vehicle_delay.astype(np.float64).round(1).tolist()
+        offsets = topology['route_offsets'].tolist()
+        waiting = self.stop_waiting.astype(np.int64).tolist()
+        boarding = self.stop_boarding_rate.astype(np.float64).round(2).tolist()
+        demand = (topology['stop_arrival_rate'] * 3600).astype(np.int64).tolist()
         
-        # Simple proof of work
-        while not new_block['hash'].startswith('00'):
-            new_block['nonce'] += 1
-            new_block['hash'] = self.calculate_hash(new_block)
+        vehicles = {}
+        for r, route_id in enumerate(topology['route_ids']):
+            low, high = offsets[r], offsets[r + 1]
+            vehicles[route_id] = [
+                {
+                    'id': f"V{route_id}_{i}",
+                    'position': position,
+                    'capacity_utilization': util,
+                    'delay_minutes': delay
+                }
+                for i, (position, util, delay)
+                in enumerate(zip(positions[low:high], utilization[low:high], delays[low:high]))
+            ]
         
-        self.chain.append(new_block)
-        self.pending_transactions = []
-        return new_block
+        return {
+            'vehicles': vehicles,
+            'stops': topology['stops'],
+            'routes': topology['routes'],
+            'passenger_flow': {
+                stop_id: {
+                    'waiting_passengers': waiting[i],
+                    'boarding_rate': boarding[i],
+                    'predicted_demand': demand[i]
+                }
+                for i, stop_id in enumerate(topology['stop_ids'])
+            },
+            'last_update': self.timestamp
+        }
+
+class _HistoryFrame:
+    __slots__ = ('timestamp', 'version', 'keyframe', 'data', 'routes', 'network')
+    
+    def __init__(self, timestamp, version, keyframe, data, routes, network):
+        self.timestamp = timestamp
+        self.version = version
+        self.keyframe = keyframe
+        self.data = data
+        self.routes = routes
+        self.network = network
+    
+    @property
+    def size(self):
+        return len(self.data) + self.routes.nbytes + self.network.nbytes
+
+class TwinHistory:
+    """Fixed-memory ring buffer of past digital twin ticks
+    
+    Each tick is kept as one int16 vector of fixed-point vehicle and stop
+    values (see SCALES). With delta encoding a frame stores only the change
+    from the previous tick, zlib-compressed, and every ``keyframe_interval``
+    frames one is stored in full, so rebuilding a past state decodes at most
+    that many frames. Per-route and network aggregates are kept as small
+    plain arrays so time series never touch the vehicle data. The oldest
+    frames are dropped once ``max_bytes`` or ``max_frames`` is exceeded.
+    """
+    
+    # Fixed-point scale per snapshot field; value * scale must fit in int16
+    SCALES = {
+        'vehicle_direction': 1,
+        'vehicle_position': 100,
+        'vehicle_utilization': 1000,
+        'vehicle_delay': 100,
+        'stop_waiting': 1,
+        'stop_boarding_rate': 100
+    }
+    ROUTE_METRICS = ('avg_utilization', 'avg_delay_minutes', 'max_delay_minutes')
+    NETWORK_METRICS = ('avg_utilization', 'avg_delay_minutes', 'waiting_passengers', 'boarding_per_minute')
+    
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_frames=720, delta=True, keyframe_interval=30,
+                 compress=True):
+        self.max_bytes = max_bytes
+        self.max_frames = max_frames
+        self.delta = delta
+        self.keyframe_interval = keyframe_interval if delta else 1
+        self.compress = compress
+        self.epoch = None
+        self.topology = None
+        self.frames = deque()
+        self.bytes = 0
+        self._previous = None
+        self._since_keyframe = 0
+        self._scratch = None
+        self._lock = threading.Lock()
+    
+    # -- encoding ----------------------------------------------------------
+    
+    def _quantize(self, snapshot):
+        sources = [getattr(snapshot, name) for name in self.SCALES]
+        size = sum(len(source) for source in sources)
+        if self._scratch is None or len(self._scratch) != size:
+            self._scratch = np.empty(size, dtype=np.float32)
+        scratch = self._scratch
+        offset = 0
+        for source, scale in zip(sources, self.SCALES.values()):
+            np.multiply(source, scale, out=scratch[offset:offset + len(source)])
+            offset += len(source)
+        np.rint(scratch, out=scratch)
+        np.clip(scratch, -32768, 32767, out=scratch)
+        return scratch.astype(np.int16)
+    
+    def _pack(self, vector):
+        data = vector.tobytes()
+        return zlib.compress(data, 1) if self.compress else data
+    
+    def _unpack(self, frame):
+        data = zlib.decompress(frame.data) if self.compress else frame.data
+        return np.frombuffer(data, dtype=np.int16)
+    
+    def _arrays(self, vector, topology):
+        """Snapshot field arrays from a decoded vector"""
+        lengths = {'vehicle': len(topology['vehicle_route']), 'stop': len(topology['stop_ids'])}
+        arrays = {}
+        offset = 0
+        for name, scale in self.SCALES.items():
+            length = lengths[name.split('_')[0]]
+            values = vector[offset:offset + length]
+            arrays[name] = values.astype(np.int8) if name == 'vehicle_direction' else values.astype(np.float32) / scale
+            offset += length
+        return arrays
+    
+    def _decode(self, frames, first, last):
+        """Yield (index, frame, vector) for frames[first..last], starting from the keyframe before first"""
+        start = first
+        while not frames[start].keyframe:
+            start -= 1
+        vector = None
+        for index in range(start, last + 1):
+            frame = frames[index]
+            raw = self._unpack(frame)
+            # int16 differences wrap, and wrap back when added
+            vector = raw if frame.keyframe else vector + raw
+            if index >= first:
+                yield index, frame, vector
+    
+    # -- recording ---------------------------------------------------------
+    
+    def record(self, snapshot):
+        """Append a snapshot; a new twin epoch (network) starts a new history"""
+        aggregates = snapshot.aggregates()
+        counts, utilization, delay, max_delay = aggregates.route_means()
+        routes = np.array([utilization, delay, np.where(counts > 0, max_delay, 0)], dtype=np.float32)
+        network = np.array([
+            aggregates.avg_utilization,
+            aggregates.avg_delay,
+            float(snapshot.stop_waiting.sum()),
+            float(snapshot.stop_boarding_rate.sum())
+        ], dtype=np.float32)
+        vector = self._quantize(snapshot)
+        
+        with self._lock:
+            if snapshot.epoch != self.epoch:
+                self.frames.clear()
+                self.bytes = 0
+                self._previous = None
+                self.epoch = snapshot.epoch
+                self.topology = snapshot.topology
+            
+            keyframe = self._previous is None or self._since_keyframe + 1 >= self.keyframe_interval
+            self._since_keyframe = 0 if keyframe else self._since_keyframe + 1
+            data = self._pack(vector if keyframe else vector - self._previous)
+            frame = _HistoryFrame(snapshot.timestamp, snapshot.version, keyframe, data, routes, network)
+            self.frames.append(frame)
+            self.bytes += frame.size
+            self._previous = vector
+            
+            while self.frames and (self.bytes > self.max_bytes or len(self.frames) > self.max_frames):
+                self._evict()
+            if not self.frames:
+                self._previous = None
+    
+    def _evict(self):
+        oldest = self.frames.popleft()
+        self.bytes -= oldest.size
+        if self.frames and not self.frames[0].keyframe:
+            # The oldest frame must stay a keyframe for the rest to decode;
+            # frames are replaced, not modified, so readers' copies stay valid
+            following = self.frames[0]
+            vector = self._unpack(oldest) + self._unpack(following)
+            replacement = _HistoryFrame(following.timestamp, following.version, True, self._pack(vector),
+                                        following.routes, following.network)
+            self.frames[0] = replacement
+            self.bytes += replacement.size - following.size
+    
+    # -- queries -----------------------------------------------------------
+    
+    def _view(self, since=None, until=None):
+        with self._lock:
+            frames = list(self.frames)
+            topology, epoch = self.topology, self.epoch
+        first = 0 if since is None else bisect.bisect_left(frames, since, key=lambda frame: frame.timestamp)
+        last = len(frames) if until is None else bisect.bisect_right(frames, until, key=lambda frame: frame.timestamp)
+        return frames, first, last, topology, epoch
+    
+    def state_at(self, timestamp):
+        """TwinSnapshot of the last tick at or before ``timestamp`` (None if older than the history)"""
+        frames, _, last, topology, epoch = self._view(until=timestamp)
+        if last == 0:
+            return None
+        for _, frame, vector in self._decode(frames, last - 1, last - 1):
+            return TwinSnapshot(epoch, frame.version, frame.timestamp, topology, self._arrays(vector, topology))
+    
+    def _route_index(self, topology, route_id):
+        try:
+            return topology['route_ids'].index(route_id)
+        except (TypeError, ValueError):
+            raise ValueError(f'Unknown route {route_id}')
+    
+    def series(self, metric, route_id=None, since=None, until=None):
+        """Timestamps and values of a network metric, or of a route metric for ``route_id``"""
+        frames, first, last, topology, _ = self._view(since, until)
+        frames = frames[first:last]
+        if route_id is None:
+            if metric not in self.NETWORK_METRICS:
+                raise ValueError(f'metric must be one of {self.NETWORK_METRICS}')
+            column = self.NETWORK_METRICS.index(metric)
+            values = [frame.network[column] for frame in frames]
+        else:
+            if metric not in self.ROUTE_METRICS:
+                raise ValueError(f'metric must be one of {self.ROUTE_METRICS}')
+            row, r = self.ROUTE_METRICS.index(metric), self._route_index(topology, route_id)
+            values = [frame.routes[row, r] for frame in frames]
+        return {
+            'metric': metric,
+            'route_id': route_id,
+            'timestamps': [frame.timestamp for frame in frames],
+            'values': np.array(values, dtype=np.float64).round(3).tolist()
+        }
+    
+    def playback(self, since=None, until=None, every=1, route_id=None, limit=500):
+        """Frames for replaying a window: network metrics, plus one route's vehicles if ``route_id`` is given"""
+        frames, first, last, topology, _ = self._view(since, until)
+        last = min(last, first + every * limit)
+        if first >= last:
+            return []
+        
+        def network(frame):
+            return dict(zip(self.NETWORK_METRICS, np.round(frame.network.astype(np.float64), 3).tolist()))
+        
+        if route_id is None:
+            return [
+                {'timestamp': frame.timestamp, 'version': frame.version, 'network': network(frame)}
+                for frame in frames[first:last:every]
+            ]
+        
+        r = self._route_index(topology, route_id)
+        low, high = topology['route_offsets'][r], topology['route_offsets'][r + 1]
+        playback = []
+        for index, frame, vector in self._decode(frames, first, last - 1):
+            if (index - first) % every:
+                continue
+            arrays = self._arrays(vector, topology)
+            playback.append({
+                'timestamp': frame.timestamp,
+                'version': frame.version,
+                'network': network(frame),
+                'route': dict(zip(self.ROUTE_METRICS, np.round(frame.routes[:, r].astype(np.float64), 3).tolist())),
+                'vehicles': {
+                    'position': arrays['vehicle_position'][low:high].astype(np.float64).round(2).tolist(),
+                    'direction': arrays['vehicle_direction'][low:high].tolist(),
+                    'capacity_utilization': arrays['vehicle_utilization'][low:high].astype(np.float64).round(3).tolist(),
+                    'delay_minutes': arrays['vehicle_delay'][low:high].astype(np.float64).round(1).tolist()
+                }
+            })
+        return playback
+    
+    def stats(self):
+        with self._lock:
+            frames = list(self.frames)
+            stored = self.bytes
+        raw = len(self._previous) * 2 if self._previous is not None else 0
+        return {
+            'frames': len(frames),
+            'keyframes': sum(frame.keyframe for frame in frames),
+            'bytes': stored,
+            'max_bytes': self.max_bytes,
+            'max_frames': self.max_frames,
+            'delta': self.delta,
+            'compress': self.compress,
+            'oldest': frames[0].timestamp if frames else None,
+            'newest': frames[-1].timestamp if frames else None,
+            'bytes_per_frame': round(stored / len(frames)) if frames else None,
+            'uncompressed_bytes_per_frame': raw
+        }
+
+class TransitEventSimulator:
+    """Discrete-event simulation of a service day on a virtual clock
+    
+    Trip dispatches, arrivals at stops and departures after dwelling are
+    processed from a priority queue in time order, so the clock jumps from one
+    event to the next and a whole day runs in well under a minute. Passengers
+    arrive at each stop as a Poisson process following a time-of-day profile;
+    their number is drawn when a vehicle calls, for the interval since the
+    previous call. Stops share one queue across the routes that serve them.
+    """
+    
+    # Relative demand per hour of day, with morning and evening peaks
+    HOURLY_PROFILE = DAILY_PROFILE
+    DWELL_SECONDS = 20.0
+    BOARDING_SECONDS = 2.0
+    ALIGHTING_SECONDS = 1.5
+    LAYOVER_SECONDS = 300.0
+    # Mean time passengers wait before giving up
+    PATIENCE_SECONDS = 1800.0
+    # Busiest-hour travel times are this much longer than quiet-hour ones;
+    # the daily average matches the scheduled running time
+    PEAK_CONGESTION = 0.4
+    
+    DISPATCH, ARRIVE, DEPART = 0, 1, 2
+    
+    def __init__(self, stops, routes, schedule, demand_scale=1.0, vehicle_capacity=None, seed=None):
+        self.rng = np.random.default_rng(seed)
+        self.schedule = schedule
+        self.demand_scale = demand_scale
+        self.route_capacity = {
+            route['route_id']: self.route_value(vehicle_capacity, route['route_id'], route.get('vehicle_capacity', 50))
+            for route in routes
+        }
+        
+        self.stop_ids = [stop['stop_id'] for stop in stops]
+        self.stop_index = {stop_id: i for i, stop_id in enumerate(self.stop_ids)}
+        self.stop_daily = [float(stop.get('daily_passengers', 1000)) * demand_scale for stop in stops]
+        
+        profile = self.HOURLY_PROFILE / self.HOURLY_PROFILE.sum()
+        self._demand_cdf = np.concatenate([[0.0], np.cumsum(profile)]).tolist()
+        congestion = 1 + self.PEAK_CONGESTION * self.HOURLY_PROFILE / self.HOURLY_PROFILE.max()
+        self._congestion = congestion / np.average(congestion, weights=self.HOURLY_PROFILE)
+        
+        self.now = 0.0
+        self.events_processed = 0
+        self._events = []
+        self._sequence = 0
+        
+        # Per-stop queues of (passengers, mean arrival time) cohorts, oldest first
+        self.queues = {}
+        self.last_call = {}
+        # Vehicles: [route_id, capacity, onboard]; idle ones wait at a terminal
+        self.vehicles = []
+        self.idle = defaultdict(list)
+        self.in_service = 0
+        self.peak_in_service = 0
+        
+        self.route_stats = defaultdict(lambda: {
+            'trips': 0, 'boardings': 0, 'left_behind': 0, 'delay_sum': 0.0, 'arrivals': 0,
+            'max_delay': 0.0, 'load_sum': 0.0, 'departures': 0
+        })
+        self.stop_stats = defaultdict(lambda: {'boardings': 0, 'wait_sum': 0.0, 'max_queue': 0, 'abandoned': 0})
+        self.hourly_boardings = np.zeros(48, dtype=np.int64)
+        
+        # Trips are dispatched from this time-ordered list rather than all
+        # being queued up front, which keeps the event heap small
+        self._dispatch_order = sorted(range(len(schedule)), key=lambda i: schedule[i]['times'][0])
+        self._next_dispatch = 0
+    
+    # -- schedules ---------------------------------------------------------
+    
+    @staticmethod
+    def route_value(value, route_id, default):
+        """Scenario setting for one route: a number applies network-wide, a dict overrides per route"""
+        if value is None:
+            return default
+        if isinstance(value, dict):
+            return value.get(route_id, default)
+        return value
+    
+    @staticmethod
+    def schedule_from_routes(routes, start_hour=5, end_hour=23, headway_minutes=None):
+        """Trips in both directions between each route's terminals at its headway"""
+        schedule = []
+        for route in routes:
+            route_id = route['route_id']
+            headway = float(TransitEventSimulator.route_value(
+                headway_minutes, route_id, route.get('current_frequency', 10))) * 60
+            if headway <= 0:
+                raise ValueError(f'headway_minutes must be positive for route {route_id}')
+            travel = float(route.get('avg_travel_time', 60)) * 60
+            terminals = (route['start_stop'], route['end_stop'])
+            for direction in (0, 1):
+                stops = list(terminals if direction == 0 else terminals[::-1])
+                departure = start_hour * 3600 + direction * headway / 2
+                while departure < end_hour * 3600:
+                    schedule.append({
+                        'trip_id': f"{route_id}_{direction}_{int(departure)}",
+                        'route_id': route_id,
+                        'stops': stops,
+                        'times': [departure, departure + travel]
+                    })
+                    departure += headway
+        return schedule
+    
+    @staticmethod
+    def schedule_from_stop_times(trips, stop_times):
+        """Trips from GTFS ``trips`` and ``stop_times`` DataFrames"""
+        merged = stop_times.merge(trips[['trip_id', 'route_id']], on='trip_id')
+        merged = merged.sort_values(['trip_id', 'stop_sequence'])
+        # GTFS times may run past 24:00:00 for trips after midnight
+        parts = merged['arrival_time'].str.split(':', expand=True).astype(int)
+        merged = merged.assign(seconds=parts[0] * 3600 + parts[1] * 60 + parts[2])
+        return [
+            {
+                'trip_id': trip_id,
+                'route_id': group['route_id'].iloc[0],
+                'stops': group['stop_id'].tolist(),
+                'times': group['seconds'].astype(float).tolist()
+            }
+            for trip_id, group in merged.groupby('trip_id', sort=False)
+            if len(group) >= 2
+        ]
+    
+    # -- engine ------------------------------------------------------------
+    
+    def _schedule(self, at, kind, trip_index, stop_position, vehicle):
+        heapq.heappush(self._events, (at, self._sequence, kind, trip_index, stop_position, vehicle))
+        self._sequence += 1
+    
+    def _demand_share(self, seconds):
+        """Fraction of a day's demand arrived by ``seconds`` (the profile repeats daily)"""
+        days, hour = divmod(seconds / 3600, 24)
+        index = int(hour)
+        cdf = self._demand_cdf
+        return days + cdf[index] + (cdf[index + 1] - cdf[index]) * (hour - index)
+    
+    def _expected_arrivals(self, stop_id, start, end):
+        index = self.stop_index.get(stop_id)
+        if index is None or end <= start:
+            return 0.0
+        return self.stop_daily[index] * (self._demand_share(end) - self._demand_share(start))
+    
+    def _travel_factor(self):
+        hour = int(self.now // 3600) % 24
+        return self._congestion[hour] * self.rng.lognormal(0, 0.1)
+    
+    def run(self, until=None, speed=None):
+        """Process events up to virtual time ``until`` (seconds after midnight)
+        
+        With ``speed`` the clock is paced at that multiple of wall time
+        (e.g. 60 = one simulated minute per second); otherwise it runs as fast
+        as possible.
+        """
+        wall_start = time.perf_counter()
+        clock_start = self.now
+        events = self._events
+        order = self._dispatch_order
+        schedule = self.schedule
+        end = float('inf') if until is None else until
+        while True:
+            next_trip = (schedule[order[self._next_dispatch]]['times'][0]
+                         if self._next_dispatch < len(order) else float('inf'))
+            next_event = events[0][0] if events else float('inf')
+            if min(next_trip, next_event) > end or next_event == next_trip == float('inf'):
+                break
+            if next_trip <= next_event:
+                at, kind, trip_index, stop_position, vehicle = next_trip, self.DISPATCH, order[self._next_dispatch], 0, None
+                self._next_dispatch += 1
+            else:
+                at, _, kind, trip_index, stop_position, vehicle = heapq.heappop(events)
+            if speed:
+                lag = (at - clock_start) / speed - (time.perf_counter() - wall_start)
+                if lag > 0:
+                    time.sleep(lag)
+            self.now = at
+            self.events_processed += 1
+            
+            if kind == self.DISPATCH:
+                self._dispatch(trip_index)
+            elif kind == self.ARRIVE:
+                self._arrive(trip_index, stop_position, vehicle)
+            else:
+                self._depart(trip_index, stop_position, vehicle)
+        
+        if until is not None:
+            self.now = max(self.now, until)
+        return self
+    
+    def _dispatch(self, trip_index):
+        trip = self.schedule[trip_index]
+        route_id = trip['route_id']
+        pool = self.idle[(route_id, trip['stops'][0])]
+        if pool and pool[0][0] <= self.now:
+            vehicle = heapq.heappop(pool)[1]
+        else:
+            # No vehicle back at this terminal in time: the fleet has to grow
+            vehicle = len(self.vehicles)
+            self.vehicles.append([route_id, self.route_capacity.get(route_id, 50), 0])
+        
+        self.in_service += 1
+        self.peak_in_service = max(self.peak_in_service, self.in_service)
+        self.route_stats[route_id]['trips'] += 1
+        self._arrive(trip_index, 0, vehicle)
+    
+    def _arrive(self, trip_index, stop_position, vehicle):
+        trip = self.schedule[trip_index]
+        route_id, capacity, onboard = self.vehicles[vehicle]
+        stop_id = trip['stops'][stop_position]
+        last_stop = stop_position == len(trip['stops']) - 1
+        route_stats = self.route_stats[route_id]
+        
+        delay = self.now - trip['times'][stop_position]
+        route_stats['delay_sum'] += delay
+        route_stats['arrivals'] += 1
+        route_stats['max_delay'] = max(route_stats['max_delay'], delay)
+        
+        # Riders spread their destinations evenly over the remaining stops
+        if last_stop:
+            alighting = onboard
+        elif stop_position:
+            alighting = int(self.rng.binomial(onboard, 1 / (len(trip['stops']) - stop_position)))
+        else:
+            alighting = 0
+        onboard -= alighting
+        
+        boarding = 0
+        if not last_stop:
+            boarding = self._board(stop_id, capacity - onboard, route_stats)
+            onboard += boarding
+        self.vehicles[vehicle][2] = onboard
+        
+        if last_stop:
+            self.in_service -= 1
+            heapq.heappush(self.idle[(route_id, stop_id)], (self.now + self.LAYOVER_SECONDS, vehicle))
+            return
+        
+        dwell = self.DWELL_SECONDS + boarding * self.BOARDING_SECONDS + alighting * self.ALIGHTING_SECONDS
+        # Early vehicles hold at the stop until their scheduled time
+        departure = max(self.now + dwell, trip['times'][stop_position])
+        self._schedule(departure, self.DEPART, trip_index, stop_position, vehicle)
+    
+    def _board(self, stop_id, free_seats, route_stats):
+        queue = self.queues.setdefault(stop_id, deque())
+        previous_call = self.last_call.get(stop_id, self.now)
+        stop_stats = self.stop_stats[stop_id]
+        
+        # Exponential patience: each queued passenger stays with probability
+        # exp(-elapsed / patience) between two calls
+        if queue and self.now > previous_call:
+            stay = np.exp(-(self.now - previous_call) / self.PATIENCE_SECONDS)
+            for cohort in queue:
+                remaining = int(self.rng.binomial(cohort[0], stay))
+                stop_stats['abandoned'] += cohort[0] - remaining
+                cohort[0] = remaining
+            while queue and queue[0][0] == 0:
+                queue.popleft()
+        
+        arrivals = int(self.rng.poisson(self._expected_arrivals(stop_id, previous_call, self.now)))
+        if arrivals:
+            queue.append([arrivals, (previous_call + self.now) / 2])
+        self.last_call[stop_id] = self.now
+        
+        waiting = sum(cohort[0] for cohort in queue)
+        stop_stats['max_queue'] = max(stop_stats['max_queue'], waiting)
+        
+        boarding = 0
+        while queue and boarding < free_seats:
+            cohort = queue[0]
+            taken = min(cohort[0], free_seats - boarding)
+            stop_stats['wait_sum'] += taken * (self.now - cohort[1])
+            boarding += taken
+            cohort[0] -= taken
+            if cohort[0] == 0:
+                queue.popleft()
+        # Arrivals are drawn per call, so a mid-queue cohort can also be empty
+        while queue and queue[0][0] == 0:
+            queue.popleft()
+        
+        stop_stats['boardings'] += boarding
+        route_stats['boardings'] += boarding
+        route_stats['left_behind'] += waiting - boarding
+        self.hourly_boardings[min(int(self.now // 3600), len(self.hourly_boardings) - 1)] += boarding
+        return boarding
+    
+    def _depart(self, trip_index, stop_position, vehicle):
+        trip = self.schedule[trip_index]
+        route_id, capacity, onboard = self.vehicles[vehicle]
+        route_stats = self.route_stats[route_id]
+        route_stats['load_sum'] += onboard / capacity if capacity else 0
+        route_stats['departures'] += 1
+        
+        scheduled = trip['times'][stop_position + 1] - trip['times'][stop_position]
+        self._schedule(self.now + scheduled * self._travel_factor(), self.ARRIVE,
+                       trip_index, stop_position + 1, vehicle)
+    
+    # -- results -----------------------------------------------------------
+    
+    def results(self):
+        """Per-route and per-stop service statistics for the simulated period"""
+        routes = {
+            route_id: {
+                'trips': stats['trips'],
+                'boardings': stats['boardings'],
+                'left_behind': stats['left_behind'],
+                'avg_delay_minutes': round(stats['delay_sum'] / max(stats['arrivals'], 1) / 60, 2),
+                'max_delay_minutes': round(stats['max_delay'] / 60, 2),
+                'avg_load_factor': round(stats['load_sum'] / max(stats['departures'], 1), 3),
+                'vehicles_used': sum(1 for vehicle in self.vehicles if vehicle[0] == route_id)
+            }
+            for route_id, stats in sorted(self.route_stats.items())
+        }
+        stops = {
+            stop_id: {
+                'boardings': stats['boardings'],
+                'avg_wait_minutes': round(stats['wait_sum'] / max(stats['boardings'], 1) / 60, 2),
+                'max_queue': stats['max_queue'],
+                'abandoned': stats['abandoned'],
+                'still_waiting': sum(cohort[0] for cohort in self.queues.get(stop_id, ()))
+            }
+            for stop_id, stats in sorted(self.stop_stats.items())
+        }
+        total_boardings = sum(route['boardings'] for route in routes.values())
+        return {
+            'clock': self.now,
+            'events_processed': self.events_processed,
+            'trips': len(self.schedule),
+            'vehicles_used': len(self.vehicles),
+            'peak_vehicles_in_service': self.peak_in_service,
+            'total_boardings': total_boardings,
+            'abandoned': sum(stats['abandoned'] for stats in self.stop_stats.values()),
+            'avg_wait_minutes': round(
+                sum(stats['wait_sum'] for stats in self.stop_stats.values()) / max(total_boardings, 1) / 60, 2),
+            # Trips running past midnight count towards the early hours
+            'hourly_boardings': (self.hourly_boardings[:24] + self.hourly_boardings[24:]).tolist(),
+            'routes': routes,
+            'stops': stops
+        }
 
 class DigitalTwinEngine:
-    """Digital Twin simulation for real-time transport network modeling"""
+    """Digital Twin simulation for real-time transport network modeling
     
-    def __init__(self):
-        self.twin_state = {}
+    Vehicle and stop state live in NumPy arrays (one entry per vehicle or
+    stop) that each tick updates with whole-array operations, so a tick costs
+    a few passes over the fleet instead of building Python objects per vehicle.
+    
+    Only the simulation thread touches those live arrays. At the end of every
+    tick they are copied into one of two buffers and published as a
+    TwinSnapshot; readers just take the current snapshot reference. Each
+    tick's vehicle delays are scored by the optional ``anomalies`` detector
+    (StreamingAnomalyDetector), one series per route. With a ``features``
+    store (StopFeatureStore), passengers arrive at each stop at its
+    historical boarding rate for the current hour instead of a flat share
+    of its daily volume.
+    """
+    
+    # Hours per day over which a stop's daily passengers arrive
+    SERVICE_HOURS = 18
+    # Mean time passengers wait before giving up, and the smoothing window
+    # of the reported boarding rate (seconds)
+    PATIENCE_SECONDS = 1800
+    BOARDING_RATE_WINDOW = 300
+    # Forecast congestion bands: below 0.5 low, above 0.7 high
+    CONGESTION_THRESHOLDS = (0.5, 0.7)
+    CONGESTION_LEVELS = ('low', 'moderate', 'high')
+    
+    def __init__(self, tick_interval=5.0, history=None, anomalies=None, features=None):
+        self.tick_interval = tick_interval
+        self.history = history
+        self.anomalies = anomalies
+        self.features = features
+        # (features version, hour, epoch) and the arrival rates derived from them
+        self._arrival = (None, None)
         self.simulation_running = False
         self.real_time_data = {}
         self.predictions = {}
+        self.rng = np.random.default_rng()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._epoch = 0
+        # Two reusable buffer sets: (arrays, weakref to the snapshot using them)
+        self._buffers = [None, None]
+        self._next_buffer = 0
+        self._alternatives = None
+        self._snapshot = None
+        self._reset_arrays([], [])
+        self._publish()
+    
+    def _reset_arrays(self, stops, routes):
+        self.stops = stops
+        self.routes = routes
+        self.stop_ids = [stop['stop_id'] for stop in stops]
+        self.route_ids = [route['route_id'] for route in routes]
+        
+        # Per-stop state
+        self.stop_arrival_rate = np.zeros(len(stops), dtype=np.float32)
+        self.stop_waiting = np.zeros(len(stops), dtype=np.float32)
+        self.stop_boarding_rate = np.zeros(len(stops), dtype=np.float32)
+        
+        # Per-route constants
+        self.route_speed = np.zeros(len(routes), dtype=np.float32)
+        self.route_capacity = np.zeros(len(routes), dtype=np.float32)
+        self.route_terminals = np.zeros((len(routes), 2), dtype=np.int32)
+        self.route_offsets = np.zeros(len(routes) + 1, dtype=np.int64)
+        
+        # Per-vehicle state, sorted by route
+        self.vehicle_route = np.zeros(0, dtype=np.int32)
+        self.vehicle_direction = np.zeros(0, dtype=np.int8)
+        self.vehicle_position = np.zeros(0, dtype=np.float32)
+        self.vehicle_utilization = np.zeros(0, dtype=np.float32)
+        self.vehicle_delay = np.zeros(0, dtype=np.float32)
+        
+        self.tick_count = 0
+        self.last_update = time.time()
+        self._update_topology()
     
-    def initialize_twin(self, network_data):
-        """Initialize digital twin with network topology"""
-        self.twin_state = {
-            'vehicles': {},
-            'stops': network_data.get('stops', {}),
-            'routes': network_data.get('routes', {}),
-            'passenger_flow': {},
-            'last_update': time.time()
+    def _update_topology(self):
+        # Constant during a run; snapshots share it by reference
+        self._topology = {
+            'stops': self.stops,
+            'routes': self.routes,
+            'stop_ids': self.stop_ids,
+            'route_ids': self.route_ids,
+            'route_offsets': self.route_offsets,
+            'vehicle_route': self.vehicle_route,
+            'stop_arrival_rate': self.stop_arrival_rate,
+            'route_capacity': self.route_capacity,
+            'route_terminals': self.route_terminals
         }
     
+    def initialize_twin(self, network_data, fleet_size=None):
+        """Initialize digital twin with network topology
+        
+        Each route gets enough vehicles to run its headway over its travel
+        time; ``fleet_size`` rescales those counts to a given total.
+        """
+        stops = list(network_data.get('stops', []))
+        routes = list(network_data.get('routes', []))
+        rng = np.random.default_rng()
+        
+        with self._lock:
+            self.rng = rng
+            self._reset_arrays(stops, routes)
+            stop_index = {stop_id: i for i, stop_id in enumerate(self.stop_ids)}
+            
+            daily_passengers = np.array([stop.get('daily_passengers', 1000) for stop in stops], dtype=np.float32)
+            self.stop_arrival_rate = daily_passengers / (self.SERVICE_HOURS * 3600)
+            self.stop_waiting = rng.poisson(self.stop_arrival_rate * 120).astype(np.float32)
+            
+            travel_minutes = np.array([route.get('avg_travel_time', 60) for route in routes], dtype=np.float32)
+            headway_minutes = np.array([route.get('current_frequency', 10) for route in routes], dtype=np.float32)
+            self.route_speed = 100.0 / np.maximum(travel_minutes * 60, 1)  # % of the route per second
+            self.route_capacity = np.array([route.get('vehicle_capacity', 50) for route in routes], dtype=np.float32)
+            self.route_terminals = np.array(
+                [[stop_index.get(route.get('start_stop'), -1), stop_index.get(route.get('end_stop'), -1)]
+                 for route in routes], dtype=np.int32).reshape(-1, 2)
+            
+            counts = np.maximum(1, np.ceil(travel_minutes / np.maximum(headway_minutes, 1))).astype(np.int64)
+            if fleet_size and len(routes):
+                scaled = np.maximum(1, np.floor(counts / counts.sum() * fleet_size)).astype(np.int64)
+                scaled[np.argmax(scaled)] += max(0, fleet_size - scaled.sum())
+                counts = scaled
+            self.route_offsets = np.concatenate([[0], np.cumsum(counts)])
+            
+            vehicles = int(self.route_offsets[-1])
+            self.vehicle_route = np.repeat(np.arange(len(routes), dtype=np.int32), counts)
+            self.vehicle_direction = rng.integers(0, 2, vehicles).astype(np.int8)
+            # Spread each route's vehicles evenly along it
+            slot = np.arange(vehicles) - np.repeat(self.route_offsets[:-1], counts)
+            self.vehicle_position = ((slot / counts[self.vehicle_route] * 100
+                                      + rng.uniform(0, 5, vehicles)) % 100).astype(np.float32)
+            self.vehicle_utilization = rng.uniform(0.3, 0.95, vehicles).astype(np.float32)
+            self.vehicle_delay = rng.integers(-2, 5, vehicles).astype(np.float32)
+            
+            self._update_topology()
+            self._epoch += 1
+            self._publish()
+    
+    @property
+    def vehicle_count(self):
+        return len(self.vehicle_route)
+    
+    def tick(self, dt=None):
+        """Advance the simulation by ``dt`` seconds"""
+        dt = self.tick_interval if dt is None else dt
+        tick_start = time.perf_counter()
+        rng = self.rng
+        route = self.vehicle_route
+        
+        # Traffic: each vehicle runs at 80-115% of its scheduled speed and
+        # gains (or recovers) delay accordingly
+        traffic = rng.uniform(0.8, 1.15, len(route)).astype(np.float32)
+        self.vehicle_position += self.route_speed[route] * traffic * dt
+        self.vehicle_delay += (1 - traffic) * (dt / 60)
+        
+        # Vehicles that finished a trip: everyone alights at the terminus, the
+        # delay is partly recovered, and the vehicle turns around and boards
+        # the passengers waiting there
+        finished = np.flatnonzero(self.vehicle_position >= 100)
+        np.mod(self.vehicle_position, 100, out=self.vehicle_position)
+        self.vehicle_delay[finished] *= 0.5
+        np.clip(self.vehicle_delay, -2, 30, out=self.vehicle_delay)
+        self.vehicle_direction[finished] ^= 1
+        
+        # Passengers arrive, and some give up waiting
+        self.stop_waiting += rng.poisson(self._arrival_rate() * dt)
+        self.stop_waiting *= np.float32(np.exp(-dt / self.PATIENCE_SECONDS))
+        
+        boarded = np.zeros(len(self.stop_waiting), dtype=np.float32)
+        if len(finished):
+            stop = self.route_terminals[route[finished], self.vehicle_direction[finished]]
+            served = stop >= 0
+            seats = np.bincount(stop[served], weights=self.route_capacity[route[finished]][served],
+                                minlength=len(self.stop_waiting))
+            boarded = np.minimum(self.stop_waiting, seats).astype(np.float32)
+            fill = np.divide(boarded, seats, out=np.zeros_like(boarded), where=seats > 0)
+            self.vehicle_utilization[finished] = np.where(served, fill[np.maximum(stop, 0)], 0)
+            self.stop_waiting -= boarded
+        
+        self.vehicle_utilization += rng.normal(0, 0.01, len(route)).astype(np.float32)
+        np.clip(self.vehicle_utilization, 0, 1, out=self.vehicle_utilization)
+        
+        # Boardings per minute, smoothed over BOARDING_RATE_WINDOW
+        alpha = np.float32(1 - np.exp(-dt / self.BOARDING_RATE_WINDOW))
+        self.stop_boarding_rate += alpha * (boarded * np.float32(60 / dt) - self.stop_boarding_rate)
+        
+        self.tick_count += 1
+        self.last_update = time.time()
+        self._publish()
+        if self.anomalies is not None and len(route):
+            self._score_delays(self._snapshot)
+        metrics.TWIN_TICK_SECONDS.observe(time.perf_counter() - tick_start)
+    
+    def _arrival_rate(self):
+        """Passengers per second at each stop, from the feature store when there is one"""
+        if self.features is None:
+            return self.stop_arrival_rate
+        features = self.features.snapshot()
+        key = (features.version, int(time.time() // 3600 % 24), self._epoch)
+        if self._arrival[0] != key:
+            rows = np.array([features.stop_index.get(stop_id, -1) for stop_id in self.stop_ids], dtype=np.int64)
+            known = rows >= 0
+            rate = self.stop_arrival_rate.copy()
+            rate[known] = features.hour_column('boardings')[rows[known], key[1]] / 3600
+            self._arrival = (key, rate)
+        return self._arrival[1]
+    
+    def _score_delays(self, snapshot):
+        """Score every vehicle's delay against its route's baseline"""
+        topology = snapshot.topology
+        route_ids, offsets, vehicle_route = topology['route_ids'], topology['route_offsets'], topology['vehicle_route']
+        
+        def vehicle(i):
+            r = int(vehicle_route[i])
+            return f"V{route_ids[r]}_{i - int(offsets[r])}"
+        
+        self.anomalies.observe('route', vehicle_route, 'delay_minutes', snapshot.vehicle_delay,
+                               snapshot.timestamp, route_ids, labels=vehicle)
+    
+    def _publish(self):
+        """Copy the live arrays into a free buffer and make them the current snapshot"""
+        slot = self._next_buffer
+        self._next_buffer ^= 1
+        
+        entry = self._buffers[slot]
+        reusable = (
+            entry is not None
+            and entry[1]() is None  # no reader still holds the snapshot from two ticks ago
+            and all(entry[0][name].shape == getattr(self, name).shape for name in TwinSnapshot.FIELDS)
+        )
+        if reusable:
+            arrays = entry[0]
+            for array in arrays.values():
+                array.flags.writeable = True
+        else:
+            arrays = {name: np.empty_like(getattr(self, name)) for name in TwinSnapshot.FIELDS}
+        
+        for name, array in arrays.items():
+            np.copyto(array, getattr(self, name))
+            array.flags.writeable = False
+        
+        topology = self._topology
+        previous = self._snapshot
+        aggregates = TwinAggregates(topology, arrays['vehicle_utilization'], arrays['vehicle_delay'],
+                                    previous.aggregates() if previous and previous.epoch == self._epoch else None)
+        snapshot = TwinSnapshot(self._epoch, self.tick_count, self.last_update, topology, arrays, aggregates)
+        self._buffers[slot] = (arrays, weakref.ref(snapshot))
+        self._snapshot = snapshot
+        if self.history is not None:
+            self.history.record(snapshot)
+    
+    def snapshot(self):
+        """Latest completed state; never blocks and never changes afterwards"""
+        return self._snapshot
+    
     def simulate_real_time(self):
         """Simulate real-time network state"""
         while self.simulation_running:
-            # Simulate vehicle positions
-            for route_id in self.twin_state['routes']:
-                if route_id not in self.twin_state['vehicles']:
-                    self.twin_state['vehicles'][route_id] = []
-                
-                # Add random vehicle positions
-                vehicle_count = random.randint(2, 6)
-                self.twin_state['vehicles'][route_id] = [
-                    {
-                        'id': f"V{route_id}_{i}",
-                        'position': random.uniform(0, 100),
-                        'capacity_utilization': random.uniform(0.3, 0.95),
-                        'delay_minutes': random.randint(-2, 15)
-                    }
-                    for i in range(vehicle_count)
-                ]
-            
-            # Update passenger flow
-            for stop_id in self.twin_state['stops']:
-                self.twin_state['passenger_flow'][stop_id] = {
-                    'waiting_passengers': random.randint(0, 50),
-                    'boarding_rate': random.uniform(0.5, 3.0),
-                    'predicted_demand': random.randint(100, 2000)
-                }
-            
-            self.twin_state['last_update'] = time.time()
-            time.sleep(5)  # Update every 5 seconds
+            with self._lock:
+                self.tick()
+            time.sleep(self.tick_interval)
     
     def start_simulation(self):
         self.simulation_running = True
-        threading.Thread(target=self.simulate_real_time, daemon=True).start()
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self.simulate_real_time, daemon=True)
+            self._thread.start()
     
     def stop_simulation(self):
         self.simulation_running = False
     
+    def route_summary(self):
+        return self._snapshot.route_summary()
+    
     def get_twin_state(self):
-        return self.twin_state
+        """State after the latest completed tick as nested dicts"""
+        return self._snapshot.to_state()
+    
+    def simulate_day(self, network_data=None, schedule=None, headway_minutes=None, start_hour=5,
+                     end_hour=23, demand_scale=1.0, vehicle_capacity=None, seed=None):
+        """Run a what-if discrete-event simulation of a service day
+        
+        Uses the twin's network unless ``network_data`` is given, and builds
+        the timetable from route headways unless a ``schedule`` is given.
+        """
+        stops = network_data['stops'] if network_data else self.stops
+        routes = network_data['routes'] if network_data else self.routes
+        if schedule is None:
+            schedule = TransitEventSimulator.schedule_from_routes(routes, start_hour, end_hour, headway_minutes)
+        
+        started = time.perf_counter()
+        simulator = TransitEventSimulator(stops, routes, schedule, demand_scale=demand_scale,
+                                          vehicle_capacity=vehicle_capacity, seed=seed)
+        simulator.run()
+        elapsed = time.perf_counter() - started
+        
+        results = simulator.results()
+        simulated = simulator.now - min(trip['times'][0] for trip in schedule) if schedule else 0
+        results['simulated_hours'] = round(simulated / 3600, 2)
+        results['wall_seconds'] = round(elapsed, 3)
+        results['speedup'] = round(simulated / elapsed) if elapsed > 0 else None
+        return results
+    
+    def forecast_congestion(self, route_ids=None, horizon=60, step=1, at=None):
+        """Congestion forecast for many routes over the next ``horizon`` minutes
+        
+        Builds a routes x minutes matrix in one pass: each route starts from
+        its current load (utilization, delay and passengers waiting at its
+        terminals) and follows the daily demand profile from the current
+        hour. Alternatives are looked up only when a route crosses into a
+        higher congestion band, not for every minute.
+        """
+        snapshot = self._snapshot
+        topology = snapshot.topology
+        all_ids = topology['route_ids']
+        if route_ids is None:
+            selected = np.arange(len(all_ids))
+        else:
+            index = {route_id: i for i, route_id in enumerate(all_ids)}
+            selected = np.array([index[route_id] for route_id in route_ids if route_id in index], dtype=np.int64)
+        
+        minutes = np.arange(0, horizon, step)
+        levels = self._congestion_matrix(snapshot, minutes, at)
+        bands = np.digitize(levels, self.CONGESTION_THRESHOLDS, right=True)
+        # A crossing is the first minute, or any minute the band goes up
+        rising = np.zeros_like(bands, dtype=bool)
+        rising[:, 0] = bands[:, 0] > 0
+        rising[:, 1:] = bands[:, 1:] > bands[:, :-1]
+        
+        alternatives = self._alternative_candidates(snapshot)
+        forecasts = {}
+        for r in selected:
+            crossings = []
+            for t in np.flatnonzero(rising[r]):
+                candidates = [(all_ids[other], levels[other, t]) for other in alternatives[r]]
+                crossings.append({
+                    'minute': int(minutes[t]),
+                    'level': self.CONGESTION_LEVELS[bands[r, t]],
+                    'congestion_level': round(float(levels[r, t]), 3),
+                    'alternative_routes': self.suggest_alternatives(all_ids[r], levels[r, t], candidates)
+                })
+            forecasts[all_ids[r]] = {
+                'congestion_level': levels[r].round(3).tolist(),
+                'estimated_delay': (levels[r] * 10).round(1).tolist(),
+                'peak_level': self.CONGESTION_LEVELS[bands[r].max()] if len(minutes) else 'low',
+                'crossings': crossings
+            }
+        return {'minutes': minutes.tolist(), 'routes': forecasts}
+    
+    def _congestion_matrix(self, snapshot, minutes, at=None):
+        topology = snapshot.topology
+        route_count = len(topology['route_ids'])
+        counts, utilization, delay, _ = snapshot.route_aggregates()
+        counts = np.maximum(counts, 1)
+        
+        terminals = topology['route_terminals']
+        waiting = np.zeros(route_count)
+        if len(snapshot.stop_waiting):
+            waiting = np.where(terminals >= 0, snapshot.stop_waiting[np.maximum(terminals, 0)], 0).sum(axis=1)
+        seats = np.maximum(topology['route_capacity'] * counts, 1)
+        
+        current = (0.5 * utilization + 0.3 * np.clip(delay / 10, 0, 1)
+                   + 0.2 * np.clip(waiting / seats, 0, 1))
+        
+        # Demand relative to now, damped: congestion lags and flattens demand
+        now = datetime.fromtimestamp(at if at is not None else snapshot.timestamp)
+        hours = (now.hour + now.minute / 60 + minutes / 60) % 24
+        profile = TransitEventSimulator.HOURLY_PROFILE
+        demand = np.interp(hours, np.arange(25), np.append(profile, profile[0]))
+        trend = np.sqrt(demand / max(demand[0], 1e-6)) if len(minutes) else demand
+        return np.clip(current[:, None] * trend[None, :], 0, 1)
+    
+    def _alternative_candidates(self, snapshot):
+        """Per route, the other routes that serve either of its terminals (cached per network)"""
+        cached = self._alternatives
+        if cached is not None and cached[0] == snapshot.epoch:
+            return cached[1]
+        terminals = snapshot.topology['route_terminals'].tolist()
+        by_stop = {}
+        for r, ends in enumerate(terminals):
+            for stop in set(ends) - {-1}:
+                by_stop.setdefault(stop, []).append(r)
+        candidates = []
+        for r, (start, end) in enumerate(terminals):
+            nearby = set(by_stop.get(start, [])) | set(by_stop.get(end, []))
+            nearby.discard(r)
+            candidates.append(sorted(nearby))
+        self._alternatives = (snapshot.epoch, candidates)
+        return candidates
     
     def predict_congestion(self, route_id, time_horizon=30):
         """Predict congestion levels for the next time_horizon minutes"""
-        base_congestion = random.uniform(0.3, 0.8)
-        predictions = []
+        forecast = self.forecast_congestion([route_id], horizon=time_horizon)['routes'].get(route_id)
+        if forecast is None:
+            return None
         
-        for minute in range(time_horizon):
-            # Simulate congestion patterns
-            congestion_factor = base_congestion + 0.2 * np.sin(minute / 10) + random.uniform(-0.1, 0.1)
-            congestion_factor = max(0, min(1, congestion_factor))
-            
+        predictions = []
+        crossings = {crossing['minute']: crossing for crossing in forecast['crossings']}
+        alternatives = []
+        for minute, level, delay in zip(range(time_horizon), forecast['congestion_level'],
+                                        forecast['estimated_delay']):
+            if minute in crossings:
+                alternatives = crossings[minute]['alternative_routes']
+            elif level <= self.CONGESTION_THRESHOLDS[0]:
+                alternatives = []
             predictions.append({
                 'time': minute,
-                'congestion_level': congestion_factor,
-                'estimated_delay': congestion_factor * 10,
-                'alternative_routes': self.suggest_alternatives(route_id, congestion_factor)
+                'congestion_level': level,
+                'estimated_delay': delay,
+                'alternative_routes': alternatives
             })
         
         return predictions
     
-    def suggest_alternatives(self, route_id, congestion_level):
-        """Suggest alternative routes based on congestion"""
-        if congestion_level > 0.7:
-            return ['Alternative Route A', 'Alternative Route B']
-        elif congestion_level > 0.5:
-            return ['Alternative Route A']
-        return []
+    def suggest_alternatives(self, route_id, congestion_level, candidates=None):
+        """Suggest alternative routes based on congestion
+        
+        ``candidates`` are (route_id, congestion_level) pairs for routes
+        sharing a terminal; the least congested ones that beat this route
+        are returned.
+        """
+        count = 2 if congestion_level > 0.7 else 1 if congestion_level > 0.5 else 0
+        if candidates is None:
+            return ['Alternative Route A', 'Alternative Route B'][:count]
+        better = sorted((level, other) for other, level in candidates if level < congestion_level)
+        return [other for _, other in better[:count]]
+
+def _as_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('nan')
+
+def _as_count(value):
+    """Non-negative integer count; ValueError for negative, fractional, infinite or non-numeric values"""
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value) \
+            or value < 0 or value != int(value):
+        raise ValueError(f'Invalid count {value!r}')
+    return int(value)
+
+def _as_finite(value):
+    """float of a finite number; ValueError for NaN, infinities and non-numeric values"""
+    value = float(value)
+    if not math.isfinite(value):
+        raise ValueError(f'Invalid value {value!r}')
+    return value
 
 class IoTDataProcessor:
-    """IoT and Edge Computing integration for smart infrastructure"""
+    """IoT and Edge Computing integration for smart infrastructure
     
-    def __init__(self):
+    Recent readings are kept in a bounded ring (``stream_size``), and
+    sliding-window aggregates over all readings, each sensor type and each
+    sensor are updated as readings arrive, so summaries never scan the
+    stream and memory stays flat under continuous ingest. Long-term history
+    goes to an optional compressed ``series`` store (SensorSeriesStore), and
+    each numeric field is scored by the optional ``anomalies`` detector
+    (StreamingAnomalyDetector) as it is recorded. Passenger counts from
+    counters with a known nearest stop go to the optional ``demand`` trainer
+    (OnlineDemandTrainer).
+    """
+    
+    # Windows (seconds) kept for all readings and per sensor type; sensors
+    # keep only the SENSOR_WINDOW
+    WINDOWS = (60, 300, 3600)
+    SENSOR_WINDOW = 300
+    # Readings timestamped further ahead of the server clock are rejected
+    MAX_CLOCK_SKEW = 60
+    
+    def __init__(self, stream_size=10000, series=None, anomalies=None, demand=None):
         self.sensors = {}
         self.edge_devices = {}
-        self.data_stream = []
+        self.data_stream = deque(maxlen=stream_size)
+        self.readings_total = 0
+        self.type_counts = defaultdict(int)
+        self.active_sensors = 0
+        self.windows = {window: WindowAggregate(window) for window in self.WINDOWS}
+        self.type_windows = defaultdict(lambda: {window: WindowAggregate(window) for window in self.WINDOWS})
+        self.sensor_windows = WindowTable(self.SENSOR_WINDOW, buckets=5)
+        self.series = series
+        self.anomalies = anomalies
+        self.demand = demand
+        # Registry index for batch validation: sensor id -> position, and
+        # each position's sensor type code
+        self._sensor_ids = []
+        self._sensor_index = {}
+        self._sensor_type_codes = np.zeros(0, dtype=np.int64)
+        self._type_names = []
+        self._type_codes = {}
+        # Enrichment: sensor (lat, lon) and cached nearest stop (-2 = not yet known)
+        self._sensor_coords = np.zeros((0, 2))
+        self._sensor_nearest = np.zeros(0, dtype=np.int64)
+        self._stops = ([], np.zeros((0, 2)))
+        self._lock = threading.Lock()
     
     def register_sensor(self, sensor_id, sensor_type, location):
         """Register IoT sensor"""
-        self.sensors[sensor_id] = {
-            'type': sensor_type,
-            'location': location,
-            'status': 'active',
-            'last_reading': None
-        }
+        with self._lock:
+            previous = self.sensors.get(sensor_id)
+            if previous is not None:
+                self.type_counts[previous['type']] -= 1
+                if not self.type_counts[previous['type']]:
+                    del self.type_counts[previous['type']]
+                self.active_sensors -= previous['status'] == 'active'
+            self.sensors[sensor_id] = {
+                'type': sensor_type,
+                'location': location,
+                'status': 'active',
+                'last_reading': previous['last_reading'] if previous else None
+            }
+            self.type_counts[sensor_type] += 1
+            self.active_sensors += 1
+            if sensor_type not in self._type_codes:
+                self._type_codes[sensor_type] = len(self._type_names)
+                self._type_names.append(sensor_type)
+            position = self._sensor_index.get(sensor_id)
+            if position is None:
+                position = self._sensor_index[sensor_id] = len(self._sensor_ids)
+                self._sensor_ids.append(sensor_id)
+                if position >= len(self._sensor_type_codes):
+                    self._grow_registry(max(64, 2 * position))
+            self._sensor_type_codes[position] = self._type_codes[sensor_type]
+            location = location if isinstance(location, dict) else {}
+            self._sensor_coords[position] = (_as_float(location.get('lat')), _as_float(location.get('lon')))
+            self._sensor_nearest[position] = -2
+            if previous is None or previous['type'] != sensor_type:
+                self.sensor_windows.reset(position)
     
-    def process_sensor_data(self, sensor_id, data):
+    def _grow_registry(self, size):
+        def grown(array, fill):
+            bigger = np.full((size,) + array.shape[1:], fill, dtype=array.dtype)
+            bigger[:len(array)] = array
+            return bigger
+        
+        self._sensor_type_codes = grown(self._sensor_type_codes, 0)
+        self._sensor_coords = grown(self._sensor_coords, np.nan)
+        self._sensor_nearest = grown(self._sensor_nearest, -2)
+    
+    def process_sensor_data(self, sensor_id, data, timestamp=None):
         """Process incoming sensor data"""
-        if sensor_id in self.sensors:
-            processed_data = {
-                'sensor_id': sensor_id,
-                'timestamp': time.time(),
-                'data': data,
-                'processed': True
+        sensor = self.sensors.get(sensor_id)
+        if sensor is None:
+            return None
+        processed_data = {
+            'sensor_id': sensor_id,
+            'timestamp': time.time() if timestamp is None else timestamp,
+            'data': data,
+            'processed': True,
+            'location': sensor['location']
+        }
+        stop_ids = self._stops[0]
+        if stop_ids:
+            nearest = int(self._nearest_stops(np.array([self._sensor_index[sensor_id]]))[0])
+            if 0 <= nearest < len(stop_ids):
+                processed_data['nearest_stop'] = stop_ids[nearest]
+        self._record(sensor_id, sensor, processed_data)
+        metrics.IOT_READINGS.inc(sensor_type=sensor['type'])
+        return processed_data
+    
+    def _record(self, sensor_id, sensor, reading):
+        timestamp = reading['timestamp']
+        fields = numeric_fields(reading['data'])
+        with self._lock:
+            self.data_stream.append(reading)
+            self.readings_total += 1
+            sensor['last_reading'] = reading
+            for aggregate in self.windows.values():
+                aggregate.add(timestamp, fields)
+            for aggregate in self.type_windows[sensor['type']].values():
+                aggregate.add(timestamp, fields)
+            self.sensor_windows.add(self._sensor_index[sensor_id], timestamp, fields)
+        if self.series is not None:
+            self.series.append(sensor_id, timestamp, fields)
+        if self.anomalies is not None:
+            for field, value in fields.items():
+                self.anomalies.observe_value('sensor', sensor_id, field, value, timestamp)
+        if self.demand is not None and sensor['type'] == 'passenger_counter' and 'count' in fields \
+                and reading.get('nearest_stop') is not None:
+            self.demand.observe_value(reading['nearest_stop'], timestamp, fields['count'])
+    
+    def ingest_batch(self, readings, now=None):
+        """Validate, enrich and record a batch of {sensor_id, timestamp, data} readings
+        
+        Returns received / accepted / rejected counts and rejections by reason.
+        """
+        return self.record_batch(self.enrich_batch(self.validate_batch(readings, now)))
+    
+    def validate_batch(self, readings, now=None):
+        """Check a batch against the sensor registry; returns the accepted rows for enrich/record
+        
+        Checks run over the whole batch at once instead of reading by reading.
+        """
+        now = time.time() if now is None else now
+        count = len(readings)
+        index = self._sensor_index
+        is_reading = np.fromiter((isinstance(reading, dict) for reading in readings), dtype=bool, count=count)
+        readings = [reading if ok else {} for reading, ok in zip(readings, is_reading)]
+        
+        sensor_ids = [reading.get('sensor_id') for reading in readings]
+        try:
+            positions = [index.get(sensor_id, -1) for sensor_id in sensor_ids]
+        except TypeError:  # unhashable ids
+            positions = [index.get(sensor_id, -1) if isinstance(sensor_id, str) else -1 for sensor_id in sensor_ids]
+        positions = np.array(positions, dtype=np.int64)
+        
+        timestamps = [reading.get('timestamp', now) for reading in readings]
+        try:
+            timestamps = np.array(timestamps, dtype=np.float64)
+        except (TypeError, ValueError):
+            timestamps = np.array([_as_float(value) for value in timestamps], dtype=np.float64)
+        
+        data = [reading.get('data') for reading in readings]
+        has_data = np.fromiter((isinstance(values, dict) for values in data), dtype=bool, count=count)
+        
+        checks = [
+            ('invalid_reading', is_reading),
+            ('unknown_sensor', positions >= 0),
+            ('invalid_timestamp', np.isfinite(timestamps) & (timestamps <= now + self.MAX_CLOCK_SKEW)),
+            ('invalid_data', has_data)
+        ]
+        accepted = np.ones(count, dtype=bool)
+        rejections = {}
+        for reason, ok in checks:
+            failed = accepted & ~ok
+            if failed.any():
+                rejections[reason] = int(failed.sum())
+                accepted &= ok
+        
+        for reason, rejected in rejections.items():
+            metrics.IOT_READINGS_REJECTED.inc(rejected, reason=reason)
+        
+        rows = np.flatnonzero(accepted)
+        row_list = rows.tolist()
+        return {
+            'received': count,
+            'rejections': rejections,
+            'positions': positions[rows],
+            'timestamps': timestamps[rows],
+            'sensor_ids': [sensor_ids[row] for row in row_list],
+            'data': [data[row] for row in row_list]
+        }
+    
+    def set_stops(self, stop_ids, latitudes, longitudes):
+        """Stops used to tag readings with the sensor's nearest stop"""
+        coords = np.column_stack([np.asarray(latitudes, dtype=np.float64),
+                                  np.asarray(longitudes, dtype=np.float64)]).reshape(-1, 2)
+        with self._lock:
+            self._stops = (list(stop_ids), coords)
+            self._sensor_nearest[:] = -2
+    
+    def _nearest_stops(self, positions):
+        """Nearest stop index per sensor position (-1 when unknown), computed once per sensor"""
+        nearest = self._sensor_nearest
+        missing = np.unique(positions[nearest[positions] == -2])
+        if len(missing):
+            coords = self._sensor_coords[missing]
+            stops = self._stops[1]
+            if len(stops):
+                # Equirectangular distance is plenty at city scale
+                scale = np.cos(np.radians(coords[:, :1]))
+                distance = (coords[:, :1] - stops[:, 0]) ** 2 + ((coords[:, 1:] - stops[:, 1]) * scale) ** 2
+                found = np.where(np.isnan(distance).all(axis=1), -1,
+                                 np.nanargmin(np.where(np.isnan(distance), np.inf, distance), axis=1))
+            else:
+                found = np.full(len(missing), -1)
+            nearest[missing] = found
+        return nearest[positions]
+    
+    def sensor_stops(self):
+        """Nearest stop id of every registered sensor (None when unknown)"""
+        with self._lock:
+            stop_ids = self._stops[0]
+            nearest = self._nearest_stops(np.arange(len(self._sensor_ids))).tolist()
+        return [stop_ids[i] if 0 <= i < len(stop_ids) else None for i in nearest]
+    
+    def enrich_batch(self, batch):
+        """Attach each accepted reading's sensor location and nearest stop"""
+        positions = batch['positions']
+        batch['nearest_stops'] = self._nearest_stops(positions) if len(positions) else positions
+        return batch
+    
+    def record_batch(self, batch):
+        """Store a validated (and optionally enriched) batch and update the window aggregates
+        
+        Aggregates are updated once per (scope, time bucket) cell rather than
+        per reading.
+        """
+        count = len(batch['positions'])
+        if count:
+            self._record_batch(batch)
+        return {
+            'received': batch['received'],
+            'accepted': count,
+            'rejected': batch['received'] - count,
+            'rejections': batch['rejections']
+        }
+    
+    def _record_batch(self, batch):
+        positions, timestamps, sensor_ids, data = batch['positions'], batch['timestamps'], batch['sensor_ids'], batch['data']
+        count = len(positions)
+        # Numeric fields as columns of (position in the batch, value); one
+        # pass per field name instead of per value
+        columns = {}
+        for field in set().union(*map(dict.keys, data)):
+            values = np.array([value if type(value) in (int, float) else np.nan
+                               for value in (values.get(field) for values in data)], dtype=np.float64)
+            present = np.flatnonzero(np.isfinite(values))
+            if len(present):
+                columns[field] = (present, values[present])
+        
+        type_codes = self._sensor_type_codes[positions]
+        no_group = np.zeros(count, dtype=np.int64)
+        updates = []
+        for window in self.WINDOWS:
+            keys = np.floor(timestamps / self.windows[window].width).astype(np.int64)
+            updates.append((window, 'all', list(bucket_stats(no_group, keys, columns, sketches=True))))
+            updates.append((window, 'type', list(bucket_stats(type_codes, keys, columns, sketches=True))))
+        sensor_cells = bucket_cells(positions, np.floor(timestamps / self.sensor_windows.width).astype(np.int64),
+                                    columns)
+        
+        # Only the newest readings stay in the bounded stream, and only each
+        # sensor's newest reading becomes its last_reading
+        first = max(0, count - self.data_stream.maxlen) if self.data_stream.maxlen is not None else 0
+        timestamp_list = timestamps.tolist()
+        stop_ids = self._stops[0]
+        nearest = batch.get('nearest_stops')
+        nearest = nearest.tolist() if nearest is not None else [-1] * count
+        
+        sensors = self.sensors
+        
+        def processed(i):
+            reading = {'sensor_id': sensor_ids[i], 'timestamp': timestamp_list[i], 'data': data[i], 'processed': True}
+            sensor = sensors.get(sensor_ids[i])
+            if sensor is not None:
+                reading['location'] = sensor['location']
+            if 0 <= nearest[i] < len(stop_ids):
+                reading['nearest_stop'] = stop_ids[nearest[i]]
+            return reading
+        
+        recent = [processed(i) for i in range(first, count)]
+        unique, last = np.unique(positions[::-1], return_index=True)
+        last = (count - 1 - last).tolist()
+        
+        with self._lock:
+            self.data_stream.extend(recent)
+            self.readings_total += count
+            for position, i in zip(unique.tolist(), last):
+                sensor = sensors.get(self._sensor_ids[position])
+                if sensor is not None:
+                    sensor['last_reading'] = processed(i)
+            for window, scope, cells in updates:
+                for group, key, cell_count, fields, sketches in cells:
+                    if scope == 'all':
+                        self.windows[window].merge(key, cell_count, fields, sketches)
+                    else:
+                        self.type_windows[self._type_names[group]][window].merge(key, cell_count, fields, sketches)
+            self.sensor_windows.merge(*sensor_cells)
+        if self.series is not None:
+            self.series.append_batch(sensor_ids, timestamps, columns)
+        if self.anomalies is not None:
+            for field, (present, values) in columns.items():
+                self.anomalies.observe('sensor', positions[present], field, values, timestamps[present],
+                                       self._sensor_ids)
+        counter = self._type_codes.get('passenger_counter')
+        nearest_stops = batch.get('nearest_stops')
+        if self.demand is not None and counter is not None and 'count' in columns and nearest_stops is not None:
+            present, values = columns['count']
+            stops = nearest_stops[present]
+            counted = (type_codes[present] == counter) & (stops >= 0) & (stops < len(stop_ids))
+            if counted.any():
+                self.demand.observe(stops[counted], timestamps[present][counted], values[counted], stop_ids)
+        
+        for code, readings in enumerate(np.bincount(type_codes, minlength=len(self._type_names)).tolist()):
+            if readings:
+                metrics.IOT_READINGS.inc(readings, sensor_type=self._type_names[code])
+    
+    def register_edge_device(self, edge_id, sensors=None, location=None):
+        """Register an edge node that pre-aggregates readings for ``sensors``"""
+        with self._lock:
+            previous = self.edge_devices.get(edge_id, {})
+            self.edge_devices[edge_id] = {
+                'sensors': list(sensors or []),
+                'location': location,
+                'status': 'active',
+                'summaries': previous.get('summaries', 0),
+                'cells': previous.get('cells', 0),
+                'readings': previous.get('readings', 0),
+                'last_summary': previous.get('last_summary')
             }
-            self.data_stream.append(processed_data)
-            self.sensors[sensor_id]['last_reading'] = processed_data
-            return processed_data
-        return None
+            return self.edge_devices[edge_id]
+    
+    def merge_edge_summary(self, payload, now=None):
+        """Merge an edge node's summary cells (see iot_edge.EdgeAggregator) instead of raw readings
+        
+        Each cell is merged into the window buckets holding its start time,
+        so window edges are as precise as the edge bucket width.
+        """
+        now = time.time() if now is None else now
+        edge = self.edge_devices.get(payload.get('edge_id'))
+        if edge is None:
+            raise KeyError(f"Unknown edge device {payload.get('edge_id')}")
+        width = _as_float(payload.get('width'))
+        cells = payload.get('cells')
+        if not width > 0 or not isinstance(cells, list):
+            raise ValueError('An edge summary needs a positive width and a list of cells')
+        
+        rejections = defaultdict(int)
+        accepted = []
+        # An edge that registered its sensors may only report for those
+        allowed = set(edge['sensors'])
+        for cell in cells:
+            try:
+                sensor = self.sensors.get(cell['sensor_id'])
+                if sensor is None:
+                    rejections['unknown_sensor'] += 1
+                    continue
+                if allowed and cell['sensor_id'] not in allowed:
+                    rejections['foreign_sensor'] += 1
+                    continue
+                start = float(cell['start'])
+                if not np.isfinite(start) or start > now + self.MAX_CLOCK_SKEW:
+                    rejections['invalid_timestamp'] += 1
+                    continue
+                count = _as_count(cell['count'])
+                fields = {field: (_as_finite(total), _as_count(present), _as_finite(low), _as_finite(high))
+                          for field, (total, present, low, high) in cell.get('fields', {}).items()}
+                if any(present > count for _, present, _, _ in fields.values()):
+                    raise ValueError('A field has more values than the cell has readings')
+                sketches = {field: QuantileSketch.from_dict({code: _as_count(n) for code, n in bins.items()})
+                            for field, bins in cell.get('sketches', {}).items()}
+                accepted.append((cell['sensor_id'], sensor, start, count, fields, sketches))
+            except (KeyError, TypeError, ValueError, OverflowError, AttributeError):
+                rejections['invalid_cell'] += 1
+        
+        readings = 0
+        type_readings = defaultdict(int)
+        # The per-sensor table needs one entry per (sensor, window bucket)
+        sensor_cells = {}
+        with self._lock:
+            for sensor_id, sensor, start, count, fields, sketches in accepted:
+                for aggregate in self.windows.values():
+                    aggregate.merge(int(start // aggregate.width), count, fields, sketches)
+                for aggregate in self.type_windows[sensor['type']].values():
+                    aggregate.merge(int(start // aggregate.width), count, fields, sketches)
+                cell_key = (self._sensor_index[sensor_id], int(start // self.sensor_windows.width))
+                merged = sensor_cells.setdefault(cell_key, [0, {}])
+                merged[0] += count
+                for field, (total, present, low, high) in fields.items():
+                    stats = merged[1].setdefault(field, [0.0, 0, np.inf, -np.inf])
+                    stats[0] += total
+                    stats[1] += present
+                    stats[2] = min(stats[2], low)
+                    stats[3] = max(stats[3], high)
+                if sensor['last_reading'] is None or sensor['last_reading']['timestamp'] <= start + width:
+                    sensor['last_reading'] = {
+                        'sensor_id': sensor_id,
+                        'timestamp': start + width,
+                        'data': {field: round(total / present, 4) for field, (total, present, _, _) in fields.items()
+                                 if present},
+                        'processed': True,
+                        'edge_id': payload['edge_id'],
+                        'aggregated_readings': count
+                    }
+                readings += count
+                type_readings[sensor['type']] += count
+            
+            if sensor_cells:
+                names = sorted(set().union(*(fields for _, fields in sensor_cells.values())))
+                rows = np.array([row for row, _ in sensor_cells], dtype=np.int64)
+                keys = np.array([key for _, key in sensor_cells], dtype=np.int64)
+                counts = np.array([count for count, _ in sensor_cells.values()], dtype=np.int64)
+                empty = [0.0, 0, np.inf, -np.inf]
+                self.sensor_windows.merge(rows, keys, counts, {
+                    name: tuple(np.array(column) for column in
+                                zip(*(fields.get(name, empty) for _, fields in sensor_cells.values())))
+                    for name in names
+                })
+            self.readings_total += readings
+            edge['summaries'] += 1
+            edge['cells'] += len(accepted)
+            edge['readings'] += readings
+            edge['last_summary'] = now
+        
+        for sensor_type, count in type_readings.items():
+            metrics.IOT_READINGS.inc(count, sensor_type=sensor_type)
+        metrics.IOT_EDGE_CELLS.inc(len(accepted))
+        for reason, count in rejections.items():
+            metrics.IOT_READINGS_REJECTED.inc(count, reason=reason)
+        return {
+            'cells': len(cells),
+            'merged': len(accepted),
+            'readings': readings,
+            'rejected': len(cells) - len(accepted),
+            'rejections': dict(rejections)
+        }
+    
+    def recent_readings(self, limit=10):
+        """Newest ``limit`` readings, oldest first"""
+        with self._lock:
+            count = min(limit, len(self.data_stream))
+            return [self.data_stream[-i] for i in range(count, 0, -1)]
+    
+    def sensor_history(self, sensor_id, start=None, end=None, resolution=None, fields=None, limit=10000):
+        """A sensor's stored readings in [start, end], raw or rolled up to ``resolution`` seconds"""
+        if sensor_id not in self.sensors:
+            raise KeyError(f'Unknown sensor {sensor_id}')
+        if self.series is None:
+            raise ValueError('Sensor history is not enabled')
+        if resolution is not None:
+            return self.series.rollup(sensor_id, resolution, start, end, fields)[-limit:]
+        timestamps, columns = self.series.read(sensor_id, start, end, fields)
+        timestamps = timestamps[-limit:].tolist()
+        columns = {field: values[-limit:].tolist() for field, values in columns.items()}
+        return [
+            {'timestamp': timestamp,
+             'data': {field: values[i] for field, values in columns.items() if values[i] == values[i]}}
+            for i, timestamp in enumerate(timestamps)
+        ]
     
     def simulate_iot_data(self):
         """Simulate IoT sensor data"""
@@ -216,12 +2014,31 @@ class IoTDataProcessor:
     
     def get_sensor_summary(self):
         """Get summary of all IoT sensors"""
-        return {
-            'total_sensors': len(self.sensors),
-            'active_sensors': len([s for s in self.sensors.values() if s['status'] == 'active']),
-            'sensor_types': list(set(s['type'] for s in self.sensors.values())),
-            'recent_readings': len([d for d in self.data_stream if time.time() - d['timestamp'] < 300])
-        }
+        now = time.time()
+        with self._lock:
+            return {
+                'total_sensors': len(self.sensors),
+                'active_sensors': self.active_sensors,
+                'sensor_types': list(self.type_counts),
+                'recent_readings': self.windows[300].summary(now)['count'],
+                'total_readings': self.readings_total
+            }
+    
+    def window_summary(self, window=300, sensor_type=None, sensor_id=None):
+        """Sliding-window count, rate and field statistics for all readings, one type or one sensor"""
+        now = time.time()
+        with self._lock:
+            if sensor_id is not None:
+                if sensor_id not in self._sensor_index:
+                    raise KeyError(f'Unknown sensor {sensor_id}')
+                return self.sensor_windows.summary(self._sensor_index[sensor_id], now)
+            if window not in self.WINDOWS:
+                raise ValueError(f'window must be one of {self.WINDOWS}')
+            if sensor_type is not None:
+                if sensor_type not in self.type_windows:
+                    raise KeyError(f'No readings for sensor type {sensor_type}')
+                return self.type_windows[sensor_type][window].summary(now)
+            return self.windows[window].summary(now)
 
 class SocialImpactAnalyzer:
     """Social Impact Analytics for sustainable transport"""
@@ -277,7 +2094,7 @@ class GamificationEngine:
     def __init__(self):
         self.user_profiles = {}
         self.challenges = []
-        self.leaderboard = []
+        self.leaderboard = Leaderboard()
         self.achievements = {}
     
     def create_user_profile(self, user_id, name):
@@ -291,6 +2108,7 @@ class GamificationEngine:
             'co2_saved': 0,
             'challenges_completed': 0
         }
+        self.leaderboard.update(user_id, 0)
     
     def add_trip_points(self, user_id, trip_data):
         """Award points for sustainable transport trips"""
@@ -313,6 +2131,7 @@ class GamificationEngine:
         self.user_profiles[user_id]['points'] += total_points
         self.user_profiles[user_id]['trips_taken'] += 1
         self.user_profiles[user_id]['co2_saved'] += trip_data.get('co2_saved', 2.5)
+        self.leaderboard.update(user_id, self.user_profiles[user_id]['points'])
         
         # Check for level up
         self.check_level_up(user_id)
@@ -328,25 +2147,32 @@ class GamificationEngine:
             profile['level'] = new_level
             profile['badges'].append(f"Level {new_level} Achiever")
     
-    def get_leaderboard(self, limit=10):
-        """Get top users leaderboard"""
-        sorted_users = sorted(
-            self.user_profiles.items(),
-            key=lambda x: x[1]['points'],
-            reverse=True
-        )[:limit]
-        
-        return [
-            {
-                'rank': i + 1,
+    def _entries(self, entries):
+        result = []
+        for rank, user_id, points in entries:
+            profile = self.user_profiles[user_id]
+            result.append({
+                'rank': rank,
                 'user_id': user_id,
                 'name': profile['name'],
-                'points': profile['points'],
+                'points': points,
                 'level': profile['level'],
                 'trips': profile['trips_taken']
-            }
-            for i, (user_id, profile) in enumerate(sorted_users)
-        ]
+            })
+        return result
+    
+    def get_leaderboard(self, limit=10, offset=0):
+        """Get top users leaderboard"""
+        return self._entries(self.leaderboard.top(limit, offset))
+    
+    def get_rank(self, user_id, radius=0):
+        """Rank of a user and the ``radius`` users ranked directly above and below; KeyError if unknown"""
+        return {
+            'user_id': user_id,
+            'rank': self.leaderboard.rank(user_id),
+            'total_users': len(self.leaderboard),
+            'neighbors': self._entries(self.leaderboard.around(user_id, radius)) if radius else []
+        }
     
     def create_challenges(self):
         """Create weekly challenges"""
@@ -450,105 +2276,91 @@ class VoiceAssistant:
 class AdvancedAnalytics:
     """Advanced AI-powered analytics and predictions"""
     
-    def __init__(self):
+    def __init__(self, anomaly_detector=None, demand_forecaster=None):
         self.predictive_models = {}
-        self.anomaly_detector = None
+        self.anomaly_detector = anomaly_detector
+        self.demand_forecaster = demand_forecaster
         self.optimization_engine = None
     
-    def train_demand_prediction_model(self, historical_data):
-        """Train ML model for demand prediction using available libraries"""
-        if HAS_ADVANCED_ML:
-            # Use MLPRegressor as a simpler alternative to LSTM
-            model = MLPRegressor(
-                hidden_layer_sizes=(50, 25),
-                max_iter=100,
-                random_state=42
-            )
-            
-            # Generate sample training data
-            X_train = np.random.random((1000, 24))
-            y_train = np.random.random((1000,))
-            
-            model.fit(X_train, y_train)
-            self.predictive_models['demand'] = model
-            return model
-        else:
-            # Fallback to simple statistical model
-            self.predictive_models['demand'] = 'statistical_model'
-            return 'statistical_model'
+    def train_demand_prediction_model(self, historical_data=None):
+        """Train the per-stop hourly demand model (on ``historical_data``, a stops table, if given)"""
+        if self.demand_forecaster is None:
+            self.demand_forecaster = DemandForecaster()
+        model = self.demand_forecaster.fit(historical_data)
+        self.predictive_models['demand'] = model
+        return model
     
-    def predict_future_demand(self, current_data, hours_ahead=24):
-        """Predict passenger demand for next hours_ahead hours"""
-        if 'demand' not in self.predictive_models:
-            return None
-        
-        # Generate predictions
-        predictions = []
-        for hour in range(hours_ahead):
-            # Simplified prediction
-            base_demand = random.uniform(500, 2000)
-            time_factor = 1 + 0.3 * np.sin(hour * 2 * np.pi / 24)  # Daily pattern
-            predicted_demand = base_demand * time_factor
-            
-            predictions.append({
-                'hour': hour,
-                'predicted_demand': round(predicted_demand),
-                'confidence': random.uniform(0.7, 0.95)
-            })
+    def predict_future_demand(self, current_data=None, hours_ahead=24, stop_ids=None, start=None):
+        """Predict passengers per stop for the next ``hours_ahead`` hours
         
-        return predictions
+        One model call covers every (stop, hour); see DemandForecaster.predict.
+        """
+        if self.demand_forecaster is None or not self.demand_forecaster.fitted:
+            return None
+        return self.demand_forecaster.predict(stop_ids, hours_ahead, start)
     
-    def detect_anomalies(self, current_data):
-        """Detect anomalies in transport network"""
-        anomalies = []
-        
-        # Simulate anomaly detection
-        for route in current_data.get('routes', []):
-            if random.random() < 0.1:  # 10% chance of anomaly
-                anomaly_type = random.choice(['delay', 'overcrowding', 'breakdown'])
-                anomalies.append({
-                    'route_id': route.get('route_id', 'unknown'),
-                    'type': anomaly_type,
-                    'severity': random.choice(['low', 'medium', 'high']),
-                    'description': f"Detected {anomaly_type} on route",
-                    'timestamp': time.time()
-                })
+    def detect_anomalies(self, current_data=None, limit=50, scope=None, entity_id=None, since=None):
+        """Recent anomalies from the streaming detector
         
-        return anomalies
+        Route anomalies are limited to the routes in ``current_data`` when it
+        lists any; sensor anomalies are always included.
+        """
+        if self.anomaly_detector is None:
+            return []
+        anomalies = self.anomaly_detector.recent_anomalies(
+            limit=self.anomaly_detector.recent.maxlen, scope=scope, entity_id=entity_id, since=since)
+        routes = {route.get('route_id') for route in (current_data or {}).get('routes', [])}
+        if routes:
+            anomalies = [anomaly for anomaly in anomalies if anomaly['scope'] != 'route' or anomaly['id'] in routes]
+        return anomalies[-limit:] if limit else []
     
-    def generate_real_time_insights(self, network_state):
-        """Generate real-time insights from current network state"""
+    def generate_real_time_insights(self, snapshot, route_limit=5):
+        """Generate real-time insights from a twin snapshot's per-tick aggregates
+        
+        Reads network totals and per-route counts only, so the cost grows with
+        the number of routes rather than the fleet. Routes where most vehicles
+        are crowded or late are reported as hotspots, worst first.
+        """
+        aggregates = snapshot.aggregates()
         insights = []
+        if not aggregates.vehicles:
+            return insights
         
         # Capacity utilization insights
-        if 'vehicles' in network_state:
-            avg_utilization = np.mean([
-                v['capacity_utilization'] 
-                for vehicles in network_state['vehicles'].values() 
-                for v in vehicles
-            ])
-            
-            if avg_utilization > 0.85:
-                insights.append({
-                    'type': 'capacity_warning',
-                    'message': f"High capacity utilization detected: {avg_utilization:.1%}",
-                    'action': 'Consider deploying additional vehicles'
-                })
+        if aggregates.capacity_streak:
+            insights.append({
+                'type': 'capacity_warning',
+                'message': f"High capacity utilization detected: {aggregates.avg_utilization:.1%}",
+                'action': 'Consider deploying additional vehicles',
+                'ticks': aggregates.capacity_streak
+            })
         
         # Delay insights
-        if 'vehicles' in network_state:
-            delays = [
-                v['delay_minutes'] 
-                for vehicles in network_state['vehicles'].values() 
-                for v in vehicles
-            ]
-            avg_delay = np.mean(delays)
-            
-            if avg_delay > 5:
+        if aggregates.delay_streak:
+            insights.append({
+                'type': 'delay_warning',
+                'message': f"Average delay: {aggregates.avg_delay:.1f} minutes",
+                'action': 'Investigate traffic conditions and adjust schedules',
+                'ticks': aggregates.delay_streak
+            })
+        
+        route_ids = snapshot.topology['route_ids']
+        safe = np.maximum(aggregates.counts, 1)
+        hotspots = (
+            ('route_capacity_warning', aggregates.crowded, 'crowded', 'Add vehicles or increase frequency'),
+            ('route_delay_warning', aggregates.late, f'over {aggregates.LATE_MINUTES:g} minutes late', 'Check traffic on the route')
+        )
+        for kind, breaches, label, action in hotspots:
+            share = breaches / safe
+            for r in np.argsort(-share, kind='stable')[:route_limit]:
+                if share[r] <= 0.5:
+                    break
                 insights.append({
-                    'type': 'delay_warning',
-                    'message': f"Average delay: {avg_delay:.1f} minutes",
-                    'action': 'Investigate traffic conditions and adjust schedules'
+                    'type': kind,
+                    'route_id': route_ids[r],
+                    'message': f"{int(breaches[r])} of {int(aggregates.counts[r])} vehicles on route "
+                               f"{route_ids[r]} {label}",
+                    'action': action
                 })
         
         return insights
@@ -0,0 +1,370 @@
+"""
+Streaming anomaly detection for sensor readings and vehicle delays.
+
+Every series (a sensor field, or a route's vehicle delays) keeps constant-
+size running statistics in NumPy arrays:
+
+    baseline   Welford count / mean / M2 over all normal values, plus the
+               same per hour of day (UTC, which is Accra local time)
+    level      EWMA mean and variance, which follow recent drift
+
+A value is scored against its hour-of-day baseline once that hour has seen
+``warmup`` values (the overall baseline before that) and against the EWMA
+level. It is anomalous when both z-scores exceed ``threshold``, so a lasting
+shift stops alerting once the level has caught up. Values are scored before
+they update the statistics, and anomalous values are kept out of the
+baselines. A batch of values costs a few array operations, with no
+recomputation over history.
+
+Each series alerts at most once per ``cooldown`` seconds. Alerts are kept
+in a bounded list and passed to subscribers (``subscribe(callback)``).
+"""
+
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+import metrics
+
+HOURS = 24
+
+
+def _merge(count, mean, m2, index, n, batch_mean, batch_m2):
+    """Chan et al. parallel Welford merge of grouped batch statistics into arrays"""
+    previous = count[index]
+    total = previous + n
+    delta = batch_mean - mean[index]
+    mean[index] += delta * n / total
+    m2[index] += batch_m2 + delta ** 2 * previous * n / total
+    count[index] = total
+
+
+def _by_row(rows, n, means, m2):
+    """Combine grouped statistics of consecutive equal (sorted) rows"""
+    starts = np.flatnonzero(np.concatenate(([True], rows[1:] != rows[:-1])))
+    if len(starts) == len(rows):
+        return rows, n, means, m2
+    total = np.add.reduceat(n, starts)
+    mean = np.add.reduceat(n * means, starts) / total
+    spread = m2 + n * (means - np.repeat(mean, np.diff(np.append(starts, len(rows))))) ** 2
+    return rows[starts], total, mean, np.add.reduceat(spread, starts)
+
+
+class StreamingAnomalyDetector:
+    """Online per-series baselines and z-score anomaly alerts"""
+
+    # Per-series statistics, one row per series (HOUR_ARRAYS: one column per hour)
+    ARRAYS = ('count', 'mean', 'm2', 'ewm_count', 'ewm_mean', 'ewm_var')
+    HOUR_ARRAYS = ('hour_count', 'hour_mean', 'hour_m2')
+
+    def __init__(self, threshold=4.0, alpha=0.05, warmup=30, cooldown=300, recent=500, min_std=1e-3):
+        self.threshold = threshold
+        self.alpha = alpha
+        self.warmup = warmup
+        self.cooldown = cooldown
+        # Standard deviations are floored at max(min_std, 1% of the mean)
+        self.min_std = min_std
+        self.recent = deque(maxlen=recent)
+        self.subscribers = []
+        self.observed = 0
+        self.detected = 0
+        self.suppressed = 0
+        # (scope, name, field) -> row, and each row's key
+        self._index = {}
+        self._series = []
+        # (scope, field) -> (names list the codes refer to, code -> row array)
+        self._codes = {}
+        self._lock = threading.Lock()
+        capacity = 64
+        for name in self.ARRAYS:
+            setattr(self, name, np.zeros(capacity))
+        for name in self.HOUR_ARRAYS:
+            setattr(self, name, np.zeros((capacity, HOURS)))
+        self.last_alert = np.full(capacity, -np.inf)
+
+    def _grow(self, capacity):
+        def grown(array, fill):
+            bigger = np.full((capacity,) + array.shape[1:], fill, dtype=array.dtype)
+            bigger[:len(array)] = array
+            return bigger
+
+        for name in self.ARRAYS + self.HOUR_ARRAYS:
+            setattr(self, name, grown(getattr(self, name), 0.0))
+        self.last_alert = grown(self.last_alert, -np.inf)
+
+    def subscribe(self, callback):
+        """Call ``callback(anomalies)`` with each non-empty list of new anomalies"""
+        self.subscribers.append(callback)
+
+    # -- series rows -------------------------------------------------------
+
+    def _row(self, scope, name, field):
+        key = (scope, name, field)
+        row = self._index.get(key)
+        if row is None:
+            row = self._index[key] = len(self._series)
+            self._series.append(key)
+            if row >= len(self.count):
+                self._grow(2 * len(self.count))
+        return row
+
+    def _rows(self, scope, field, codes, names):
+        """Rows for entity ``codes`` (indexes into ``names``), cached per (scope, field)"""
+        cached = self._codes.get((scope, field))
+        if cached is None or cached[0] is not names:
+            # A different names list (e.g. a re-initialized twin) means the
+            # codes changed meaning; rows are found again by name
+            cached = self._codes[(scope, field)] = [names, np.full(len(names), -1, dtype=np.int64)]
+        table = cached[1]
+        if len(names) > len(table):
+            table = cached[1] = np.concatenate([table, np.full(len(names) - len(table), -1, dtype=np.int64)])
+        rows = table[codes]
+        if (rows < 0).any():
+            for code in np.unique(codes[rows < 0]).tolist():
+                table[code] = self._row(scope, names[code], field)
+            rows = table[codes]
+        return rows
+
+    # -- scoring -----------------------------------------------------------
+
+    def _floor(self, mean):
+        return np.maximum(self.min_std, 0.01 * np.abs(mean))
+
+    def observe(self, scope, codes, field, values, timestamps, names, labels=None):
+        """Score and learn a batch of ``field`` values of entities ``names[codes]``
+
+        ``timestamps`` is one time or one per value; ``labels(i)`` optionally
+        names the source of value ``i`` (e.g. a vehicle id). Returns the new
+        anomalies.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        codes = np.asarray(codes, dtype=np.int64)
+        one_time = np.ndim(timestamps) == 0
+        timestamps = float(timestamps) if one_time else np.asarray(timestamps, dtype=np.float64)
+        positions = np.arange(len(values))
+        finite = np.isfinite(values)
+        if not finite.all():
+            positions = np.flatnonzero(finite)
+            values, codes = values[positions], codes[positions]
+            if not one_time:
+                timestamps = timestamps[positions]
+        if not len(values):
+            return []
+
+        with self._lock:
+            rows = self._rows(scope, field, codes, names)
+            # Group by (series, hour); values that are already in series
+            # order (like twin vehicles) need no sort
+            hours = int(timestamps // 3600 % HOURS) if one_time else (timestamps // 3600 % HOURS).astype(np.int64)
+            keys = rows * HOURS + hours
+            if len(keys) > 1 and (keys[1:] < keys[:-1]).any():
+                order = np.argsort(keys, kind='stable')
+                keys, values, positions = keys[order], values[order], positions[order]
+                if not one_time:
+                    timestamps = timestamps[order]
+            starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+            counts = np.diff(np.append(starts, len(keys)))
+            group_keys = keys[starts]
+            group_rows, group_hours = group_keys // HOURS, group_keys % HOURS
+
+            # Baseline and level per group, then one z-score per value; the
+            # level is only checked for values already off their baseline
+            seasonal = self.hour_count[group_rows, group_hours] >= self.warmup
+            count = np.where(seasonal, self.hour_count[group_rows, group_hours], self.count[group_rows])
+            mean = np.where(seasonal, self.hour_mean[group_rows, group_hours], self.mean[group_rows])
+            m2 = np.where(seasonal, self.hour_m2[group_rows, group_hours], self.m2[group_rows])
+            std = np.maximum(np.sqrt(m2 / np.maximum(count - 1, 1)), self._floor(mean))
+            group_of = np.repeat(np.arange(len(starts)), counts)
+            z = (values - mean[group_of]) / std[group_of]
+            hits = np.flatnonzero(np.abs(z) > self.threshold)
+            if len(hits):
+                group = group_of[hits]
+                level = self.ewm_mean[group_rows[group]]
+                level_std = np.maximum(np.sqrt(self.ewm_var[group_rows[group]]), self._floor(level))
+                hits = hits[(self.count[group_rows[group]] >= self.warmup)
+                            & (np.abs((values[hits] - level) / level_std) > self.threshold)]
+
+            group_mean = np.add.reduceat(values, starts) / counts
+            group_m2 = np.add.reduceat((values - group_mean[group_of]) ** 2, starts)
+            self._learn_level(*_by_row(group_rows, counts, group_mean, group_m2))
+            anomalies = []
+            if len(hits):
+                # Baselines learn from normal values only: take the (few)
+                # anomalous values back out of their groups
+                counts, group_mean, group_m2 = counts.astype(np.float64), group_mean.copy(), group_m2.copy()
+                for group, value in zip(group_of[hits].tolist(), values[hits].tolist()):
+                    n = counts[group] - 1
+                    if n:
+                        previous = group_mean[group]
+                        group_mean[group] = previous - (value - previous) / n
+                        group_m2[group] = max(0.0, group_m2[group] - (value - previous) * (value - group_mean[group]))
+                    else:
+                        group_mean[group] = group_m2[group] = 0.0
+                    counts[group] = n
+                group = group_of[hits]
+                anomalies = self._alerts(
+                    group_rows[group], values[hits],
+                    np.full(len(hits), timestamps) if one_time else timestamps[hits],
+                    z[hits], mean[group], std[group], seasonal[group], positions[hits], labels)
+                learned = counts > 0
+                if not learned.all():
+                    group_keys, counts, group_mean, group_m2 = (
+                        group_keys[learned], counts[learned], group_mean[learned], group_m2[learned])
+            self._learn_baselines(group_keys, counts, group_mean, group_m2)
+            self.observed += len(values)
+        self._notify(scope, anomalies)
+        return anomalies
+
+    def _learn_level(self, rows, n, batch_mean, batch_m2):
+        """EWMA step for each series, a group of n values weighted like n single steps"""
+        first = self.ewm_count[rows] == 0
+        weight = 1 - (1 - self.alpha) ** n
+        delta = batch_mean - self.ewm_mean[rows]
+        self.ewm_var[rows] = np.where(
+            first, batch_m2 / n,
+            (1 - weight) * (self.ewm_var[rows] + weight * delta ** 2) + weight * batch_m2 / n)
+        self.ewm_mean[rows] = np.where(first, batch_mean, self.ewm_mean[rows] + weight * delta)
+        self.ewm_count[rows] += n
+
+    def _learn_baselines(self, keys, n, batch_mean, batch_m2):
+        """Merge grouped (series * HOURS + hour) statistics into the hourly and overall baselines"""
+        if not len(keys):
+            return
+        _merge(self.hour_count.reshape(-1), self.hour_mean.reshape(-1), self.hour_m2.reshape(-1),
+               keys, n, batch_mean, batch_m2)
+        _merge(self.count, self.mean, self.m2, *_by_row(keys // HOURS, n, batch_mean, batch_m2))
+
+    def _alerts(self, rows, values, timestamps, z, mean, std, seasonal, positions, labels):
+        """Alerts for anomalous values (one per series, the strongest), honouring the cooldown"""
+        order = np.lexsort((-np.abs(z), rows))
+        ordered_rows = rows[order]
+        firsts = np.flatnonzero(np.concatenate(([True], ordered_rows[1:] != ordered_rows[:-1])))
+        per_row = np.diff(np.append(firsts, len(order)))
+        anomalies = []
+        for i, hit_count in zip(order[firsts].tolist(), per_row.tolist()):
+            row = int(rows[i])
+            timestamp = float(timestamps[i])
+            if timestamp < self.last_alert[row] + self.cooldown:
+                self.suppressed += hit_count
+                continue
+            self.last_alert[row] = timestamp
+            scope, name, field = self._series[row]
+            score = float(z[i])
+            anomaly = {
+                'scope': scope,
+                'id': name,
+                'field': field,
+                'value': round(float(values[i]), 4),
+                'expected': round(float(mean[i]), 4),
+                'std': round(float(std[i]), 4),
+                'z_score': round(score, 2),
+                'direction': 'high' if score > 0 else 'low',
+                'severity': 'high' if abs(score) >= 2 * self.threshold else 'medium',
+                'baseline': 'hour_of_day' if seasonal[i] else 'overall',
+                'anomalous_values': hit_count,
+                'timestamp': timestamp
+            }
+            if labels is not None:
+                anomaly['source'] = labels(int(positions[i]))
+            anomalies.append(anomaly)
+        self.detected += len(anomalies)
+        self.recent.extend(anomalies)
+        return anomalies
+
+    def observe_value(self, scope, name, field, value, timestamp):
+        """``observe`` for a single value without array overhead"""
+        if value != value or value in (float('inf'), float('-inf')):
+            return []
+        hour = int(timestamp // 3600 % HOURS)
+        with self._lock:
+            row = self._row(scope, name, field)
+            seasonal = self.hour_count[row, hour] >= self.warmup
+            if seasonal:
+                count, mean, m2 = self.hour_count[row, hour], self.hour_mean[row, hour], self.hour_m2[row, hour]
+            else:
+                count, mean, m2 = self.count[row], self.mean[row], self.m2[row]
+            std = max((m2 / max(count - 1, 1)) ** 0.5, self.min_std, 0.01 * abs(mean))
+            z = (value - mean) / std
+            level = self.ewm_mean[row]
+            z_level = (value - level) / max(self.ewm_var[row] ** 0.5, self.min_std, 0.01 * abs(level))
+            anomalous = self.count[row] >= self.warmup and abs(z) > self.threshold and abs(z_level) > self.threshold
+
+            if self.ewm_count[row]:
+                delta = value - level
+                self.ewm_var[row] = (1 - self.alpha) * (self.ewm_var[row] + self.alpha * delta ** 2)
+                self.ewm_mean[row] = level + self.alpha * delta
+            else:
+                self.ewm_mean[row] = value
+            self.ewm_count[row] += 1
+            anomalies = []
+            if anomalous:
+                anomalies = self._alerts(np.array([row]), [value], [timestamp], np.array([z]), [mean], [std],
+                                         [seasonal], [0], None)
+            else:
+                for counts, means, m2s, index in ((self.count, self.mean, self.m2, row),
+                                                  (self.hour_count, self.hour_mean, self.hour_m2, (row, hour))):
+                    counts[index] += 1
+                    delta = value - means[index]
+                    means[index] += delta / counts[index]
+                    m2s[index] += delta * (value - means[index])
+            self.observed += 1
+        self._notify(scope, anomalies)
+        return anomalies
+
+    def _notify(self, scope, anomalies):
+        if not anomalies:
+            return
+        metrics.ANOMALIES_DETECTED.inc(len(anomalies), scope=scope)
+        for callback in self.subscribers:
+            try:
+                callback(anomalies)
+            except Exception as e:
+                print(f"⚠️ Anomaly subscriber failed: {e}")
+
+    # -- queries -----------------------------------------------------------
+
+    def recent_anomalies(self, limit=50, scope=None, entity_id=None, since=None):
+        """Newest ``limit`` anomalies, oldest first, optionally for one scope / entity / time onwards"""
+        with self._lock:
+            anomalies = [
+                anomaly for anomaly in self.recent
+                if (scope is None or anomaly['scope'] == scope)
+                and (entity_id is None or anomaly['id'] == entity_id)
+                and (since is None or anomaly['timestamp'] >= since)
+            ]
+        return anomalies[-limit:] if limit else []
+
+    def baseline(self, scope, name, field, at=None):
+        """Current statistics of one series"""
+        with self._lock:
+            row = self._index.get((scope, name, field))
+            if row is None:
+                raise KeyError(f'No observations for {scope} {name} {field}')
+            hour = int((time.time() if at is None else at) // 3600 % HOURS)
+            count = self.count[row]
+            hour_count = self.hour_count[row, hour]
+            return {
+                'observations': int(self.ewm_count[row]),
+                'mean': round(float(self.mean[row]), 4),
+                'std': round(float(np.sqrt(self.m2[row] / max(count - 1, 1))), 4),
+                'hour': hour,
+                'hour_observations': int(hour_count),
+                'hour_mean': round(float(self.hour_mean[row, hour]), 4) if hour_count else None,
+                'level': round(float(self.ewm_mean[row]), 4),
+                'level_std': round(float(np.sqrt(self.ewm_var[row])), 4)
+            }
+
+    def stats(self):
+        with self._lock:
+            return {
+                'series': len(self._series),
+                'observed': self.observed,
+                'detected': self.detected,
+                'suppressed': self.suppressed,
+                'threshold': self.threshold,
+                'warmup': self.warmup,
+                'cooldown_seconds': self.cooldown,
+                'ewma_alpha': self.alpha
+            }
@@ -1,33 +1,39 @@
 import os
 import json
+import threading
 import pandas as pd
 import numpy as np
-import folium
-import plotly.graph_objs as go
-import plotly.express as px
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, render_template, request, jsonify, send_file, Response
 from flask_socketio import SocketIO, emit
-from sklearn.cluster import KMeans
-from sklearn.preprocessing import StandardScaler
-from sklearn.ensemble import RandomForestRegressor
-
-# Alternative optimization using scipy and custom algorithms
-try:
-    from scipy.optimize import minimize
-    SCIPY_AVAILABLE = True
-except ImportError:
-    SCIPY_AVAILABLE = False
-import networkx as nx
-from geopy.distance import geodesic
+from werkzeug.exceptions import RequestEntityTooLarge
 import warnings
 import uuid
 import random
+import time
+
+# Heavy dependencies (folium, scikit-learn, scipy, ...) are imported lazily on
+# first use so that importing this module and respawning workers stays fast
+from lazy_imports import lazy_import, is_available, startup_phase, startup_report
+
+# Alternative optimization using scipy and custom algorithms
+SCIPY_AVAILABLE = is_available('scipy')
+
+import metrics
+from metrics import timed_stage
+from request_profiler import ProfileStore, RequestProfiler, admin_authorized
+from ledger_store import LedgerStore
+from chain_verifier import ChainVerifier
+from iot_pipeline import NDJSON_MIMETYPES, IngestPipeline, PipelineSaturated
+from iot_timeseries import SensorSeriesStore
+from anomaly_detector import StreamingAnomalyDetector
+from demand_forecast import DemandForecaster, OnlineDemandTrainer
+from feature_store import StopFeatureStore
 
 # Import advanced features
 from advanced_features import (
     BlockchainLedger, DigitalTwinEngine, IoTDataProcessor, 
     SocialImpactAnalyzer, GamificationEngine, VoiceAssistant, 
-    AdvancedAnalytics
+    AdvancedAnalytics, TransitEventSimulator, TwinHistory
 )
 
 warnings.filterwarnings('ignore')
@@ -38,14 +44,39 @@ app.secret_key = 'advanced_transport_hackathon_2024'
 # Initialize SocketIO
 socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
 
+# Per-endpoint request counts, latency histograms, in-flight gauge and errors
+metrics.instrument_flask(app)
+
+def error_response(message, status=200, **extra):
+    """``{"status": "error"}`` JSON reply, counted as a failed request in the metrics"""
+    metrics.mark_request_failed()
+    return jsonify({'status': 'error', 'message': message, **extra}), status
+
+# Opt-in cProfile of single requests (X-Profile header, admin toggle or 1-in-N sample)
+request_profiler = RequestProfiler(
+    ProfileStore(os.environ.get('PROFILE_DIR'), int(os.environ.get('PROFILE_MAX_FILES', 50))),
+    sample_every=int(os.environ.get('PROFILE_SAMPLE_EVERY', 0))
+)
+request_profiler.instrument_flask(app)
+
 class AccraTransportOptimizer:
     def __init__(self):
         self.routes_data = None
         self.stops_data = None
         self.transport_network = None
-        self.demand_model = None
+        self.feature_store = StopFeatureStore()
+        self.demand_forecaster = DemandForecaster(self.feature_store)
         self.optimization_results = {}
+    
+    @property
+    def demand_model(self):
+        return self.demand_forecaster.model
+    
+    @property
+    def demand_model_score(self):
+        return self.demand_forecaster.score
         
+    @timed_stage('load_sample_data')
     def load_sample_data(self):
         """Load sample GTFS-like data for demonstration"""
         # Sample bus stops in Accra (major locations)
@@ -72,38 +103,40 @@ class AccraTransportOptimizer:
         
         self.stops_data = pd.DataFrame(stops_data)
         self.routes_data = pd.DataFrame(routes_data)
+        self.transport_network = None
         
         return self.stops_data, self.routes_data
     
+    @timed_stage('analyze_demand_patterns')
     def analyze_demand_patterns(self):
         """Analyze passenger demand patterns using ML"""
         if self.stops_data is None:
             return None
             
-        # Create features for demand prediction
-        features = self.stops_data[['stop_lat', 'stop_lon', 'daily_passengers']].copy()
-        
-        # Add synthetic time-based features
-        np.random.seed(42)
-        features['hour_peak_factor'] = np.random.uniform(0.8, 1.5, len(features))
-        features['weekend_factor'] = np.random.uniform(0.6, 1.2, len(features))
+        # Per-stop features for clustering and the demand model
+        self.feature_store.load_network(self.stops_data, self.routes_data)
+        features = self.feature_store.snapshot()
+        boardings = features.hour_column('boardings')
         
-        # Cluster stops by demand patterns
+        # Cluster stops by volume, morning-peak share and centrality
+        StandardScaler = lazy_import('sklearn.preprocessing').StandardScaler
+        KMeans = lazy_import('sklearn.cluster').KMeans
         scaler = StandardScaler()
-        scaled_features = scaler.fit_transform(features[['daily_passengers', 'hour_peak_factor']])
+        scaled_features = scaler.fit_transform(np.column_stack([
+            features.stop_column('daily_passengers'),
+            boardings[:, 6:10].sum(axis=1) / np.maximum(boardings.sum(axis=1), 1),
+            features.stop_column('closeness')
+        ]))
         
         kmeans = KMeans(n_clusters=3, random_state=42)
         self.stops_data['demand_cluster'] = kmeans.fit_predict(scaled_features)
         
-        # Train demand prediction model
-        X = features[['stop_lat', 'stop_lon', 'hour_peak_factor', 'weekend_factor']]
-        y = features['daily_passengers']
-        
-        self.demand_model = RandomForestRegressor(n_estimators=100, random_state=42)
-        self.demand_model.fit(X, y)
+        # Train the per-stop hourly demand model
+        self.demand_forecaster.fit()
         
         return self.stops_data
     
+    @timed_stage('optimize_routes')
     def optimize_routes(self):
         """Optimize routes using OR-Tools"""
         if self.stops_data is None or self.routes_data is None:
@@ -137,13 +170,91 @@ class AccraTransportOptimizer:
             optimization_results.append(improvement)
         
         self.optimization_results = optimization_results
+        metrics.ROUTES_OPTIMIZED.inc(len(optimization_results))
         return optimization_results
     
+    def build_transport_network(self):
+        """Build origin-destination distances and route edges between stops"""
+        if self.stops_data is None or self.routes_data is None:
+            return None
+        
+        # Haversine distance matrix between all stops (km)
+        lat = np.radians(self.stops_data['stop_lat'].to_numpy(dtype=float))
+        lon = np.radians(self.stops_data['stop_lon'].to_numpy(dtype=float))
+        dlat = lat[:, None] - lat[None, :]
+        dlon = lon[:, None] - lon[None, :]
+        a = np.sin(dlat / 2) ** 2 + np.cos(lat[:, None]) * np.cos(lat[None, :]) * np.sin(dlon / 2) ** 2
+        od_distance_km = 2 * 6371.0 * np.arcsin(np.sqrt(a))
+        
+        stop_index = {stop_id: i for i, stop_id in enumerate(self.stops_data['stop_id'])}
+        edges = np.array([
+            [stop_index[start], stop_index[end]]
+            for start, end in zip(self.routes_data['start_stop'], self.routes_data['end_stop'])
+        ], dtype=np.int32).reshape(-1, 2)
+        
+        self.transport_network = {
+            'od_distance_km': od_distance_km,
+            'edges': edges
+        }
+        return self.transport_network
+    
+    def export_arrays(self):
+        """Flatten network data into named arrays for the shared-memory store"""
+        if self.stops_data is None or self.routes_data is None:
+            return {}
+        
+        if self.transport_network is None:
+            self.build_transport_network()
+        
+        arrays = {}
+        for prefix, frame in (('stops', self.stops_data), ('routes', self.routes_data)):
+            for column in frame.columns:
+                values = frame[column].to_numpy()
+                if values.dtype == object or str(values.dtype) == 'str':
+                    values = values.astype(str)
+                arrays[f'{prefix}.{column}'] = values
+        
+        if self.optimization_results:
+            for key in self.optimization_results[0]:
+                arrays[f'optimization.{key}'] = np.array([r[key] for r in self.optimization_results])
+        
+        for key, values in self.transport_network.items():
+            arrays[f'graph.{key}'] = values
+        
+        return arrays
+    
+    def attach_arrays(self, snapshot):
+        """Point the optimizer at arrays from a shared-memory snapshot without copying"""
+        stops = snapshot.group('stops')
+        routes = snapshot.group('routes')
+        if not stops or not routes:
+            return False
+        
+        optimization = snapshot.group('optimization')
+        optimization_results = []
+        if optimization:
+            keys = list(optimization)
+            optimization_results = [
+                dict(zip(keys, (values.item() for values in row)))
+                for row in zip(*(optimization[key] for key in keys))
+            ]
+        
+        # Swap everything in one go so readers never mix two versions
+        self.stops_data, self.routes_data, self.optimization_results, self.transport_network = (
+            pd.DataFrame(stops, copy=False),
+            pd.DataFrame(routes, copy=False),
+            optimization_results,
+            snapshot.group('graph')
+        )
+        return True
+    
     def create_network_visualization(self):
         """Create an interactive map of the transport network"""
         if self.stops_data is None:
             return None
             
+        folium = lazy_import('folium')
+        
         # Create base map centered on Accra
         m = folium.Map(location=[5.6037, -0.1870], zoom_start=11)
         
@@ -218,13 +329,73 @@ class AccraTransportOptimizer:
 optimizer = AccraTransportOptimizer()
 
 # Initialize advanced feature instances
-blockchain = BlockchainLedger()
-digital_twin = DigitalTwinEngine()
-iot_processor = IoTDataProcessor()
+blockchain = BlockchainLedger(
+    difficulty=int(os.environ.get('BLOCKCHAIN_DIFFICULTY', 2)),
+    block_size=int(os.environ.get('BLOCKCHAIN_BLOCK_SIZE', 3)),
+    block_interval=float(os.environ.get('BLOCKCHAIN_BLOCK_INTERVAL', 2.0)),
+    # Opt-in persistent ledger; production workers can share one directory
+    store=LedgerStore(os.environ['LEDGER_DIR']) if os.environ.get('LEDGER_DIR') else None
+)
+chain_verifier = ChainVerifier(blockchain, workers=int(os.environ.get('VERIFY_WORKERS', 0)) or None)
+# Online baselines for sensor readings and vehicle delays
+anomaly_detector = StreamingAnomalyDetector(
+    threshold=float(os.environ.get('ANOMALY_THRESHOLD', 4.0)),
+    warmup=int(os.environ.get('ANOMALY_WARMUP', 30)),
+    cooldown=float(os.environ.get('ANOMALY_COOLDOWN', 300))
+)
+# Bounded in-memory twin history; TWIN_HISTORY_MB=0 turns it off
+twin_history_mb = float(os.environ.get('TWIN_HISTORY_MB', 64))
+digital_twin = DigitalTwinEngine(history=TwinHistory(
+    max_bytes=int(twin_history_mb * 1024 * 1024),
+    max_frames=int(os.environ.get('TWIN_HISTORY_FRAMES', 720)),
+    delta=os.environ.get('TWIN_HISTORY_DELTA', '1') != '0',
+    compress=os.environ.get('TWIN_HISTORY_COMPRESS', '1') != '0'
+) if twin_history_mb > 0 else None, anomalies=anomaly_detector, features=optimizer.feature_store)
+
+def _series_precision(spec):
+    """IOT_SERIES_PRECISION: a default step ("0.01") and/or per-field steps ("temperature=0.1,count=1")"""
+    precision = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        field, _, step = item.rpartition('=')
+        precision[field or None] = float(step)
+    return precision
+
+# Live passenger counts keep the demand model current; DEMAND_TRAIN_INTERVAL=0 turns it off
+demand_train_interval = float(os.environ.get('DEMAND_TRAIN_INTERVAL', 60))
+demand_trainer = OnlineDemandTrainer(
+    optimizer.demand_forecaster,
+    interval=demand_train_interval,
+    holdout=float(os.environ.get('DEMAND_TRAIN_HOLDOUT', 0.2)),
+    sensors=lambda: iot_processor.sensor_stops()
+) if demand_train_interval > 0 else None
+
+# Compressed per-sensor history, in RAM or in IOT_SERIES_DIR; IOT_SERIES_MB=0 turns it off
+iot_series_mb = float(os.environ.get('IOT_SERIES_MB', 256))
+iot_processor = IoTDataProcessor(
+    stream_size=int(os.environ.get('IOT_STREAM_SIZE', 10000)),
+    series=SensorSeriesStore(
+        directory=os.environ.get('IOT_SERIES_DIR') or None,
+        chunk_size=int(os.environ.get('IOT_SERIES_CHUNK', 1024)),
+        precision=_series_precision(os.environ.get('IOT_SERIES_PRECISION', '')),
+        retention=float(os.environ.get('IOT_SERIES_RETENTION_DAYS', 28)) * 86400,
+        max_bytes=int(iot_series_mb * 1024 * 1024)
+    ) if iot_series_mb > 0 else None,
+    anomalies=anomaly_detector,
+    demand=demand_trainer
+)
+# Bounded parse -> enrich -> store ingest; a full pipeline answers 429
+iot_pipeline = IngestPipeline(
+    iot_processor,
+    stops=lambda: optimizer.stops_data,
+    queue_size=int(os.environ.get('IOT_PIPELINE_QUEUE', 32)),
+    max_queued_bytes=int(float(os.environ.get('IOT_PIPELINE_MB', 64)) * 1024 * 1024),
+    batch_size=int(os.environ.get('IOT_INGEST_BATCH_SIZE', 5000)),
+    parse_workers=int(os.environ.get('IOT_PARSE_WORKERS', 2))
+)
 social_impact = SocialImpactAnalyzer()
 gamification = GamificationEngine()
 voice_assistant = VoiceAssistant()
-advanced_analytics = AdvancedAnalytics()
+advanced_analytics = AdvancedAnalytics(anomaly_detector, demand_forecaster=optimizer.demand_forecaster)
 
 @app.route('/')
 def index():
@@ -241,6 +412,7 @@ def load_data():
         stops_data, routes_data = optimizer.load_sample_data()
         demand_analysis = optimizer.analyze_demand_patterns()
         optimization_results = optimizer.optimize_routes()
+        publish_shared_data()
         
         return jsonify({
             'status': 'success',
@@ -249,13 +421,13 @@ def load_data():
             'routes_count': len(routes_data)
         })
     except Exception as e:
-        return jsonify({'status': 'error', 'message': str(e)})
+        return error_response(str(e))
 
 @app.route('/api/optimization_results')
 def get_optimization_results():
     """Get route optimization results"""
     if not optimizer.optimization_results:
-        return jsonify({'status': 'error', 'message': 'No optimization results available'})
+        return error_response('No optimization results available')
     
     return jsonify({
         'status': 'success',
@@ -272,7 +444,7 @@ def get_network_map():
             'map_html': map_html
         })
     except Exception as e:
-        return jsonify({'status': 'error', 'message': str(e)})
+        return error_response(str(e))
 
 @app.route('/api/insights')
 def get_insights():
@@ -284,14 +456,14 @@ def get_insights():
             'insights': insights
         })
     except Exception as e:
-        return jsonify({'status': 'error', 'message': str(e)})
+        return error_response(str(e))
 
 @app.route('/api/demand_analysis')
 def get_demand_analysis():
     """Get demand analysis data"""
     try:
         if optimizer.stops_data is None:
-            return jsonify({'status': 'error', 'message': 'No data available'})
+            return error_response('No data available')
         
         # Create demand visualization data
         demand_data = optimizer.stops_data.to_dict('records')
@@ -301,7 +473,7 @@ def get_demand_analysis():
             'demand_data': demand_data
         })
     except Exception as e:
-        return jsonify({'status': 'error', 'message': str(e)})
+        return error_response(str(e))
 
 # Advanced feature API endpoints
 
@@ -313,10 +485,79 @@ def get_blockchain_status():
             'status': 'success',
             'chain_length': len(blockchain.chain),
             'pending_transactions': len(blockchain.pending_transactions),
-            'latest_block': blockchain.chain[-1] if blockchain.chain else None
+            'latest_block': blockchain.chain[-1] if blockchain.chain else None,
+            'storage': blockchain.storage_stats()
+        })
+    except Exception as e:
+        return error_response(str(e))
+
+@app.route('/api/blockchain/verify', methods=['GET', 'POST'])
+def verify_blockchain():
+    """Verification status, or run an incremental / full (?full=1) / deep (?deep=1) check"""
+    try:
+        if request.method == 'GET':
+            return jsonify({'status': 'success', 'verification': chain_verifier.status()})
+        
+        # A full or deep audit can keep a core per worker busy for seconds
+        data = request.get_json(silent=True) or {}
+        full = bool(data.get('full', request.args.get('full', type=int)))
+        deep = bool(data.get('deep', request.args.get('deep', type=int)))
+        if (full or deep) and not admin_authorized(request):
+            return error_response('Admin access required', 403)
+        return jsonify({'status': 'success', 'verification': chain_verifier.verify(full=full, deep=deep)})
+    except Exception as e:
+        return error_response(str(e))
+
+@app.route('/api/blockchain/transaction/<transaction_id>')
+def get_blockchain_transaction(transaction_id):
+    """Look up a mined transaction by id"""
+    try:
+        found = blockchain.find_transaction(transaction_id)
+        if found is None:
+            pending = any(tx['id'] == transaction_id for tx in list(blockchain.pending_transactions))
+            return error_response('Transaction is pending' if pending else 'Transaction not found', 404,
+                                  pending=pending)
+        
+        block_index, position, transaction = found
+        return jsonify({
+            'status': 'success',
+            'block_index': block_index,
+            'block_hash': blockchain.chain[block_index]['hash'],
+            'position': position,
+            'transaction': transaction
+        })
+    except Exception as e:
+        return error_response(str(e))
+
+@app.route('/api/blockchain/blocks')
+def get_blockchain_blocks():
+    """Read a range of blocks (?start=&limit=, latest blocks by default)"""
+    try:
+        length = len(blockchain.chain)
+        limit = max(1, min(request.args.get('limit', 10, type=int), 100))
+        start = request.args.get('start', type=int)
+        if start is None:
+            start = max(0, length - limit)
+        start = max(0, start)
+        return jsonify({
+            'status': 'success',
+            'chain_length': length,
+            'start': start,
+            'blocks': blockchain.chain[start:start + limit]
         })
     except Exception as e:
-        return jsonify({'status': 'error', 'message': str(e)})
+        return error_response(str(e))
+
+@app.route('/api/blockchain/block/<block_hash>')
+def get_blockchain_block(block_hash):
+    """Look up a block by hash"""
+    try:
+        block = blockchain.find_block(block_hash)
+        if block is None:
+            return error_response('Block not found', 404)
+        return jsonify({'status': 'success', 'block': block})
+    except Exception as e:
+        return error_response(str(e))
 
 @app.route('/api/blockchain/add_transaction', methods=['POST'])
 def add_blockchain_transaction():
@@ -328,23 +569,32 @@ def add_blockchain_transaction():
             data.get('data', {})
         )
         
-        # Mine block if we have enough transactions
-        if len(blockchain.pending_transactions) >= 3:
-            new_block = blockchain.mine_block()
-            return jsonify({
-                'status': 'success',
-                'transaction_id': transaction_id,
-                'block_mined': True,
-                'block': new_block
-            })
-        
+        # Blocks are sealed by the background miner and announced as 'block_mined'
         return jsonify({
             'status': 'success',
             'transaction_id': transaction_id,
-            'block_mined': False
+            'block_mined': False,
+            'pending_transactions': len(blockchain.pending_transactions)
         })
     except Exception as e:
-        return jsonify({'status': 'error', 'message': str(e)})
+        return error_response(str(e))
+
+@app.route('/api/blockchain/mining', methods=['GET', 'POST'])
+def blockchain_mining_config():
+    """Get or change difficulty and block sealing thresholds"""
+    try:
+        if request.method == 'POST':
+            data = request.get_json(silent=True) or {}
+            config = blockchain.configure(
+                difficulty=data.get('difficulty'),
+                block_size=data.get('block_size'),
+                block_interval=data.get('block_interval')
+            )
+        else:
+            config = blockchain.mining_status()
+        return jsonify({'status': 'success', 'mining': config})
+    except Exception as e:
+        return error_response(str(e))
 
 @app.route('/api/digital_twin/start')
 def start_digital_twin():
@@ -355,32 +605,141 @@ def start_digital_twin():
                 'stops': optimizer.stops_data.to_dict('records'),
                 'routes': optimizer.routes_data.to_dict('records')
             }
-            digital_twin.initialize_twin(network_data)
+            fleet_size = request.args.get('fleet_size', type=int) or \
+                int(os.environ.get('DIGITAL_TWIN_FLEET_SIZE', 0)) or None
+            digital_twin.initialize_twin(network_data, fleet_size=fleet_size)
             digital_twin.start_simulation()
             
             return jsonify({
                 'status': 'success',
-                'message': 'Digital twin simulation started'
+                'message': 'Digital twin simulation started',
+                'vehicles': digital_twin.vehicle_count
             })
         else:
-            return jsonify({
-                'status': 'error',
-                'message': 'No transport data available. Load data first.'
-            })
+            return error_response('No transport data available. Load data first.')
     except Exception as e:
-        return jsonify({'status': 'error', 'message': str(e)})
+        return error_response(str(e))
 
 @app.route('/api/digital_twin/state')
 def get_digital_twin_state():
     """Get current digital twin state"""
     try:
-        state = digital_twin.get_twin_state()
-        return jsonify({
-            'status': 'success',
-            'twin_state': state
-        })
+        # Serialized once per tick and shared by every reader of that tick
+        snapshot = digital_twin.snapshot()
+        response = Response(b'{"status":"success","twin_state":' + snapshot.to_json() + b'}',
+                            mimetype='application/json')
+        response.set_etag(f'twin-{os.getpid()}-{snapshot.epoch}-{snapshot.version}')
+        return response.make_conditional(request)
+    except Exception as e:
+        return error_response(str(e))
+
+def _history_window():
+    """(since, until) from ?since/?until (epoch seconds) or ?window (seconds back from now)"""
+    until = request.args.get('until', type=float)
+    since = request.args.get('since', type=float)
+    window = request.args.get('window', type=float)
+    if since is None and window is not None:
+        since = (until or time.time()) - window
+    return since, until
+
+def _twin_history_disabled():
+    return error_response('Digital twin history is disabled (TWIN_HISTORY_MB=0)', 404)
+
+@app.route('/api/digital_twin/history')
+def twin_history_status():
+    """Size and time span of the digital twin history"""
+    if digital_twin.history is None:
+        return _twin_history_disabled()
+    return jsonify({'status': 'success', 'history': digital_twin.history.stats()})
+
+@app.route('/api/digital_twin/history/state')
+def twin_history_state():
+    """Twin state as of ?at=<epoch seconds> or ?ago=<seconds>"""
+    try:
+        if digital_twin.history is None:
+            return _twin_history_disabled()
+        at = request.args.get('at', type=float)
+        if at is None:
+            at = time.time() - request.args.get('ago', 0, type=float)
+        snapshot = digital_twin.history.state_at(at)
+        if snapshot is None:
+            return error_response('Requested time is older than the twin history', 404)
+        return Response(b'{"status":"success","twin_state":' + snapshot.to_json() + b'}',
+                        mimetype='application/json')
+    except Exception as e:
+        return error_response(str(e))
+
+@app.route('/api/digital_twin/history/series')
+def twin_history_series():
+    """Time series of a network metric, or of a route metric with ?route_id="""
+    try:
+        if digital_twin.history is None:
+            return _twin_history_disabled()
+        since, until = _history_window()
+        series = digital_twin.history.series(request.args.get('metric', 'avg_delay_minutes'),
+                                             route_id=request.args.get('route_id'), since=since, until=until)
+        return jsonify({'status': 'success', 'series': series})
+    except ValueError as e:
+        return error_response(str(e), 400)
+    except Exception as e:
+        return error_response(str(e))
+
+@app.route('/api/digital_twin/history/playback')
+def twin_history_playback():
+    """Recorded frames for replay; ?route_id= adds that route's vehicles"""
+    try:
+        if digital_twin.history is None:
+            return _twin_history_disabled()
+        since, until = _history_window()
+        frames = digital_twin.history.playback(
+            since=since, until=until,
+            every=max(request.args.get('every', 1, type=int), 1),
+            route_id=request.args.get('route_id'),
+            limit=min(request.args.get('limit', 500, type=int), 5000)
+        )
+        return jsonify({'status': 'success', 'frames': frames})
+    except ValueError as e:
+        return error_response(str(e), 400)
     except Exception as e:
-        return jsonify({'status': 'error', 'message': str(e)})
+        return error_response(str(e))
+
+@app.route('/api/digital_twin/simulate_day', methods=['GET', 'POST'])
+def simulate_service_day():
+    """Discrete-event simulation of a full service day for what-if planning"""
+    try:
+        if optimizer.stops_data is None or optimizer.routes_data is None:
+            return error_response('No transport data available. Load data first.')
+        
+        # Scenario: {"headway_minutes": 8, "vehicle_capacity": 80, "demand_scale": 1.2,
+        #            "start_hour": 5, "end_hour": 23, "seed": 1}; headway_minutes and
+        #            vehicle_capacity may also be per-route dicts such as {"R001": 4}
+        scenario = request.get_json(silent=True) or {}
+        network_data = {
+            'stops': optimizer.stops_data.to_dict('records'),
+            'routes': optimizer.routes_data.to_dict('records')
+        }
+        
+        schedule = None
+        if scenario.get('source', request.args.get('source')) == 'gtfs':
+            # Sample GTFS timetable (stop_times) instead of route headways
+            gtfs = lazy_import('data.gtfs_processor').GTFSProcessor().create_sample_gtfs_data()
+            schedule = TransitEventSimulator.schedule_from_stop_times(gtfs['trips'], gtfs['stop_times'])
+        
+        results = digital_twin.simulate_day(
+            network_data,
+            schedule=schedule,
+            headway_minutes=scenario.get('headway_minutes'),
+            start_hour=float(scenario.get('start_hour', request.args.get('start_hour', 5))),
+            end_hour=float(scenario.get('end_hour', request.args.get('end_hour', 23))),
+            demand_scale=float(scenario.get('demand_scale', request.args.get('demand_scale', 1.0))),
+            vehicle_capacity=scenario.get('vehicle_capacity'),
+            seed=scenario.get('seed', request.args.get('seed', type=int))
+        )
+        return jsonify({'status': 'success', 'scenario': scenario, 'simulation': results})
+    except ValueError as e:
+        return error_response(str(e), 400)
+    except Exception as e:
+        return error_response(str(e))
 
 @app.route('/api/digital_twin/predict_congestion')
 def predict_congestion():
@@ -390,6 +749,8 @@ def predict_congestion():
         time_horizon = int(request.args.get('time_horizon', 30))
         
         predictions = digital_twin.predict_congestion(route_id, time_horizon)
+        if predictions is None:
+            return error_response(f'Unknown route {route_id}', 404)
         
         return jsonify({
             'status': 'success',
@@ -397,7 +758,38 @@ def predict_congestion():
             'predictions': predictions
         })
     except Exception as e:
-        return jsonify({'status': 'error', 'message': str(e)})
+        return error_response(str(e))
+
+@app.route('/api/digital_twin/forecast')
+def forecast_congestion():
+    """Network-wide congestion forecast: routes x minutes in one request"""
+    try:
+        # ?routes=R001,R002 (or repeated route_id) limits the routes;
+        # ?min_level=moderate|high keeps only routes reaching that level
+        route_ids = [route_id for value in request.args.getlist('routes') + request.args.getlist('route_id')
+                     for route_id in value.split(',') if route_id] or None
+        horizon = min(request.args.get('horizon', 60, type=int), 24 * 60)
+        step = max(request.args.get('step', 1, type=int), 1)
+        min_level = request.args.get('min_level', 'low')
+        if min_level not in digital_twin.CONGESTION_LEVELS:
+            return error_response(f'min_level must be one of {digital_twin.CONGESTION_LEVELS}', 400)
+        
+        started = time.perf_counter()
+        forecast = digital_twin.forecast_congestion(route_ids, horizon=horizon, step=step)
+        rank = digital_twin.CONGESTION_LEVELS.index
+        forecast['routes'] = {route_id: route for route_id, route in forecast['routes'].items()
+                              if rank(route['peak_level']) >= rank(min_level)}
+        
+        return jsonify({
+            'status': 'success',
+            'horizon_minutes': horizon,
+            'step_minutes': step,
+            'thresholds': dict(zip(digital_twin.CONGESTION_LEVELS[1:], digital_twin.CONGESTION_THRESHOLDS)),
+            'forecast': forecast,
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 2)
+        })
+    except Exception as e:
+        return error_response(str(e))
 
 @app.route('/api/iot/simulate_data')
 def simulate_iot_data():
@@ -412,7 +804,7 @@ def simulate_iot_data():
             'summary': summary
         })
     except Exception as e:
-        return jsonify({'status': 'error', 'message': str(e)})
+        return error_response(str(e))
 
 @app.route('/api/iot/sensors')
 def get_iot_sensors():
@@ -421,17 +813,209 @@ def get_iot_sensors():
         return jsonify({
             'status': 'success',
             'sensors': iot_processor.sensors,
-            'recent_data': iot_processor.data_stream[-10:] if iot_processor.data_stream else []
+            'recent_data': iot_processor.recent_readings(10),
+            'summary': iot_processor.get_sensor_summary()
+        })
+    except Exception as e:
+        return error_response(str(e))
+
+def _ndjson_chunks(stream, chunk_size=1 << 20, max_line=1 << 20):
+    """~chunk_size pieces of a (possibly chunked) NDJSON body, each ending on a line boundary
+    
+    RequestEntityTooLarge once a line grows past ``max_line`` bytes, so a
+    body without newlines cannot buffer without bound.
+    """
+    partial = b''
+    while True:
+        # Large reads and one split per block; line-by-line stream reads are slow
+        block = stream.read(chunk_size)
+        if not block:
+            if partial.strip():
+                yield partial
+            return
+        complete, newline, partial = (partial + block).rpartition(b'\n')
+        if len(partial) > max_line:
+            raise RequestEntityTooLarge(f'NDJSON line longer than {max_line} bytes')
+        if newline:
+            yield complete
+
+def _read_body(stream, limit):
+    """Whole request body, or RequestEntityTooLarge as soon as it passes ``limit`` bytes"""
+    if (request.content_length or 0) > limit:
+        raise RequestEntityTooLarge(f'Payload exceeds the {limit}-byte ingest limit')
+    parts = []
+    size = 0
+    while True:
+        block = stream.read(min(1 << 20, limit + 1 - size))
+        if not block:
+            return b''.join(parts)
+        parts.append(block)
+        size += len(block)
+        if size > limit:
+            raise RequestEntityTooLarge(f'Payload exceeds the {limit}-byte ingest limit')
+
+def _ingest_response(job_ids, saturated=None):
+    """Accepted (202) or completed ingest, or 429 when the pipeline pushed back"""
+    wait = request.args.get('wait', 0, type=float)
+    jobs = iot_pipeline.wait(job_ids, min(wait, 60)) if wait > 0 and job_ids else [iot_pipeline.job(i) for i in job_ids]
+    jobs = [job for job in jobs if job is not None]
+    rejections = {}
+    for job in jobs:
+        for reason, count in job['rejections'].items():
+            rejections[reason] = rejections.get(reason, 0) + count
+    response = {
+        'status': 'success',
+        'batch_ids': job_ids,
+        'batches': jobs,
+        'complete': all(job['status'] in ('done', 'failed') for job in jobs),
+        'received': sum(job['received'] for job in jobs),
+        'accepted': sum(job['accepted'] for job in jobs),
+        'rejected': sum(job['rejected'] for job in jobs),
+        'rejections': rejections,
+        'queues': {stage: queue['depth'] for stage, queue in iot_pipeline.stats()['queues'].items()}
+    }
+    if saturated is not None:
+        metrics.IOT_INGEST_THROTTLED.inc()
+        response.update(status='error', message=str(saturated), retry_after=saturated.retry_after)
+        metrics.mark_request_failed()
+        return jsonify(response), 429, {'Retry-After': str(saturated.retry_after)}
+    return jsonify(response), 200 if response['complete'] and wait > 0 else 202
+
+@app.route('/api/iot/sensors/<sensor_id>/history')
+def get_iot_sensor_history(sensor_id):
+    """Stored readings of one sensor (?window|since|until, ?resolution=60|300|3600 for rollups, ?fields=a,b)"""
+    try:
+        since, until = _history_window()
+        if since is None and until is None:
+            since = time.time() - 3600
+        resolution = request.args.get('resolution', type=int)
+        fields = request.args.get('fields')
+        history = iot_processor.sensor_history(
+            sensor_id, since, until, resolution=resolution,
+            fields=fields.split(',') if fields else None,
+            limit=request.args.get('limit', 10000, type=int)
+        )
+        return jsonify({
+            'status': 'success',
+            'sensor_id': sensor_id,
+            'resolution': resolution or 'raw',
+            'points' if resolution is None else 'buckets': history
         })
+    except KeyError as e:
+        return error_response(e.args[0], 404)
+    except ValueError as e:
+        return error_response(str(e), 400)
+    except Exception as e:
+        return error_response(str(e))
+
+@app.route('/api/iot/series')
+def get_iot_series_stats():
+    """Footprint of the compressed sensor history"""
+    if iot_processor.series is None:
+        return error_response('Sensor history is disabled (IOT_SERIES_MB=0)', 404)
+    return jsonify({'status': 'success', 'series': iot_processor.series.stats()})
+
+@app.route('/api/iot/edge', methods=['GET'])
+def get_iot_edge_devices():
+    """Registered edge devices and how much they have pre-aggregated"""
+    try:
+        return jsonify({'status': 'success', 'edge_devices': iot_processor.edge_devices})
+    except Exception as e:
+        return error_response(str(e))
+
+@app.route('/api/iot/edge/register', methods=['POST'])
+def register_iot_edge_device():
+    """Register an edge node ({"edge_id", "sensors": [...], "location"})"""
+    try:
+        payload = request.get_json(silent=True) or {}
+        if not payload.get('edge_id'):
+            return error_response('edge_id is required', 400)
+        device = iot_processor.register_edge_device(payload['edge_id'], payload.get('sensors'), payload.get('location'))
+        return jsonify({'status': 'success', 'edge_id': payload['edge_id'], 'device': device})
+    except Exception as e:
+        return error_response(str(e))
+
+@app.route('/api/iot/edge/summary', methods=['POST'])
+def merge_iot_edge_summary():
+    """Merge pre-aggregated summary cells from an edge node (see iot_edge.py)"""
+    try:
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict):
+            return error_response('Expected a JSON edge summary', 400)
+        return jsonify({'status': 'success', **iot_processor.merge_edge_summary(payload)})
+    except KeyError as e:
+        return error_response(e.args[0], 404)
+    except ValueError as e:
+        return error_response(str(e), 400)
+    except Exception as e:
+        return error_response(str(e))
+
+@app.route('/api/iot/ingest', methods=['POST'])
+def ingest_iot_readings():
+    """Queue sensor readings (a JSON array, {"readings": [...]} or an NDJSON stream) for the ingest pipeline"""
+    try:
+        job_ids = []
+        try:
+            if request.mimetype in NDJSON_MIMETYPES:
+                for chunk in _ndjson_chunks(request.stream):
+                    job_ids.append(iot_pipeline.submit(chunk, request.mimetype))
+            else:
+                body = _read_body(request.stream, iot_pipeline.max_queued_bytes)
+                job_ids.append(iot_pipeline.submit(body, request.mimetype))
+        except PipelineSaturated as e:
+            # Chunks already queued are kept; the client resends the rest
+            return _ingest_response(job_ids, saturated=e)
+        return _ingest_response(job_ids)
+    except RequestEntityTooLarge as e:
+        # NDJSON chunks queued before the oversized line are kept
+        return error_response(e.description, 413, batch_ids=job_ids)
+    except ValueError as e:
+        return error_response(str(e), 400)
+    except Exception as e:
+        return error_response(str(e))
+
+@app.route('/api/iot/ingest/<int:batch_id>')
+def get_iot_ingest_batch(batch_id):
+    """Progress and counts of one queued ingest batch"""
+    try:
+        job = iot_pipeline.job(batch_id)
+        if job is None:
+            return error_response(f'Unknown ingest batch {batch_id}', 404)
+        return jsonify({'status': 'success', 'batch': job})
+    except Exception as e:
+        return error_response(str(e))
+
+@app.route('/api/iot/pipeline')
+def get_iot_pipeline():
+    """Ingest pipeline queue depths, workers and totals"""
+    try:
+        return jsonify({'status': 'success', 'pipeline': iot_pipeline.stats()})
+    except Exception as e:
+        return error_response(str(e))
+
+@app.route('/api/iot/summary')
+def get_iot_window_summary():
+    """Sliding-window reading statistics (?window=60|300|3600, ?type= or ?sensor_id=)"""
+    try:
+        summary = iot_processor.window_summary(
+            window=request.args.get('window', 300, type=int),
+            sensor_type=request.args.get('type'),
+            sensor_id=request.args.get('sensor_id')
+        )
+        return jsonify({'status': 'success', 'summary': summary})
+    except KeyError as e:
+        return error_response(e.args[0], 404)
+    except ValueError as e:
+        return error_response(str(e), 400)
     except Exception as e:
-        return jsonify({'status': 'error', 'message': str(e)})
+        return error_response(str(e))
 
 @app.route('/api/social_impact')
 def get_social_impact():
     """Get social impact analytics"""
     try:
         if not optimizer.optimization_results or optimizer.stops_data is None:
-            return jsonify({'status': 'error', 'message': 'No optimization data available'})
+            return error_response('No optimization data available')
         
         environmental_impact = social_impact.calculate_environmental_impact(optimizer.optimization_results)
         social_benefits = social_impact.calculate_social_benefits(optimizer.stops_data)
@@ -444,7 +1028,7 @@ def get_social_impact():
             'economic': economic_impact
         })
     except Exception as e:
-        return jsonify({'status': 'error', 'message': str(e)})
+        return error_response(str(e))
 
 @app.route('/api/gamification/create_user', methods=['POST'])
 def create_gamification_user():
@@ -462,7 +1046,7 @@ def create_gamification_user():
             'profile': gamification.user_profiles[user_id]
         })
     except Exception as e:
-        return jsonify({'status': 'error', 'message': str(e)})
+        return error_response(str(e))
 
 @app.route('/api/gamification/add_trip', methods=['POST'])
 def add_gamification_trip():
@@ -473,7 +1057,7 @@ def add_gamification_trip():
         trip_data = data.get('trip_data', {})
         
         if user_id not in gamification.user_profiles:
-            return jsonify({'status': 'error', 'message': 'User not found'})
+            return error_response('User not found')
         
         points_earned = gamification.add_trip_points(user_id, trip_data)
         
@@ -483,19 +1067,41 @@ def add_gamification_trip():
             'total_points': gamification.user_profiles[user_id]['points']
         })
     except Exception as e:
-        return jsonify({'status': 'error', 'message': str(e)})
+        return error_response(str(e))
 
 @app.route('/api/gamification/leaderboard')
 def get_leaderboard():
     """Get gamification leaderboard"""
     try:
-        leaderboard = gamification.get_leaderboard()
+        limit = int(request.args.get('limit', 10))
+        offset = int(request.args.get('offset', 0))
+        if not 0 < limit <= 1000 or offset < 0:
+            raise ValueError('limit must be between 1 and 1000 and offset non-negative')
+        leaderboard = gamification.get_leaderboard(limit, offset)
         return jsonify({
             'status': 'success',
+            'total_users': len(gamification.leaderboard),
             'leaderboard': leaderboard
         })
+    except ValueError as e:
+        return error_response(str(e), 400)
+    except Exception as e:
+        return error_response(str(e))
+
+@app.route('/api/gamification/rank/<user_id>')
+def get_user_rank(user_id):
+    """Rank of one user, with ?radius=N neighbors above and below"""
+    try:
+        radius = int(request.args.get('radius', 5))
+        if not 0 <= radius <= 100:
+            raise ValueError('radius must be between 0 and 100')
+        return jsonify({'status': 'success', **gamification.get_rank(user_id, radius)})
+    except KeyError as e:
+        return error_response(e.args[0], 404)
+    except ValueError as e:
+        return error_response(str(e), 400)
     except Exception as e:
-        return jsonify({'status': 'error', 'message': str(e)})
+        return error_response(str(e))
 
 @app.route('/api/gamification/challenges')
 def get_challenges():
@@ -507,7 +1113,7 @@ def get_challenges():
             'challenges': gamification.challenges
         })
     except Exception as e:
-        return jsonify({'status': 'error', 'message': str(e)})
+        return error_response(str(e))
 
 @app.route('/api/voice/process', methods=['POST'])
 def process_voice_command():
@@ -523,62 +1129,149 @@ def process_voice_command():
             'response': response
         })
     except Exception as e:
-        return jsonify({'status': 'error', 'message': str(e)})
+        return error_response(str(e))
 
 @app.route('/api/analytics/predict_demand')
 def predict_demand():
-    """Get demand predictions"""
+    """Hourly demand forecast per stop (?stop_id=ST001,ST002&hours=24&start=<epoch>)"""
     try:
         # Train model if not already trained
-        if 'demand' not in advanced_analytics.predictive_models:
+        if not optimizer.demand_forecaster.fitted:
+            if optimizer.stops_data is None:
+                optimizer.load_sample_data()
+            optimizer.feature_store.load_network(optimizer.stops_data, optimizer.routes_data)
             advanced_analytics.train_demand_prediction_model(None)
         
-        predictions = advanced_analytics.predict_future_demand(None, 24)
+        stop_ids = [stop_id for value in request.args.getlist('stop_id') for stop_id in value.split(',') if stop_id]
+        start = request.args.get('start')
+        predictions = advanced_analytics.predict_future_demand(
+            None,
+            hours_ahead=int(request.args.get('hours', 24)),
+            stop_ids=stop_ids or None,
+            start=float(start) if start else None
+        )
         
         return jsonify({
             'status': 'success',
             'predictions': predictions
         })
+    except KeyError as e:
+        return error_response(e.args[0], 404)
+    except ValueError as e:
+        return error_response(str(e), 400)
     except Exception as e:
-        return jsonify({'status': 'error', 'message': str(e)})
+        return error_response(str(e))
+
+@app.route('/api/analytics/demand_model')
+def get_demand_model():
+    """Served demand model version and online training progress"""
+    try:
+        forecaster = optimizer.demand_forecaster
+        return jsonify({
+            'status': 'success',
+            'model': {
+                'version': forecaster.version,
+                'type': type(forecaster.model).__name__ if forecaster.fitted else None,
+                'trained_at': forecaster.trained_at,
+                'stops': len(forecaster.stop_ids)
+            },
+            'online_training': demand_trainer.stats() if demand_trainer is not None else None
+        })
+    except Exception as e:
+        return error_response(str(e))
+
+@app.route('/api/analytics/features')
+def get_stop_features():
+    """Feature store version and columns, or one stop's features (?stop_id=ST001)"""
+    try:
+        stop_id = request.args.get('stop_id')
+        if stop_id:
+            return jsonify({'status': 'success', 'features': optimizer.feature_store.snapshot().stop_features(stop_id)})
+        return jsonify({'status': 'success', 'store': optimizer.feature_store.stats()})
+    except KeyError as e:
+        return error_response(e.args[0], 404)
+    except Exception as e:
+        return error_response(str(e))
 
 @app.route('/api/analytics/detect_anomalies')
 def detect_anomalies():
-    """Detect network anomalies"""
+    """Recent anomalies (?scope=sensor|route&id=&since=&limit=)"""
     try:
         current_data = {
             'routes': optimizer.routes_data.to_dict('records') if optimizer.routes_data is not None else []
         }
+        since = request.args.get('since')
         
-        anomalies = advanced_analytics.detect_anomalies(current_data)
+        anomalies = advanced_analytics.detect_anomalies(
+            current_data,
+            limit=int(request.args.get('limit', 50)),
+            scope=request.args.get('scope'),
+            entity_id=request.args.get('id'),
+            since=float(since) if since else None
+        )
         
         return jsonify({
             'status': 'success',
             'anomalies': anomalies
         })
+    except ValueError as e:
+        return error_response(str(e), 400)
+    except Exception as e:
+        return error_response(str(e))
+
+@app.route('/api/analytics/anomalies/baseline')
+def get_anomaly_baseline():
+    """Learned baseline of one series (?scope=sensor|route&id=&field=)"""
+    try:
+        scope = request.args.get('scope', 'route')
+        entity_id = request.args.get('id')
+        field = request.args.get('field', 'delay_minutes')
+        if not entity_id:
+            raise ValueError('id is required')
+        return jsonify({
+            'status': 'success',
+            'scope': scope,
+            'id': entity_id,
+            'field': field,
+            'baseline': anomaly_detector.baseline(scope, entity_id, field)
+        })
+    except KeyError as e:
+        return error_response(e.args[0], 404)
+    except ValueError as e:
+        return error_response(str(e), 400)
     except Exception as e:
-        return jsonify({'status': 'error', 'message': str(e)})
+        return error_response(str(e))
+
+@app.route('/api/analytics/anomalies/stats')
+def get_anomaly_stats():
+    """Streaming anomaly detector counters"""
+    try:
+        return jsonify({'status': 'success', 'detector': anomaly_detector.stats()})
+    except Exception as e:
+        return error_response(str(e))
 
 @app.route('/api/analytics/real_time_insights')
 def get_real_time_insights():
     """Get real-time insights"""
     try:
-        network_state = digital_twin.get_twin_state()
-        insights = advanced_analytics.generate_real_time_insights(network_state)
+        snapshot = digital_twin.snapshot()
+        insights = advanced_analytics.generate_real_time_insights(snapshot)
         
         return jsonify({
             'status': 'success',
+            'version': snapshot.version,
+            'network': snapshot.aggregates().network(),
             'insights': insights
         })
     except Exception as e:
-        return jsonify({'status': 'error', 'message': str(e)})
+        return error_response(str(e))
 
 @app.route('/api/ar_vr/network_data')
 def get_ar_vr_network_data():
     """Get network data formatted for AR/VR visualization"""
     try:
         if optimizer.stops_data is None or optimizer.routes_data is None:
-            return jsonify({'status': 'error', 'message': 'No network data available'})
+            return error_response('No network data available')
         
         # Format data for 3D visualization
         ar_vr_data = {
@@ -614,18 +1307,24 @@ def get_ar_vr_network_data():
             'ar_vr_data': ar_vr_data
         })
     except Exception as e:
-        return jsonify({'status': 'error', 'message': str(e)})
+        return error_response(str(e))
 
 # Additional API endpoint aliases for easier access
 @app.route('/api/digital_twin/status')
 def digital_twin_status():
     """Get digital twin status"""
+    snapshot = digital_twin.snapshot()
+    routes = snapshot.route_summary()
+    vehicles = sum(route['vehicles'] for route in routes)
+    avg_delay = sum(route['avg_delay_minutes'] * route['vehicles'] for route in routes) / max(vehicles, 1)
     return jsonify({
-        'status': 'active',
-        'simulation_running': True,
-        'last_update': pd.Timestamp.now().isoformat(),
-        'active_vehicles': 150,
-        'congestion_level': 'moderate'
+        'status': 'active' if digital_twin.simulation_running else 'idle',
+        'simulation_running': digital_twin.simulation_running,
+        'last_update': pd.Timestamp.fromtimestamp(snapshot.timestamp).isoformat(),
+        'active_vehicles': vehicles,
+        'congestion_level': 'high' if avg_delay > 8 else 'moderate' if avg_delay > 3 else 'low',
+        'tick_count': snapshot.version,
+        'routes': routes
     })
 
 @app.route('/api/iot/data')
@@ -680,12 +1379,15 @@ def voice_status():
 @app.route('/api/analytics/overview')
 def analytics_overview():
     """Get analytics overview"""
+    values = metrics.REGISTRY.collect()
+    results = optimizer.optimization_results or []
+    
     return jsonify({
-        'total_routes_optimized': np.random.randint(500, 1500),
-        'average_improvement': np.random.uniform(15, 35),
-        'prediction_accuracy': np.random.uniform(0.85, 0.95),
-        'data_points_processed': np.random.randint(50000, 150000),
-        'ml_models_active': 8
+        'total_routes_optimized': sum(values.get(metrics.ROUTES_OPTIMIZED.name, {}).values()),
+        'average_improvement': round(float(np.mean([r['efficiency_gain'] for r in results])), 1) if results else 0,
+        'prediction_accuracy': round(optimizer.demand_model_score, 3) if optimizer.demand_model_score is not None else None,
+        'data_points_processed': sum(values.get(metrics.IOT_READINGS.name, {}).values()),
+        'ml_models_active': int(optimizer.demand_model is not None) + len(advanced_analytics.predictive_models)
     })
 
 @app.route('/optimize')
@@ -750,8 +1452,219 @@ def initialize_advanced_features():
     except Exception as e:
         print(f"Error initializing advanced features: {e}")
 
-# Call initialization after importing
-initialize_advanced_features()
+_startup_lock = threading.Lock()
+_startup_complete = False
+
+def startup():
+    """Run one-time startup work that used to happen at import time"""
+    global _startup_complete
+    if _startup_complete:
+        return
+    
+    with _startup_lock:
+        if _startup_complete:
+            return
+        with startup_phase('initialize_advanced_features'):
+            initialize_advanced_features()
+        _startup_complete = True
+
+# Shared-memory data plane, attached by production_server before forking
+shared_store = None
+_shared_version = 0
+
+def use_shared_store(store):
+    """Serve network data from a shared-memory store, publishing local data if it is empty"""
+    global shared_store
+    shared_store = store
+    if store.current_version() == 0:
+        publish_shared_data()
+    else:
+        refresh_shared_data()
+
+def publish_shared_data():
+    """Publish the current optimizer arrays as a new shared version"""
+    if shared_store is None:
+        return None
+    
+    arrays = optimizer.export_arrays()
+    if not arrays:
+        return None
+    
+    shared_store.publish(arrays)
+    # Re-attach so this process also drops its private copies
+    refresh_shared_data()
+    return _shared_version
+
+def refresh_shared_data():
+    """Switch to the latest shared version if another process published one"""
+    global _shared_version
+    if shared_store is None or shared_store.current_version() == _shared_version:
+        return False
+    
+    snapshot = shared_store.attach()
+    if snapshot is None:
+        return False
+    
+    optimizer.attach_arrays(snapshot)
+    _shared_version = snapshot.version
+    return True
+
+def preload_optimizer():
+    """Load, analyze and optimize the network ahead of the first request"""
+    with startup_phase('load_sample_data'):
+        optimizer.load_sample_data()
+    with startup_phase('analyze_demand_patterns'):
+        optimizer.analyze_demand_patterns()
+    if os.environ.get('FEATURE_TIMETABLE') == 'gtfs':
+        # Departures and headways from the sample GTFS stop_times instead of route frequencies
+        with startup_phase('load_timetable'):
+            gtfs = lazy_import('data.gtfs_processor').GTFSProcessor().create_sample_gtfs_data()
+            optimizer.feature_store.set_timetable(gtfs['stop_times'])
+    with startup_phase('optimize_routes'):
+        optimizer.optimize_routes()
+
+def announce_block(block):
+    """Push a freshly mined block to Socket.IO clients"""
+    socketio.emit('block_mined', {
+        'index': block['index'],
+        'hash': block['hash'],
+        'timestamp': block['timestamp'],
+        'difficulty': block['difficulty'],
+        'nonce': block['nonce'],
+        'transactions': [tx['id'] for tx in block['transactions']]
+    })
+
+blockchain.add_block_listener(announce_block)
+
+def announce_anomalies(anomalies):
+    """Push newly detected anomalies to Socket.IO clients"""
+    socketio.emit('anomalies', {'anomalies': anomalies})
+
+anomaly_detector.subscribe(announce_anomalies)
+
+# Background threads do not survive os.fork(), so they are started per process
+_services_pid = None
+# Cleared by the production server in workers that forward stateful requests
+# to the state owner; those workers run no background services
+owns_state = True
+
+def start_background_services():
+    """Start per-process background threads (again in each forked worker)"""
+    global _services_pid
+    if _services_pid == os.getpid():
+        return
+    _services_pid = os.getpid()
+    if not owns_state:
+        return
+    blockchain.start_miner()
+    iot_pipeline.start()
+    if demand_trainer is not None:
+        demand_trainer.start()
+
+def stop_background_services():
+    """Stop background threads, e.g. before forking workers"""
+    global _services_pid
+    blockchain.stop_miner()
+    iot_pipeline.stop()
+    if demand_trainer is not None:
+        demand_trainer.stop()
+    if iot_processor.series is not None:
+        iot_processor.series.flush()
+    _services_pid = None
+
+@app.before_request
+def ensure_startup():
+    """Make sure startup ran even when served by an external WSGI server"""
+    if not _startup_complete:
+        startup()
+    if _services_pid != os.getpid():
+        start_background_services()
+    if shared_store is not None:
+        refresh_shared_data()
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus scrape endpoint"""
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/admin/profiling', methods=['GET', 'POST'])
+def admin_profiling():
+    """Get or change request profiling settings"""
+    if not admin_authorized(request):
+        return error_response('Admin access required', 403)
+    
+    try:
+        if request.method == 'POST':
+            data = request.get_json() or {}
+            settings = request_profiler.configure(
+                enabled=data.get('enabled'),
+                sample_every=data.get('sample_every'),
+                path_prefix=data.get('path_prefix')
+            )
+        else:
+            settings = request_profiler.status()
+        
+        return jsonify({'status': 'success', 'profiling': settings})
+    except Exception as e:
+        return error_response(str(e))
+
+@app.route('/admin/profiles')
+def admin_list_profiles():
+    """List stored request profiles, newest first"""
+    if not admin_authorized(request):
+        return error_response('Admin access required', 403)
+    
+    return jsonify({
+        'status': 'success',
+        'profiles': request_profiler.store.list()
+    })
+
+@app.route('/admin/profiles/<profile_id>')
+def admin_get_profile(profile_id):
+    """Download a stored profile (pstats file, or ?format=text for a summary)"""
+    if not admin_authorized(request):
+        return error_response('Admin access required', 403)
+    
+    try:
+        if request.args.get('format') == 'text':
+            report = request_profiler.store.text_report(
+                profile_id,
+                sort=request.args.get('sort', 'cumulative'),
+                limit=int(request.args.get('limit', 40))
+            )
+            if report is None:
+                return error_response('Profile not found', 404)
+            return Response(report, mimetype='text/plain')
+        
+        path = request_profiler.store.profile_path(profile_id)
+        if path is None:
+            return error_response('Profile not found', 404)
+        return send_file(path, mimetype='application/octet-stream',
+                         as_attachment=True, download_name=f'{profile_id}.prof')
+    except ValueError as e:
+        return error_response(str(e), 400)
+
+@app.route('/api/system/shared_data')
+def get_shared_data_status():
+    """Get the shared-memory data plane version attached by this process"""
+    if shared_store is None:
+        return jsonify({'status': 'success', 'enabled': False})
+    
+    return jsonify({
+        'status': 'success',
+        'enabled': True,
+        'attached_version': _shared_version,
+        'store': shared_store.stats()
+    })
+
+@app.route('/api/system/startup')
+def get_startup_report():
+    """Get lazy import and startup phase timings for this process"""
+    return jsonify({
+        'status': 'success',
+        'startup_complete': _startup_complete,
+        'report': startup_report()
+    })
 
 @app.route('/api/advanced_dashboard')
 def get_advanced_dashboard():
@@ -765,13 +1678,14 @@ def get_advanced_dashboard():
             },
             'digital_twin': {
                 'simulation_active': digital_twin.simulation_running,
-                'last_update': digital_twin.twin_state.get('last_update', 0)
+                'last_update': digital_twin.snapshot().timestamp
             },
             'iot': iot_processor.get_sensor_summary(),
             'gamification': {
                 'total_users': len(gamification.user_profiles),
                 'top_user': gamification.get_leaderboard(1)[0] if gamification.user_profiles else None
-            }
+            },
+            'server': metrics.server_summary()
         }
         
         return jsonify({
@@ -779,10 +1693,11 @@ def get_advanced_dashboard():
             'dashboard_data': dashboard_data
         })
     except Exception as e:
-        return jsonify({'status': 'error', 'message': str(e)})
+        return error_response(str(e))
 
 if __name__ == '__main__':
     print("🚀 Starting Advanced AI Transport Optimization System...")
     print("🌐 Server will be available at: http://localhost:5000")
     print("🎊 All advanced features ready for Ghana AI Hackathon 2024!")
+    startup()
     socketio.run(app, host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
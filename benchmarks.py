@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Performance benchmarks for the Advanced AI Transport System.
+
+Usage:
+    python benchmarks.py mining [--difficulty 3] [--blocks 20]
+    python benchmarks.py ledger [--blocks 20000] [--transactions 10]
+    python benchmarks.py verify [--blocks 1000000] [--workers N]
+    python benchmarks.py twin [--vehicles 100000] [--routes 2000] [--stops 5000] [--history]
+    python benchmarks.py simulate [--routes 500] [--stops 1500]
+    python benchmarks.py demand [--stops 1000] [--hours 24]
+    python benchmarks.py leaderboard [--users 1000000] [--trips 100000]
+"""
+
+import argparse
+import hashlib
+import os
+import random
+import shutil
+import tempfile
+import time
+import uuid
+
+import numpy as np
+
+import metrics
+from advanced_features import BLOCK_HEADER, BlockchainLedger, DigitalTwinEngine, TwinHistory, merkle_root
+from chain_verifier import ChainVerifier
+from demand_forecast import DemandForecaster, feature_matrix
+from leaderboard import Leaderboard
+from ledger_store import HEADER_RECORD, LedgerStore
+
+
+def benchmark_mining(args):
+    """Proof-of-work throughput for blocks of growing size"""
+    print(f"⛏️  Mining {args.blocks} blocks per size at difficulty {args.difficulty}")
+    print(f"   {'transactions':>12} {'PoW hashes/s':>14} {'PoW ms/block':>13} {'total ms/block':>15}")
+
+    for block_size in (1, 10, 100, 1000):
+        ledger = BlockchainLedger(difficulty=args.difficulty)
+        hashes = 0
+        elapsed = 0.0
+        pow_before = metrics.BLOCKCHAIN_MINING_SECONDS.summary()['sum']
+
+        for _ in range(args.blocks):
+            for i in range(block_size):
+                ledger.add_transaction('benchmark', {'seq': i, 'route_id': 'R001'})
+            start = time.perf_counter()
+            block = ledger.mine_block()
+            elapsed += time.perf_counter() - start
+            hashes += block['nonce'] + 1
+
+        # The mining histogram times only the nonce loop; the rest is the
+        # one-off merkle root over the block's transactions
+        pow_seconds = metrics.BLOCKCHAIN_MINING_SECONDS.summary()['sum'] - pow_before
+        print(f"   {block_size:>12} {hashes / pow_seconds:>14,.0f} "
+              f"{pow_seconds / args.blocks * 1000:>13.2f} {elapsed / args.blocks * 1000:>15.2f}")
+
+
+def benchmark_ledger(args):
+    """Append rate, reopen time and lookup latency of the on-disk ledger"""
+    directory = tempfile.mkdtemp(prefix='ledger-bench-')
+    try:
+        store = LedgerStore(directory)
+        ledger = BlockchainLedger(difficulty=0, store=store)
+        transaction_ids = []
+
+        print(f"📒 Appending {args.blocks:,} blocks x {args.transactions} transactions")
+        start = time.perf_counter()
+        for height in range(1, args.blocks + 1):
+            transactions = [
+                {'id': str(uuid.uuid4()), 'type': 'benchmark', 'data': {'seq': i}, 'timestamp': time.time()}
+                for i in range(args.transactions)
+            ]
+            transaction_ids.append(transactions[-1]['id'])
+            block = {
+                'index': height,
+                'timestamp': time.time(),
+                'transactions': transactions,
+                'merkle_root': merkle_root(transactions),
+                'previous_hash': store.tip_hash(),
+                'difficulty': 0,
+                'nonce': 0
+            }
+            block['hash'] = ledger.calculate_hash(block)
+            store.append_block(block)
+        elapsed = time.perf_counter() - start
+        print(f"   append:  {args.blocks / elapsed:,.0f} blocks/s")
+        store.close()
+
+        start = time.perf_counter()
+        store = LedgerStore(directory)
+        print(f"   reopen:  {(time.perf_counter() - start) * 1000:.1f} ms "
+              f"({store.count:,} blocks, {store.transaction_count:,} transactions)")
+
+        sample = random.sample(transaction_ids, min(1000, len(transaction_ids)))
+        start = time.perf_counter()
+        for transaction_id in sample:
+            assert store.find_transaction(transaction_id) is not None
+        print(f"   lookup:  {(time.perf_counter() - start) / len(sample) * 1e6:.1f} µs per transaction")
+
+        start = time.perf_counter()
+        blocks = store.read_blocks(max(0, store.count - 1000), store.count)
+        print(f"   range:   {(time.perf_counter() - start) / len(blocks) * 1e6:.1f} µs per block (last {len(blocks)})")
+        store.close()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def _write_synthetic_headers(directory, blocks):
+    """Valid header-only chain (difficulty 0, no transactions) written straight to headers.bin"""
+    empty_root = bytes.fromhex(merkle_root([]))
+    previous = bytes(32)
+    records = []
+    timestamp = time.time()
+    for height in range(blocks):
+        digest = hashlib.sha256(
+            BLOCK_HEADER.pack(height, timestamp, 0, previous, empty_root) + bytes(8)).digest()
+        records.append(HEADER_RECORD.pack(timestamp, 0, 0, digest, previous, empty_root, 0, 0, 0, 0, 0))
+        previous = digest
+    with open(os.path.join(directory, 'headers.bin'), 'wb') as f:
+        f.write(b''.join(records))
+
+
+def benchmark_verify(args):
+    """Serial vs parallel full audit, then an incremental check"""
+    directory = tempfile.mkdtemp(prefix='verify-bench-')
+    try:
+        print(f"🔍 Building a {args.blocks:,}-block header chain")
+        _write_synthetic_headers(directory, args.blocks)
+        ledger = BlockchainLedger(store=LedgerStore(directory))
+
+        for workers in (1, args.workers):
+            verifier = ChainVerifier(ledger, workers=workers)
+            verifier.verify(full=True)  # first run includes pool start-up
+            report = verifier.verify(full=True)
+            print(f"   full, {workers:>2} workers: {report['elapsed_seconds']:.2f}s "
+                  f"({report['blocks_per_second']:,} blocks/s, valid={report['valid']})")
+            verifier.close()
+
+        report = verifier.verify()
+        print(f"   incremental (no new blocks): {report['elapsed_seconds'] * 1000:.2f} ms")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def synthetic_network(stops, routes, seed=0):
+    """Random stops and routes shaped like the sample data"""
+    rng = np.random.default_rng(seed)
+    stop_records = [
+        {'stop_id': f'S{i:05d}', 'stop_name': f'Stop {i}', 'stop_lat': 5.5 + rng.uniform(0, 0.2),
+         'stop_lon': -0.3 + rng.uniform(0, 0.2), 'daily_passengers': int(rng.integers(500, 20000))}
+        for i in range(stops)
+    ]
+    route_records = [
+        {'route_id': f'R{i:05d}', 'start_stop': f'S{rng.integers(stops):05d}',
+         'end_stop': f'S{rng.integers(stops):05d}', 'current_frequency': int(rng.integers(3, 20)),
+         'vehicle_capacity': int(rng.choice([14, 30, 50, 80])), 'avg_travel_time': int(rng.integers(20, 120))}
+        for i in range(routes)
+    ]
+    return {'stops': stop_records, 'routes': route_records}
+
+
+def benchmark_twin(args):
+    """Digital twin tick time for a large fleet, optionally recording history"""
+    twin = DigitalTwinEngine(history=TwinHistory() if args.history else None)
+    start = time.perf_counter()
+    twin.initialize_twin(synthetic_network(args.stops, args.routes), fleet_size=args.vehicles)
+    print(f"🚌 {twin.vehicle_count:,} vehicles, {args.routes:,} routes, {args.stops:,} stops "
+          f"(initialized in {(time.perf_counter() - start) * 1000:.0f} ms)")
+
+    timings = []
+    for _ in range(args.ticks):
+        start = time.perf_counter()
+        twin.tick()
+        timings.append(time.perf_counter() - start)
+    timings = np.array(timings) * 1000
+    print(f"   tick: p50 {np.percentile(timings, 50):.2f} ms, p95 {np.percentile(timings, 95):.2f} ms, "
+          f"{1000 / timings.mean():,.0f} ticks/s")
+    if args.history:
+        stats = twin.history.stats()
+        print(f"   history: {stats['frames']} frames, {stats['bytes_per_frame']:,} bytes/frame "
+              f"({stats['uncompressed_bytes_per_frame']:,} uncompressed)")
+        start = time.perf_counter()
+        twin.history.state_at(time.time())
+        print(f"   state_at: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+
+def benchmark_simulate(args):
+    """Discrete-event simulation of a full service day"""
+    twin = DigitalTwinEngine()
+    results = twin.simulate_day(synthetic_network(args.stops, args.routes), seed=0)
+    print(f"🗓️  {args.routes:,} routes, {results['trips']:,} trips, {results['simulated_hours']} simulated hours")
+    print(f"   {results['events_processed']:,} events in {results['wall_seconds']:.2f}s "
+          f"({results['events_processed'] / results['wall_seconds']:,.0f} events/s, "
+          f"{results['speedup']:,}x real time)")
+
+
+def benchmark_demand(args):
+    """Network-wide demand forecast: one batched predict call vs one call per (stop, hour)"""
+    stops = synthetic_network(args.stops, 0)['stops']
+    forecaster = DemandForecaster()
+    start = time.perf_counter()
+    forecaster.fit({name: [stop[name] for stop in stops] for name in stops[0]})
+    print(f"📈 {args.stops:,} stops x {args.hours} hours, model trained in {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    forecast = forecaster.predict(hours=args.hours)
+    batched = time.perf_counter() - start
+    print(f"   batched: {batched * 1000:.0f} ms for {len(forecast['stop_ids']) * args.hours:,} predictions")
+
+    # Per-point calls, timed on a sample and scaled up
+    snapshot = forecaster.store.snapshot()
+    sample = range(min(20, args.stops))
+    timestamps = forecast['start'] + 3600 * np.arange(args.hours)
+    start = time.perf_counter()
+    for row in sample:
+        for timestamp in timestamps:
+            forecaster.model.predict(feature_matrix(snapshot, [row], [timestamp]))
+    per_point = (time.perf_counter() - start) / (len(sample) * args.hours) * args.stops * args.hours
+    print(f"   per point: ~{per_point:.1f}s ({per_point / batched:,.0f}x slower)")
+
+
+def benchmark_leaderboard(args):
+    """Leaderboard index updates and rank queries vs sorting every user"""
+    rng = random.Random(0)
+    points = [rng.randrange(10000) for _ in range(args.users)]
+    board = Leaderboard(seed=0)
+    start = time.perf_counter()
+    for user_id, score in enumerate(points):
+        board.update(user_id, score)
+    print(f"🏆 {args.users:,} users indexed in {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    for _ in range(args.trips):
+        user_id = rng.randrange(args.users)
+        points[user_id] += rng.choice((10, 13, 15, 18))
+        board.update(user_id, points[user_id])
+    print(f"   trip update: {(time.perf_counter() - start) / args.trips * 1e6:.1f} us")
+
+    queries = [rng.randrange(args.users) for _ in range(1000)]
+    start = time.perf_counter()
+    for user_id in queries:
+        board.rank(user_id)
+    print(f"   rank: {(time.perf_counter() - start) / len(queries) * 1e6:.1f} us")
+    start = time.perf_counter()
+    for user_id in queries:
+        board.top(10)
+        board.around(user_id, 5)
+    print(f"   top 10 + 5 neighbors: {(time.perf_counter() - start) / len(queries) * 1e6:.1f} us")
+
+    start = time.perf_counter()
+    sorted(range(args.users), key=points.__getitem__, reverse=True)[:10]
+    print(f"   full sort: {(time.perf_counter() - start) * 1000:.0f} ms per leaderboard read")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Transport system benchmarks')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    mining = subparsers.add_parser('mining', help='proof-of-work throughput vs block size')
+    mining.add_argument('--difficulty', type=int, default=3)
+    mining.add_argument('--blocks', type=int, default=20)
+    mining.set_defaults(func=benchmark_mining)
+
+    ledger = subparsers.add_parser('ledger', help='on-disk ledger append, reopen and lookup')
+    ledger.add_argument('--blocks', type=int, default=20000)
+    ledger.add_argument('--transactions', type=int, default=10)
+    ledger.set_defaults(func=benchmark_ledger)
+
+    verify = subparsers.add_parser('verify', help='chain verification throughput')
+    verify.add_argument('--blocks', type=int, default=1000000)
+    verify.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    verify.set_defaults(func=benchmark_verify)
+
+    twin = subparsers.add_parser('twin', help='digital twin tick time')
+    twin.add_argument('--vehicles', type=int, default=100000)
+    twin.add_argument('--routes', type=int, default=2000)
+    twin.add_argument('--stops', type=int, default=5000)
+    twin.add_argument('--ticks', type=int, default=50)
+    twin.add_argument('--history', action='store_true', help='record ticks in a TwinHistory')
+    twin.set_defaults(func=benchmark_twin)
+
+    simulate = subparsers.add_parser('simulate', help='discrete-event service day')
+    simulate.add_argument('--routes', type=int, default=500)
+    simulate.add_argument('--stops', type=int, default=1500)
+    simulate.set_defaults(func=benchmark_simulate)
+
+    demand = subparsers.add_parser('demand', help='batched demand forecast')
+    demand.add_argument('--stops', type=int, default=1000)
+    demand.add_argument('--hours', type=int, default=24)
+    demand.set_defaults(func=benchmark_demand)
+
+    leaderboard = subparsers.add_parser('leaderboard', help='ordered leaderboard index')
+    leaderboard.add_argument('--users', type=int, default=1000000)
+    leaderboard.add_argument('--trips', type=int, default=100000)
+    leaderboard.set_defaults(func=benchmark_leaderboard)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
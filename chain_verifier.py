@@ -0,0 +1,276 @@
+"""
+Parallel, incremental verification of the blockchain ledger.
+
+The chain is split into block-range chunks that are checked in a process
+pool. For every block a chunk recomputes the header hash, checks the link
+to the previous block and checks that the hash has the proof of work its
+difficulty requires. A deep check also recomputes each block's Merkle root
+from its transactions. Header bytes are assembled for a whole chunk at once
+with NumPy, so the per-block work is essentially one sha256 call.
+
+The verifier remembers how many leading blocks are known to be valid (in
+``verified.json`` next to an on-disk ledger), so routine checks only cover
+blocks added since the last run. A full audit starts again from genesis.
+"""
+
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import metrics
+from advanced_features import merkle_root
+from ledger_store import HEADER_DTYPE, read_block_records, read_headers, segment_path
+
+# advanced_features.BLOCK_HEADER followed by the 8-byte nonce
+HASHED_HEADER_DTYPE = np.dtype([
+    ('index', '<u8'),
+    ('timestamp', '<f8'),
+    ('difficulty', '<u4'),
+    ('previous_hash', 'u1', (32,)),
+    ('merkle_root', 'u1', (32,)),
+    ('nonce', '<u8')
+])
+
+
+def _hex_column(values):
+    return np.frombuffer(b''.join(bytes.fromhex(value.rjust(64, '0')) for value in values),
+                         dtype=np.uint8).reshape(-1, 32)
+
+
+def headers_from_blocks(blocks):
+    """Header records (ledger_store.HEADER_DTYPE) for in-memory blocks"""
+    records = np.zeros(len(blocks), dtype=HEADER_DTYPE)
+    if not blocks:
+        return records
+    records['timestamp'] = [block['timestamp'] for block in blocks]
+    records['difficulty'] = [block.get('difficulty', 0) for block in blocks]
+    records['nonce'] = [block['nonce'] for block in blocks]
+    records['hash'] = _hex_column(block['hash'] for block in blocks)
+    records['previous_hash'] = _hex_column(block['previous_hash'] for block in blocks)
+    records['merkle_root'] = _hex_column(block['merkle_root'] for block in blocks)
+    return records
+
+
+def verify_headers(records, first_height, previous_hash=None):
+    """Check consecutive header records starting at ``first_height``
+
+    ``previous_hash`` is the raw hash of block ``first_height - 1``. Returns
+    the number of leading valid blocks and the reason the next one failed.
+    """
+    count = len(records)
+    if count == 0:
+        return 0, None
+
+    hashed = np.zeros(count, dtype=HASHED_HEADER_DTYPE)
+    hashed['index'] = np.arange(first_height, first_height + count, dtype=np.uint64)
+    for field in ('timestamp', 'difficulty', 'previous_hash', 'merkle_root', 'nonce'):
+        hashed[field] = records[field]
+
+    raw = hashed.tobytes()
+    size = HASHED_HEADER_DTYPE.itemsize
+    sha256 = hashlib.sha256
+    digests = b''.join([sha256(raw[i:i + size]).digest() for i in range(0, len(raw), size)])
+    hash_ok = (np.frombuffer(digests, dtype=np.uint8).reshape(count, 32) == records['hash']).all(axis=1)
+
+    link_ok = np.ones(count, dtype=bool)
+    link_ok[1:] = (records['previous_hash'][1:] == records['hash'][:-1]).all(axis=1)
+    expected = previous_hash if first_height else bytes(32)
+    link_ok[0] = records['previous_hash'][0].tobytes() == expected
+
+    # Proof of work: leading zero hex digits of the hash
+    nibbles = np.empty((count, 64), dtype=np.uint8)
+    nibbles[:, 0::2] = records['hash'] >> 4
+    nibbles[:, 1::2] = records['hash'] & 0x0F
+    nonzero = nibbles != 0
+    leading_zeros = np.where(nonzero.any(axis=1), nonzero.argmax(axis=1), 64)
+    work_ok = leading_zeros >= records['difficulty']
+
+    failed = ~(hash_ok & link_ok & work_ok)
+    if not failed.any():
+        return count, None
+    first = int(failed.argmax())
+    if not hash_ok[first]:
+        reason = 'hash does not match header'
+    elif not link_ok[first]:
+        reason = 'previous_hash does not match the preceding block'
+    else:
+        reason = 'hash does not meet the block difficulty'
+    return first, reason
+
+
+def _verify_chunk(records, start, previous_hash, deep, load_blocks):
+    valid, reason = verify_headers(records, start, previous_hash)
+    if deep and valid:
+        for position, block in enumerate(load_blocks(records[:valid])):
+            if merkle_root(block['transactions']) != records['merkle_root'][position].tobytes().hex():
+                valid, reason = position, 'merkle root does not match transactions'
+                break
+    return {'start': start, 'valid': valid, 'reason': reason}
+
+
+def _verify_store_chunk(directory, start, stop, previous_hash, deep):
+    """Process pool task: verify blocks [start, stop) of an on-disk ledger"""
+    records = read_headers(directory, start, stop)
+    descriptors = {}
+
+    def segment_fd(segment):
+        if segment not in descriptors:
+            descriptors[segment] = os.open(segment_path(directory, segment), os.O_RDONLY)
+        return descriptors[segment]
+
+    try:
+        return _verify_chunk(records, start, previous_hash, deep,
+                             lambda valid: read_block_records(valid, segment_fd))
+    finally:
+        for fd in descriptors.values():
+            os.close(fd)
+
+
+def _verify_block_chunk(blocks, start, previous_hash, deep):
+    """Process pool task: verify in-memory blocks starting at height ``start``"""
+    return _verify_chunk(headers_from_blocks(blocks), start, previous_hash, deep,
+                         lambda valid: blocks[:len(valid)])
+
+
+class ChainVerifier:
+    """Verifies a BlockchainLedger in parallel chunks, resuming from the last verified height"""
+
+    def __init__(self, ledger, workers=None, chunk_size=50000):
+        self.ledger = ledger
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.verified_height = 0
+        self.verified_hash = None
+        self.last_report = None
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pool_pid = None
+        self._load_checkpoint()
+
+    # -- checkpoint --------------------------------------------------------
+
+    def _checkpoint_path(self):
+        store = self.ledger.store
+        return os.path.join(store.directory, 'verified.json') if store is not None else None
+
+    def _load_checkpoint(self):
+        path = self._checkpoint_path()
+        if path is None or not os.path.exists(path):
+            return
+        try:
+            with open(path) as f:
+                checkpoint = json.load(f)
+            self.verified_height = checkpoint['height']
+            self.verified_hash = checkpoint['hash']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def _save_checkpoint(self):
+        path = self._checkpoint_path()
+        if path is None:
+            return
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'height': self.verified_height, 'hash': self.verified_hash}, f)
+        os.replace(tmp_path, path)
+
+    # -- chain access ------------------------------------------------------
+
+    def _hash_at(self, height):
+        store = self.ledger.store
+        if store is not None:
+            return store.headers(height, height + 1)['hash'][0].tobytes()
+        return bytes.fromhex(self.ledger.chain[height]['hash'])
+
+    def _resume_height(self, length):
+        height = self.verified_height
+        if height == 0 or height > length or self._hash_at(height - 1).hex() != self.verified_hash:
+            return 0
+        return height
+
+    # -- execution ---------------------------------------------------------
+
+    def _executor(self):
+        if self._pool is None or self._pool_pid != os.getpid():
+            # spawn: the server process has threads, which fork would copy mid-flight
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+            self._pool_pid = os.getpid()
+        return self._pool
+
+    def _tasks(self, ranges, deep):
+        store = self.ledger.store
+        for start, stop in ranges:
+            previous_hash = self._hash_at(start - 1) if start else None
+            if store is not None:
+                yield _verify_store_chunk, (store.directory, start, stop, previous_hash, deep)
+            else:
+                yield _verify_block_chunk, (self.ledger.chain[start:stop], start, previous_hash, deep)
+
+    def _run(self, ranges, deep):
+        tasks = list(self._tasks(ranges, deep))
+        if len(tasks) <= 1 or self.workers == 1:
+            return [func(*args) for func, args in tasks]
+        pool = self._executor()
+        futures = [pool.submit(func, *args) for func, args in tasks]
+        return [future.result() for future in futures]
+
+    def verify(self, full=False, deep=False):
+        """Verify blocks added since the last run (or the whole chain) and report throughput"""
+        with self._lock:
+            started = time.perf_counter()
+            length = len(self.ledger.chain)
+            start = 0 if full else self._resume_height(length)
+            ranges = [(low, min(low + self.chunk_size, length)) for low in range(start, length, self.chunk_size)]
+
+            valid_height = start
+            error = None
+            for (low, high), result in zip(ranges, self._run(ranges, deep)):
+                valid_height = low + result['valid']
+                if result['reason'] is not None:
+                    error = {'height': valid_height, 'reason': result['reason']}
+                    break
+
+            self.verified_height = valid_height
+            self.verified_hash = self._hash_at(valid_height - 1).hex() if valid_height else None
+            self._save_checkpoint()
+            metrics.BLOCKCHAIN_VERIFIED_HEIGHT.set(valid_height)
+
+            elapsed = time.perf_counter() - started
+            checked = (error['height'] + 1 if error else length) - start
+            self.last_report = {
+                'valid': error is None,
+                'error': error,
+                'mode': 'full' if full else 'incremental',
+                'deep': deep,
+                'chain_length': length,
+                'from_height': start,
+                'verified_height': valid_height,
+                'checked_blocks': checked,
+                'chunks': len(ranges),
+                'workers': min(self.workers, len(ranges)) if len(ranges) > 1 else 1,
+                'elapsed_seconds': round(elapsed, 6),
+                'blocks_per_second': round(checked / elapsed) if elapsed > 0 else None,
+                'timestamp': time.time()
+            }
+            return self.last_report
+
+    def status(self):
+        return {
+            'verified_height': self.verified_height,
+            'chain_length': len(self.ledger.chain),
+            'workers': self.workers,
+            'chunk_size': self.chunk_size,
+            'last_report': self.last_report
+        }
+
+    def close(self):
+        if self._pool is not None and self._pool_pid == os.getpid():
+            self._pool.shutdown()
+        self._pool = None
@@ -0,0 +1,383 @@
+"""
+Batched passenger demand forecasts per stop and hour.
+
+The demand model predicts the passengers boarding at a stop in one hour from
+the stop's features in a StopFeatureStore (location, volume, centrality,
+nearby sensors, and that hour's historical boardings, departures and
+headway), the hour of day (as a sin/cos pair) and a weekend flag. A forecast
+slices the store's current snapshot into the whole stops x horizon feature
+matrix and makes a single ``predict`` call, so a network-wide 24-hour
+forecast is one model evaluation instead of one per (stop, hour).
+
+OnlineDemandTrainer keeps the model current from live passenger counts: it
+sums counts per (stop, hour), feeds each finished hour to a shadow model's
+``partial_fit`` in a background thread, and swaps the shadow model in only
+when it beats the served model on recent held-out hours. Finished hours
+also update the store's historical boardings.
+"""
+
+import copy
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+import metrics
+from feature_store import HOUR_COLUMNS, STOP_COLUMNS, StopFeatureStore
+from lazy_imports import is_available, lazy_import
+
+HOUR_FEATURES = ('boardings', 'departures', 'headway_minutes')
+FEATURES = STOP_COLUMNS + HOUR_FEATURES + ('hour_sin', 'hour_cos', 'weekend')
+_HOUR_FEATURE_INDEX = [HOUR_COLUMNS.index(name) for name in HOUR_FEATURES]
+_BOARDINGS, _DAILY, _WEEKEND = FEATURES.index('boardings'), FEATURES.index('daily_passengers'), FEATURES.index('weekend')
+
+WEEKEND_FACTOR = 0.75
+MAX_HORIZON = 168
+# Training rows are sampled down to this many
+TRAINING_ROWS = 20000
+
+
+def feature_rows(snapshot, rows, timestamps):
+    """One feature row per (stop row of a FeatureSnapshot, hour-start timestamp) pair"""
+    rows = np.asarray(rows, dtype=np.int64)
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    hours = (timestamps // 3600 % 24).astype(np.int64)
+    matrix = np.empty((len(timestamps), len(FEATURES)))
+    stop_columns = len(STOP_COLUMNS)
+    matrix[:, :stop_columns] = snapshot.stops[rows]
+    matrix[:, stop_columns:stop_columns + len(HOUR_FEATURES)] = snapshot.hours[rows, hours][:, _HOUR_FEATURE_INDEX]
+    angle = 2 * np.pi * hours / 24
+    matrix[:, -3] = np.sin(angle)
+    matrix[:, -2] = np.cos(angle)
+    # 1970-01-01 was a Thursday; Monday is day 0
+    matrix[:, -1] = (timestamps // 86400 + 3) % 7 >= 5
+    return matrix
+
+
+def feature_matrix(snapshot, rows, timestamps):
+    """Feature rows for every (stop row, hour) pair, stop-major"""
+    rows = np.asarray(rows, dtype=np.int64)
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    return feature_rows(snapshot, np.repeat(rows, len(timestamps)), np.tile(timestamps, len(rows)))
+
+
+def training_set(snapshot, seed=42):
+    """Synthetic hourly boardings for every stop over a reference weekday and weekend day"""
+    rng = np.random.default_rng(seed)
+    # Monday 2024-01-01 and Saturday 2024-01-06, hour by hour
+    hours = 3600 * np.arange(24)
+    timestamps = np.concatenate([1704067200 + hours, 1704499200 + hours])
+    X = feature_matrix(snapshot, np.arange(len(snapshot.stop_ids)), timestamps)
+    y = ProfileDemandModel().predict(X) * rng.lognormal(0, 0.1, len(X))
+    if len(X) > TRAINING_ROWS:
+        sample = rng.choice(len(X), TRAINING_ROWS, replace=False)
+        X, y = X[sample], y[sample]
+    return X, y
+
+
+class ProfileDemandModel:
+    """Historical boardings for the hour, less on weekends; the model used when scikit-learn is missing"""
+
+    def fit(self, X, y):
+        return self
+
+    def predict(self, X):
+        return X[:, _BOARDINGS] * np.where(X[:, _WEEKEND] > 0, WEEKEND_FACTOR, 1.0)
+
+
+class DemandForecaster:
+    """Per-stop hourly demand model with batched forecasts over a StopFeatureStore"""
+
+    def __init__(self, store=None):
+        self.store = store if store is not None else StopFeatureStore()
+        self.model = None
+        self.score = None
+        self.trained_at = None
+        # Bumped whenever the served model changes
+        self.version = 0
+
+    @property
+    def fitted(self):
+        return self.model is not None
+
+    @property
+    def stop_ids(self):
+        return self.store.snapshot().stop_ids
+
+    def fit(self, stops=None):
+        """Train on synthetic hourly history of the store's stops (loading ``stops`` first if given)"""
+        if stops is not None:
+            self.store.load_network(stops)
+        X, y = training_set(self.store.snapshot())
+        if is_available('sklearn'):
+            RandomForestRegressor = lazy_import('sklearn.ensemble').RandomForestRegressor
+            model = RandomForestRegressor(n_estimators=100, random_state=42)
+        else:
+            model = ProfileDemandModel()
+        model.fit(X, y)
+        self.swap(model, model.score(X, y) if hasattr(model, 'score') else None)
+        return model
+
+    def swap(self, model, score=None):
+        """Serve ``model`` from now on; forecasts already running finish with the old one"""
+        self.model = model
+        self.score = score
+        self.trained_at = time.time()
+        self.version += 1
+
+    def features(self, stop_ids, timestamps):
+        """Feature rows for (stop, hour) pairs, and which pairs had a known stop"""
+        snapshot = self.store.snapshot()
+        rows = np.array([snapshot.stop_index.get(stop_id, -1) for stop_id in stop_ids], dtype=np.int64)
+        known = rows >= 0
+        return feature_rows(snapshot, rows[known], np.asarray(timestamps, dtype=np.float64)[known]), known
+
+    def predict(self, stop_ids=None, hours=24, start=None):
+        """Forecast ``hours`` hours from ``start`` (default: the next full hour) for ``stop_ids`` (default: all)
+
+        Returns stop ids, the forecast hours and one row of hourly
+        passenger counts per stop, plus network totals per hour.
+        """
+        model = self.model
+        if model is None:
+            raise ValueError('Demand model has not been trained')
+        if not 1 <= hours <= MAX_HORIZON:
+            raise ValueError(f'hours must be between 1 and {MAX_HORIZON}')
+        snapshot = self.store.snapshot()
+        if stop_ids is None:
+            stop_ids, rows = snapshot.stop_ids, np.arange(len(snapshot.stop_ids))
+        else:
+            rows = snapshot.rows(stop_ids)
+        start = (time.time() // 3600 + 1) * 3600 if start is None else start // 3600 * 3600
+        timestamps = start + 3600 * np.arange(hours)
+
+        demand = model.predict(feature_matrix(snapshot, rows, timestamps))
+        demand = np.maximum(demand, 0).reshape(len(stop_ids), hours).round().astype(np.int64)
+        return {
+            'model_version': self.version,
+            'features_version': snapshot.version,
+            'start': int(start),
+            'hours': (timestamps // 3600 % 24).astype(np.int64).tolist(),
+            'stop_ids': list(stop_ids),
+            'demand': demand.tolist(),
+            'network_total': demand.sum(axis=0).tolist()
+        }
+
+
+class OnlineDemandModel:
+    """MLPRegressor trained with partial_fit, predicting demand relative to a stop's hourly average
+
+    Inputs are standardized with the spread of a reference feature matrix,
+    so mini-batches never move the scaling.
+    """
+
+    def __init__(self, reference):
+        self.center = reference.mean(axis=0) if len(reference) else np.zeros(len(FEATURES))
+        spread = reference.std(axis=0) if len(reference) else np.ones(len(FEATURES))
+        self.spread = np.where(spread > 0, spread, 1.0)
+        MLPRegressor = lazy_import('sklearn.neural_network').MLPRegressor
+        self.regressor = MLPRegressor(hidden_layer_sizes=(32, 16), learning_rate_init=0.005, random_state=42)
+
+    def _inputs(self, X):
+        return (X - self.center) / self.spread
+
+    @staticmethod
+    def _hourly_average(X):
+        return np.maximum(X[:, _DAILY], 1) / 24
+
+    def partial_fit(self, X, y):
+        self.regressor.partial_fit(self._inputs(X), y / self._hourly_average(X))
+        return self
+
+    def predict(self, X):
+        return np.maximum(self.regressor.predict(self._inputs(X)), 0) * self._hourly_average(X)
+
+
+class OnlineDemandTrainer:
+    """Incremental demand learning from live passenger counts
+
+    ``observe`` sums counts per (stop, hour). Every ``interval`` seconds
+    the background thread turns finished hours into examples, holds out a
+    ``holdout`` share of them as a rolling validation set (the newest
+    ``validation_size``) and ``partial_fit``s a shadow OnlineDemandModel on
+    the rest, replayed with the newest ``replay_size`` earlier hours for
+    ``epochs`` passes. A copy of the shadow model replaces the forecaster's model when
+    its mean absolute error on the validation set (of at least
+    ``min_validation`` hours) is lower.
+    """
+
+    def __init__(self, forecaster, interval=60, holdout=0.2, validation_size=2000, min_validation=20,
+                 replay_size=5000, epochs=5, warmup_epochs=20, max_open=100000, sensors=None, seed=42):
+        self.forecaster = forecaster
+        # Callable returning each sensor's nearest stop id, for the store's
+        # nearby_sensors feature (refreshed every step)
+        self.sensors = sensors
+        self.interval = interval
+        self.holdout = holdout
+        self.min_validation = min_validation
+        self.epochs = epochs
+        self.warmup_epochs = warmup_epochs
+        # Recent training hours, replayed alongside new ones
+        self.replay = deque(maxlen=replay_size)
+        # Counts summed per (stop_id, hour start) until the hour is over
+        self.max_open = max_open
+        self._open = {}
+        self._finished = deque()
+        self.validation = deque(maxlen=validation_size)
+        self.shadow = None
+        self.totals = {'counts': 0, 'examples': 0, 'trained': 0, 'unknown_stop': 0, 'dropped': 0,
+                       'steps': 0, 'swaps': 0}
+        self.errors = {'served': None, 'shadow': None}
+        self.last_step = None
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    # -- input -------------------------------------------------------------
+
+    def observe(self, stop_codes, timestamps, counts, stop_names):
+        """Add passenger ``counts`` counted at stops ``stop_names[stop_codes]``"""
+        stop_codes = np.asarray(stop_codes, dtype=np.int64)
+        counts = np.asarray(counts, dtype=np.float64)
+        hours = (np.asarray(timestamps, dtype=np.float64) // 3600).astype(np.int64)
+        hours = np.broadcast_to(hours, counts.shape)
+        keys, inverse = np.unique(np.stack([stop_codes, hours]), axis=1, return_inverse=True)
+        sums = np.bincount(inverse.reshape(-1), weights=counts, minlength=keys.shape[1])
+        with self._lock:
+            for code, hour, total in zip(keys[0].tolist(), keys[1].tolist(), sums.tolist()):
+                key = (stop_names[code], hour)
+                if key not in self._open and len(self._open) >= self.max_open:
+                    self.totals['dropped'] += 1
+                    continue
+                self._open[key] = self._open.get(key, 0.0) + total
+            self.totals['counts'] += len(counts)
+
+    def observe_value(self, stop_id, timestamp, count):
+        """``observe`` for a single count"""
+        key = (stop_id, int(timestamp // 3600))
+        with self._lock:
+            if key not in self._open and len(self._open) >= self.max_open:
+                self.totals['dropped'] += 1
+                return
+            self._open[key] = self._open.get(key, 0.0) + count
+            self.totals['counts'] += 1
+
+    def _close_hours(self, now):
+        current = int(now // 3600)
+        with self._lock:
+            finished = [key for key in self._open if key[1] < current]
+            for key in finished:
+                self._finished.append((key[0], key[1] * 3600, self._open.pop(key)))
+            examples, self._finished = list(self._finished), deque()
+        return examples
+
+    # -- training ----------------------------------------------------------
+
+    def train_step(self, now=None):
+        """Learn from the hours finished since the last step; returns the step summary"""
+        examples = self._close_hours(time.time() if now is None else now)
+        forecaster = self.forecaster
+        if self.sensors is not None:
+            forecaster.store.set_nearby_sensors(self.sensors())
+        if not forecaster.fitted:
+            # Nothing to compare against yet; keep the examples for later
+            with self._lock:
+                self._finished.extendleft(reversed(examples))
+            return None
+        stop_ids, timestamps, counts = zip(*examples) if examples else ((), (), ())
+        X, known = forecaster.features(stop_ids, timestamps)
+        y = np.asarray(counts, dtype=np.float64)[known]
+        if examples:
+            # After the features were taken, so an hour never predicts itself
+            forecaster.store.record_boardings(stop_ids, timestamps, counts)
+        self.totals['unknown_stop'] += int((~known).sum())
+        self.totals['examples'] += len(y)
+
+        held_out = self._rng.random(len(y)) < self.holdout
+        self.validation.extend(zip(X[held_out], y[held_out]))
+        X, y = X[~held_out], y[~held_out]
+
+        if self.shadow is None:
+            # Start from the stops' synthetic history rather than from scratch
+            X_prior, y_prior = training_set(forecaster.store.snapshot())
+            self.shadow = OnlineDemandModel(X_prior)
+            for _ in range(self.warmup_epochs):
+                self.shadow.partial_fit(X_prior, y_prior)
+        if len(y):
+            self.replay.extend(zip(X, y))
+            X_train = np.array([row for row, _ in self.replay])
+            y_train = np.array([value for _, value in self.replay])
+            for _ in range(self.epochs):
+                order = self._rng.permutation(len(y_train))
+                self.shadow.partial_fit(X_train[order], y_train[order])
+            self.totals['trained'] += len(y)
+
+        swapped = False
+        if self.validation:
+            X_valid = np.array([row for row, _ in self.validation])
+            y_valid = np.array([value for _, value in self.validation])
+            served = float(np.abs(forecaster.model.predict(X_valid) - y_valid).mean())
+            shadow = float(np.abs(self.shadow.predict(X_valid) - y_valid).mean())
+            self.errors = {'served': round(served, 3), 'shadow': round(shadow, 3)}
+            metrics.DEMAND_MODEL_ERROR.set(served, model='served')
+            metrics.DEMAND_MODEL_ERROR.set(shadow, model='shadow')
+            if shadow < served and len(self.validation) >= self.min_validation:
+                forecaster.swap(copy.deepcopy(self.shadow))
+                self.totals['swaps'] += 1
+                metrics.DEMAND_MODEL_SWAPS.inc()
+                swapped = True
+        self.totals['steps'] += 1
+        self.last_step = time.time()
+        return {'examples': len(held_out), 'trained': len(y), 'validation': len(self.validation),
+                'errors': dict(self.errors), 'swapped': swapped, 'model_version': forecaster.version}
+
+    # -- lifecycle ---------------------------------------------------------
+
+    def running(self):
+        # A thread started before os.fork() is not alive in the child
+        return self._pid == os.getpid() and self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Train every ``interval`` seconds in a background thread (once per process)"""
+        if self.running():
+            return False
+        if not is_available('sklearn'):
+            print("⚠️ scikit-learn is not installed; online demand training is off")
+            return False
+        self._pid = os.getpid()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._train_forever, name='demand-trainer', daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout)
+        self._thread = None
+
+    def _train_forever(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.train_step()
+            except Exception as e:
+                print(f"⚠️ Demand model training step failed: {e}")
+
+    def stats(self):
+        with self._lock:
+            open_hours = len(self._open)
+        return {
+            'running': self.running(),
+            'interval_seconds': self.interval,
+            'model_version': self.forecaster.version,
+            'model': type(self.forecaster.model).__name__ if self.forecaster.fitted else None,
+            'open_hours': open_hours,
+            'validation_examples': len(self.validation),
+            'mean_absolute_error': dict(self.errors),
+            'last_step': self.last_step,
+            'totals': dict(self.totals)
+        }
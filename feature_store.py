@@ -0,0 +1,258 @@
+"""
+Per-stop feature store shared by the demand models and the digital twin.
+
+Features live in two NumPy arrays with one row per stop:
+
+    stops  (stops, STOP_COLUMNS)      location, daily volume, routes
+                                      serving the stop, closeness
+                                      centrality, nearby sensors
+    hours  (stops, 24, HOUR_COLUMNS)  boardings per hour of day, departures
+                                      and headway
+
+Boardings start from the stop's daily volume spread over DAILY_PROFILE and
+become a running mean as hourly counts are recorded. Departures and headways
+come from route frequencies, or from GTFS stop_times when a timetable is set.
+
+Updates touch only what changed: recorded hours update their cells, a
+timetable recomputes departures and headways, and new routes recompute
+centrality. Each update is published as a new FeatureSnapshot version with
+read-only copies of the arrays, so readers slice a consistent version
+instead of recomputing features per model call.
+"""
+
+import threading
+import time
+
+import numpy as np
+
+from lazy_imports import lazy_import
+
+# Relative demand per hour of day, with morning and evening peaks
+DAILY_PROFILE = np.array([0.2, 0.1, 0.1, 0.2, 0.5, 1.5, 4.0, 8.5, 9.0, 6.0, 5.0, 5.0,
+                          5.5, 5.5, 5.0, 5.5, 7.0, 9.0, 8.0, 5.0, 3.0, 2.0, 1.2, 0.6])
+HOURLY_SHARE = DAILY_PROFILE / DAILY_PROFILE.sum()
+
+STOP_COLUMNS = ('stop_lat', 'stop_lon', 'daily_passengers', 'route_count', 'closeness', 'nearby_sensors')
+HOUR_COLUMNS = ('boardings', 'observed_hours', 'departures', 'headway_minutes')
+
+# Route frequencies apply over these hours when no timetable is loaded
+SERVICE_HOURS = (5, 23)
+# Headway reported for hours without service (minutes)
+MAX_HEADWAY = 120.0
+# The profile prior counts as this many observed hours
+PRIOR_HOURS = 1.0
+
+
+class FeatureSnapshot:
+    """One published version of the feature store; the arrays are read-only"""
+
+    def __init__(self, version, stop_ids, stop_index, stops, hours):
+        self.version = version
+        self.stop_ids = stop_ids
+        self.stop_index = stop_index
+        self.stops = stops
+        self.hours = hours
+        self.published = time.time()
+
+    def rows(self, stop_ids):
+        """Row of each stop id; KeyError for unknown stops"""
+        unknown = [stop_id for stop_id in stop_ids if stop_id not in self.stop_index]
+        if unknown:
+            raise KeyError(f"Unknown stop {', '.join(map(str, unknown))}")
+        return np.array([self.stop_index[stop_id] for stop_id in stop_ids], dtype=np.int64)
+
+    def stop_column(self, name):
+        return self.stops[:, STOP_COLUMNS.index(name)]
+
+    def hour_column(self, name):
+        return self.hours[:, :, HOUR_COLUMNS.index(name)]
+
+    def stop_features(self, stop_id):
+        """All features of one stop as plain lists"""
+        row = self.rows([stop_id])[0]
+        return {
+            'version': self.version,
+            'stop_id': stop_id,
+            **{name: round(float(value), 4) for name, value in zip(STOP_COLUMNS, self.stops[row])},
+            'hourly': {name: self.hours[row, :, i].round(2).tolist() for i, name in enumerate(HOUR_COLUMNS)}
+        }
+
+
+def _frozen(array):
+    array = array.copy()
+    array.flags.writeable = False
+    return array
+
+
+def _closeness(count, edges):
+    """Closeness centrality of each stop on the (undirected, unweighted) route graph"""
+    closeness = np.zeros(count)
+    if count < 2 or not len(edges):
+        return closeness
+    sparse = lazy_import('scipy.sparse')
+    csgraph = lazy_import('scipy.sparse.csgraph')
+    graph = sparse.coo_matrix((np.ones(len(edges)), (edges[:, 0], edges[:, 1])), shape=(count, count)).tocsr()
+    hops = csgraph.shortest_path(graph, directed=False, unweighted=True)
+    reachable = np.isfinite(hops)
+    others = reachable.sum(axis=1) - 1
+    total = np.where(reachable, hops, 0).sum(axis=1)
+    # Scaled by the reachable share, so small components do not look central
+    served = total > 0
+    closeness[served] = others[served] / total[served] * others[served] / (count - 1)
+    return closeness
+
+
+class StopFeatureStore:
+    """Versioned per-stop and per-stop-hour feature arrays"""
+
+    def __init__(self, max_headway=MAX_HEADWAY):
+        self.max_headway = max_headway
+        self.version = 0
+        self.stop_ids = []
+        self._stop_index = {}
+        self._stops = np.zeros((0, len(STOP_COLUMNS)))
+        self._hours = np.zeros((0, 24, len(HOUR_COLUMNS)))
+        self._timetable = False
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._publish()
+
+    def snapshot(self):
+        """Latest published version"""
+        return self._snapshot
+
+    def _publish(self):
+        self.version += 1
+        self._snapshot = FeatureSnapshot(self.version, self.stop_ids, self._stop_index,
+                                         _frozen(self._stops), _frozen(self._hours))
+        return self._snapshot
+
+    # -- updates -----------------------------------------------------------
+
+    def load_network(self, stops, routes=None):
+        """Rebuild for a stop table (and routes)
+
+        Recorded boardings of stops that remain are kept, and so are their
+        timetable departures and headways when a timetable is loaded.
+        """
+        stop_ids = list(stops['stop_id'])
+        count = len(stop_ids)
+        stop_index = {stop_id: i for i, stop_id in enumerate(stop_ids)}
+        stop_array = np.zeros((count, len(STOP_COLUMNS)))
+        for i, name in enumerate(STOP_COLUMNS[:3]):
+            stop_array[:, i] = np.asarray(stops[name], dtype=np.float64)
+        hours = np.zeros((count, 24, len(HOUR_COLUMNS)))
+        hours[:, :, 0] = stop_array[:, 2:3] * HOURLY_SHARE
+
+        with self._lock:
+            kept = np.array([self._stop_index.get(stop_id, -1) for stop_id in stop_ids], dtype=np.int64)
+            known = kept >= 0
+            hours[known, :, :2] = self._hours[kept[known], :, :2]
+            stop_array[known, 5] = self._stops[kept[known], 5]
+            if self._timetable:
+                # Stops the timetable does not know have no departures
+                hours[:, :, 3] = self.max_headway
+                hours[known, :, 2:] = self._hours[kept[known], :, 2:]
+            self.stop_ids, self._stop_index = stop_ids, stop_index
+            self._stops, self._hours = stop_array, hours
+            if routes is not None:
+                self._set_routes(routes)
+            elif not self._timetable:
+                self._hours[:, :, 3] = self.max_headway
+            return self._publish()
+
+    def set_routes(self, routes):
+        """Recompute route counts, centrality and (without a timetable) departures from routes"""
+        with self._lock:
+            self._set_routes(routes)
+            return self._publish()
+
+    def _set_routes(self, routes):
+        count = len(self.stop_ids)
+        index = self._stop_index
+        terminals = np.array([[index.get(start, -1), index.get(end, -1)]
+                              for start, end in zip(routes['start_stop'], routes['end_stop'])],
+                             dtype=np.int64).reshape(-1, 2)
+        frequency = np.asarray(routes['current_frequency'], dtype=np.float64) \
+            if 'current_frequency' in routes else np.full(len(terminals), 10.0)
+        served = terminals[terminals >= 0]
+        self._stops[:, 3] = np.bincount(served, minlength=count)[:count]
+        edges = terminals[(terminals >= 0).all(axis=1)]
+        self._stops[:, 4] = _closeness(count, edges)
+        if not self._timetable:
+            # Each route departs every current_frequency minutes from both
+            # terminals during the service day
+            per_hour = np.repeat(60.0 / np.maximum(frequency, 1), 2)
+            stops = terminals.reshape(-1)
+            valid = stops >= 0
+            departures = np.zeros((count, 24))
+            departures[:, SERVICE_HOURS[0]:SERVICE_HOURS[1]] = np.bincount(
+                stops[valid], weights=per_hour[valid], minlength=count)[:count, None]
+            self._set_departures(departures)
+
+    def set_timetable(self, stop_times):
+        """Departures and headways per stop and hour from GTFS ``stop_times``"""
+        index = self._stop_index
+        with self._lock:
+            count = len(self.stop_ids)
+            stops = np.array([index.get(stop_id, -1) for stop_id in stop_times['stop_id']], dtype=np.int64)
+            # GTFS times may run past 24:00:00 for trips after midnight
+            hours = np.array([int(str(value).split(':')[0]) % 24 for value in stop_times['departure_time']],
+                             dtype=np.int64)
+            valid = stops >= 0
+            departures = np.bincount(stops[valid] * 24 + hours[valid], minlength=count * 24)
+            self._timetable = True
+            self._set_departures(departures.reshape(count, 24).astype(np.float64))
+            return self._publish()
+
+    def _set_departures(self, departures):
+        self._hours[:, :, 2] = departures
+        self._hours[:, :, 3] = np.where(departures > 0, 60.0 / np.maximum(departures, 1e-9), self.max_headway)
+        np.minimum(self._hours[:, :, 3], self.max_headway, out=self._hours[:, :, 3])
+
+    def record_boardings(self, stop_ids, timestamps, counts):
+        """Fold observed hourly boardings into each (stop, hour of day) running mean
+
+        Returns how many observations belonged to known stops.
+        """
+        with self._lock:
+            count = len(self.stop_ids)
+            rows = np.array([self._stop_index.get(stop_id, -1) for stop_id in stop_ids], dtype=np.int64)
+            known = rows >= 0
+            if not known.any():
+                return 0
+            hours = (np.asarray(timestamps, dtype=np.float64)[known] // 3600 % 24).astype(np.int64)
+            cells = rows[known] * 24 + hours
+            observed = np.bincount(cells, minlength=count * 24).reshape(count, 24)
+            totals = np.bincount(cells, weights=np.asarray(counts, dtype=np.float64)[known],
+                                 minlength=count * 24).reshape(count, 24)
+            touched = observed > 0
+            boardings, seen = self._hours[:, :, 0], self._hours[:, :, 1]
+            weight = seen[touched] + PRIOR_HOURS
+            boardings[touched] = (boardings[touched] * weight + totals[touched]) / (weight + observed[touched])
+            seen[touched] += observed[touched]
+            self._publish()
+            return int(known.sum())
+
+    def set_nearby_sensors(self, stop_ids):
+        """Count sensors per stop from each sensor's nearest stop id"""
+        with self._lock:
+            rows = np.array([self._stop_index.get(stop_id, -1) for stop_id in stop_ids], dtype=np.int64)
+            nearby = np.bincount(rows[rows >= 0], minlength=len(self.stop_ids))
+            if np.array_equal(nearby, self._stops[:, 5]):
+                return self._snapshot
+            self._stops[:, 5] = nearby
+            return self._publish()
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {
+            'version': snapshot.version,
+            'published': snapshot.published,
+            'stops': len(snapshot.stop_ids),
+            'stop_columns': list(STOP_COLUMNS),
+            'hour_columns': list(HOUR_COLUMNS),
+            'observed_cells': int((snapshot.hour_column('observed_hours') > 0).sum()),
+            'timetable': self._timetable,
+            'bytes': snapshot.stops.nbytes + snapshot.hours.nbytes
+        }
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Edge pre-aggregation for IoT sensors.
+
+An edge node collects its sensors' raw readings locally and turns them into
+one mergeable summary cell per (sensor, ``width``-second bucket): reading
+count, per-field sum / count / min / max and a QuantileSketch. Closed
+buckets are flushed as a small JSON payload that the central
+IoTDataProcessor merges with ``merge_edge_summary``, so the central process
+handles one cell per sensor per bucket instead of every reading.
+
+Run a simulated edge node as a local process against a running server:
+
+    python iot_edge.py --central http://localhost:5000 --edge-id EDGE_01 \\
+        --sensors IOT_000,IOT_001 --rate 2000 --width 10 --duration 60
+"""
+
+import argparse
+import json
+import random
+import time
+import urllib.request
+
+import numpy as np
+
+from iot_stream import QuantileSketch, bucket_stats, merge_sketches
+
+
+class EdgeAggregator:
+    """Raw readings in, mergeable per-sensor bucket summaries out"""
+
+    def __init__(self, edge_id, width=10):
+        self.edge_id = edge_id
+        self.width = width
+        # (sensor_id, key) -> [count, {field: [sum, count, min, max]}, {field: QuantileSketch}]
+        self.cells = {}
+        self.readings = 0
+        self._sensor_index = {}
+        self._sensor_ids = []
+
+    def _cell(self, sensor_id, key):
+        cell = self.cells.get((sensor_id, key))
+        if cell is None:
+            cell = self.cells[(sensor_id, key)] = [0, {}, {}]
+        return cell
+
+    def add(self, sensor_id, timestamp, data):
+        """Add one raw reading"""
+        cell = self._cell(sensor_id, int(timestamp // self.width))
+        cell[0] += 1
+        for field, value in data.items():
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                continue
+            stats = cell[1].get(field)
+            if stats is None:
+                cell[1][field] = [value, 1, value, value]
+                cell[2][field] = QuantileSketch()
+            else:
+                stats[0] += value
+                stats[1] += 1
+                stats[2] = min(stats[2], value)
+                stats[3] = max(stats[3], value)
+            cell[2][field].add(value)
+        self.readings += 1
+
+    def add_batch(self, sensor_ids, timestamps, data):
+        """Add many readings at once (parallel lists of sensor ids, timestamps and data dicts)"""
+        if not sensor_ids:
+            return
+        index = self._sensor_index
+        for sensor_id in set(sensor_ids) - index.keys():
+            index[sensor_id] = len(self._sensor_ids)
+            self._sensor_ids.append(sensor_id)
+        groups = np.array([index[sensor_id] for sensor_id in sensor_ids], dtype=np.int64)
+        keys = np.floor(np.asarray(timestamps, dtype=np.float64) / self.width).astype(np.int64)
+        columns = {}
+        for field in set().union(*map(dict.keys, data)):
+            values = np.array([value if type(value) in (int, float) else np.nan
+                               for value in (values.get(field) for values in data)], dtype=np.float64)
+            present = np.flatnonzero(np.isfinite(values))
+            if len(present):
+                columns[field] = (present, values[present])
+
+        for group, key, count, fields, sketches in bucket_stats(groups, keys, columns, sketches=True):
+            cell = self._cell(self._sensor_ids[group], key)
+            cell[0] += count
+            for field, (total, present, low, high) in fields.items():
+                stats = cell[1].get(field)
+                if stats is None:
+                    cell[1][field] = [total, present, low, high]
+                else:
+                    stats[0] += total
+                    stats[1] += present
+                    stats[2] = min(stats[2], low)
+                    stats[3] = max(stats[3], high)
+            merge_sketches(cell[2], sketches)
+        self.readings += len(sensor_ids)
+
+    def flush(self, now=None, everything=False):
+        """Summary payload of the closed buckets (all buckets with ``everything``), removing them"""
+        current = int((time.time() if now is None else now) // self.width)
+        ready = [cell_key for cell_key in self.cells if everything or cell_key[1] < current]
+        cells = []
+        for sensor_id, key in sorted(ready, key=lambda cell_key: cell_key[1]):
+            count, fields, sketches = self.cells.pop((sensor_id, key))
+            cells.append({
+                'sensor_id': sensor_id,
+                'start': key * self.width,
+                'count': count,
+                'fields': fields,
+                'sketches': {field: sketch.to_dict() for field, sketch in sketches.items()}
+            })
+        readings = sum(cell['count'] for cell in cells)
+        return {'edge_id': self.edge_id, 'width': self.width, 'readings': readings, 'cells': cells}
+
+
+def _post(url, payload):
+    request = urllib.request.Request(url, data=json.dumps(payload).encode(),
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return json.loads(response.read())
+
+
+def run_edge_node(central, edge_id, sensors, rate, width, duration, location=None):
+    """Simulate ``rate`` readings/s across ``sensors`` and ship a summary every ``width`` seconds"""
+    _post(f'{central}/api/iot/edge/register', {'edge_id': edge_id, 'sensors': sensors, 'location': location})
+    edge = EdgeAggregator(edge_id, width)
+    started = time.time()
+    sent_bytes = raw_bytes = 0
+    while time.time() - started < duration:
+        tick = time.time()
+        count = max(1, int(rate * 0.1))
+        sensor_ids = [random.choice(sensors) for _ in range(count)]
+        timestamps = [tick] * count
+        data = [{'value': random.gauss(50, 10)} for _ in range(count)]
+        raw_bytes += sum(len(json.dumps({'sensor_id': s, 'timestamp': tick, 'data': d}))
+                         for s, d in zip(sensor_ids[:10], data[:10])) * count / min(count, 10)
+        edge.add_batch(sensor_ids, timestamps, data)
+        payload = edge.flush()
+        if payload['cells']:
+            sent_bytes += len(json.dumps(payload))
+            result = _post(f'{central}/api/iot/edge/summary', payload)
+            print(f"📡 {edge_id}: {payload['readings']} readings in {len(payload['cells'])} cells -> "
+                  f"{result.get('merged', result)}")
+        time.sleep(max(0.0, 0.1 - (time.time() - tick)))
+    payload = edge.flush(everything=True)
+    if payload['cells']:
+        sent_bytes += len(json.dumps(payload))
+        _post(f'{central}/api/iot/edge/summary', payload)
+    print(f"✅ {edge_id}: {edge.readings} readings, {sent_bytes / 1024:.1f} KB sent "
+          f"instead of ~{raw_bytes / 1024:.1f} KB of raw readings")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulated IoT edge node')
+    parser.add_argument('--central', default='http://localhost:5000')
+    parser.add_argument('--edge-id', default='EDGE_01')
+    parser.add_argument('--sensors', default='IOT_000,IOT_001,IOT_002')
+    parser.add_argument('--rate', type=float, default=1000, help='readings per second')
+    parser.add_argument('--width', type=float, default=10, help='summary bucket seconds')
+    parser.add_argument('--duration', type=float, default=60)
+    args = parser.parse_args()
+    run_edge_node(args.central, args.edge_id, args.sensors.split(','), args.rate, args.width, args.duration)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,313 @@
+"""
+Staged, bounded ingest pipeline for IoT readings.
+
+    receive (HTTP thread) -> parse/validate -> enrich -> store
+
+The web handler only queues the raw request body and returns. Worker
+threads parse and validate it (IoTDataProcessor.validate_batch), tag
+readings with their sensor's nearest stop (enrich_batch) and record them
+(record_batch). Stages are connected by bounded queues, and the raw bytes
+waiting to be parsed are capped too. When the pipeline is full, submit()
+raises PipelineSaturated with a Retry-After estimate instead of letting a
+burst pile up in memory or hold web workers.
+"""
+
+import itertools
+import json
+import math
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+
+
+class PipelineSaturated(Exception):
+    """The pipeline cannot take more work right now; retry after ``retry_after`` seconds"""
+
+    def __init__(self, retry_after, message='IoT ingest pipeline is saturated'):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_ndjson(lines):
+    """Readings from NDJSON lines (bytes), and how many lines were not valid JSON"""
+    try:
+        # One parse for the whole batch; fall back to per-line on any error
+        readings = json.loads(b'[' + b','.join(lines) + b']')
+        if len(readings) == len(lines):
+            return readings, 0
+    except ValueError:
+        pass
+    readings = []
+    for line in lines:
+        try:
+            readings.append(json.loads(line))
+        except ValueError:
+            pass
+    return readings, len(lines) - len(readings)
+
+
+def parse_payload(payload, mimetype):
+    """Readings and malformed-line count from a JSON array / {"readings": [...]} or NDJSON body"""
+    if mimetype in NDJSON_MIMETYPES:
+        lines = [line for line in payload.split(b'\n') if line.strip()]
+        return parse_ndjson(lines)
+    try:
+        body = json.loads(payload)
+    except ValueError:
+        raise ValueError('Body is not valid JSON')
+    readings = body.get('readings') if isinstance(body, dict) else body
+    if not isinstance(readings, list):
+        raise ValueError('Expected a JSON array of readings or an application/x-ndjson body')
+    return readings, 0
+
+
+class IngestPipeline:
+    """Bounded multi-stage ingest in front of an IoTDataProcessor"""
+
+    STAGES = ('parse', 'enrich', 'store')
+
+    def __init__(self, processor, stops=None, queue_size=32, max_queued_bytes=64 * 1024 * 1024,
+                 batch_size=5000, parse_workers=2, enrich_workers=1, max_jobs=1000):
+        self.processor = processor
+        # Callable returning the current stops (anything with stop_id /
+        # stop_lat / stop_lon columns), checked before each enrich
+        self.stops = stops
+        self.queue_size = queue_size
+        self.max_queued_bytes = max_queued_bytes
+        self.batch_size = batch_size
+        # Recording takes the processor lock, so one store worker is enough
+        self.workers = {'parse': parse_workers, 'enrich': enrich_workers, 'store': 1}
+        self.queues = {stage: queue.Queue(maxsize=queue_size) for stage in self.STAGES}
+        self.max_jobs = max_jobs
+        self.jobs = OrderedDict()
+        self.queued_bytes = 0
+        self.totals = {'jobs': 0, 'received': 0, 'accepted': 0, 'rejected': 0, 'saturated': 0, 'failed': 0}
+        # Parse throughput (bytes/s, smoothed) for Retry-After estimates
+        self.parse_rate = None
+        self._ids = itertools.count(1)
+        self._threads = []
+        self._pid = None
+        self._stops_source = None
+        self._lock = threading.Lock()
+        self._done = threading.Condition(self._lock)
+
+    # -- lifecycle ---------------------------------------------------------
+
+    def running(self):
+        # Threads started before os.fork() are not alive in the child
+        return self._pid == os.getpid() and all(thread.is_alive() for thread in self._threads)
+
+    def start(self):
+        """Start the stage worker threads (once per process)"""
+        with self._lock:
+            if self.running():
+                return False
+            if self._pid != os.getpid():
+                # Queued work belonged to the parent process
+                self.queues = {stage: queue.Queue(maxsize=self.queue_size) for stage in self.STAGES}
+                self.queued_bytes = 0
+            self._pid = os.getpid()
+            self._threads = []
+            for stage in self.STAGES:
+                for number in range(self.workers[stage]):
+                    thread = threading.Thread(target=self._work, args=(stage,), daemon=True,
+                                              name=f'iot-{stage}-{number}')
+                    thread.start()
+                    self._threads.append(thread)
+            return True
+
+    def stop(self, timeout=5):
+        """Let queued work finish, then stop the workers"""
+        if self._pid != os.getpid():
+            self._threads = []
+            return
+        for stage in self.STAGES:
+            for _ in range(self.workers[stage]):
+                self.queues[stage].put(None)
+            for thread in [thread for thread in self._threads if thread.name.startswith(f'iot-{stage}-')]:
+                thread.join(timeout)
+        self._threads = []
+
+    # -- receive -----------------------------------------------------------
+
+    def retry_after(self):
+        """Seconds until the queued backlog should have drained"""
+        rate = self.parse_rate or 1024 * 1024
+        return max(1, min(60, math.ceil(self.queued_bytes / rate)))
+
+    def submit(self, payload, mimetype='application/json'):
+        """Queue a raw request body; returns its job id or raises PipelineSaturated"""
+        if not self.running():
+            self.start()
+        size = len(payload)
+        with self._lock:
+            if size > self.max_queued_bytes:
+                raise ValueError(f'Payload of {size} bytes exceeds the {self.max_queued_bytes}-byte ingest limit')
+            if self.queued_bytes + size > self.max_queued_bytes or self.queues['parse'].full():
+                self.totals['saturated'] += 1
+                raise PipelineSaturated(self.retry_after())
+            job_id = next(self._ids)
+            self.queued_bytes += size
+            self._add_job(job_id)
+        try:
+            self.queues['parse'].put_nowait((job_id, payload, mimetype))
+        except queue.Full:
+            with self._lock:
+                self.queued_bytes -= size
+                self.jobs.pop(job_id, None)
+                self.totals['saturated'] += 1
+            raise PipelineSaturated(self.retry_after())
+        self._report_depths()
+        return job_id
+
+    def _add_job(self, job_id):
+        self.jobs[job_id] = {
+            'id': job_id,
+            'status': 'queued',
+            'received': 0,
+            'accepted': 0,
+            'rejected': 0,
+            'rejections': {},
+            'submitted': time.time(),
+            'completed': None,
+            'remaining': None
+        }
+        self.totals['jobs'] += 1
+        while len(self.jobs) > self.max_jobs:
+            self.jobs.popitem(last=False)
+
+    # -- stages ------------------------------------------------------------
+
+    def _work(self, stage):
+        handler = getattr(self, f'_{stage}')
+        source = self.queues[stage]
+        while True:
+            item = source.get()
+            if item is None:
+                return
+            started = time.perf_counter()
+            try:
+                handler(*item)
+            except Exception as e:
+                self._fail(item[0], e)
+            metrics.IOT_PIPELINE_STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage)
+            self._report_depths()
+
+    def _parse(self, job_id, payload, mimetype):
+        started = time.perf_counter()
+        try:
+            readings, malformed = parse_payload(payload, mimetype)
+        finally:
+            with self._lock:
+                self.queued_bytes -= len(payload)
+                elapsed = time.perf_counter() - started
+                if elapsed > 0:
+                    rate = len(payload) / elapsed
+                    self.parse_rate = rate if self.parse_rate is None else 0.8 * self.parse_rate + 0.2 * rate
+
+        chunks = [readings[i:i + self.batch_size] for i in range(0, len(readings), self.batch_size)]
+        with self._lock:
+            self.totals['received'] += malformed
+            self.totals['rejected'] += malformed
+            job = self.jobs.get(job_id)
+            if job is not None:
+                job['status'] = 'processing'
+                job['remaining'] = len(chunks)
+                if malformed:
+                    job['received'] += malformed
+                    job['rejected'] += malformed
+                    job['rejections']['invalid_json'] = malformed
+        if malformed:
+            metrics.IOT_READINGS_REJECTED.inc(malformed, reason='invalid_json')
+        if not chunks:
+            self._finish(job_id, None)
+        for chunk in chunks:
+            batch = self.processor.validate_batch(chunk)
+            # Blocks while enrich is backed up, which fills the parse queue
+            # and makes submit() push back on clients
+            self.queues['enrich'].put((job_id, batch))
+
+    def _enrich(self, job_id, batch):
+        stops = self.stops() if self.stops is not None else None
+        if stops is not None and stops is not self._stops_source:
+            self.processor.set_stops(stops['stop_id'], stops['stop_lat'], stops['stop_lon'])
+            self._stops_source = stops
+        self.queues['store'].put((job_id, self.processor.enrich_batch(batch)))
+
+    def _store(self, job_id, batch):
+        self._finish(job_id, self.processor.record_batch(batch))
+
+    def _finish(self, job_id, result):
+        with self._lock:
+            if result is not None:
+                for key in ('received', 'accepted', 'rejected'):
+                    self.totals[key] += result[key]
+            job = self.jobs.get(job_id)
+            if job is None:
+                return
+            if result is not None:
+                for key in ('received', 'accepted', 'rejected'):
+                    job[key] += result[key]
+                for reason, count in result['rejections'].items():
+                    job['rejections'][reason] = job['rejections'].get(reason, 0) + count
+                job['remaining'] -= 1
+            if not job['remaining'] and job['status'] != 'failed':
+                job['status'] = 'done'
+                job['completed'] = time.time()
+                self._done.notify_all()
+
+    def _fail(self, job_id, error):
+        with self._lock:
+            self.totals['failed'] += 1
+            job = self.jobs.get(job_id)
+            if job is not None:
+                job['status'] = 'failed'
+                job['error'] = str(error)
+                job['completed'] = time.time()
+                self._done.notify_all()
+
+    def _report_depths(self):
+        for stage, stage_queue in self.queues.items():
+            metrics.IOT_PIPELINE_QUEUE_DEPTH.set(stage_queue.qsize(), stage=stage)
+        metrics.IOT_PIPELINE_QUEUED_BYTES.set(self.queued_bytes)
+
+    # -- queries -----------------------------------------------------------
+
+    def job(self, job_id):
+        with self._lock:
+            job = self.jobs.get(job_id)
+            return dict(job, rejections=dict(job['rejections'])) if job is not None else None
+
+    def wait(self, job_ids, timeout):
+        """Wait until the jobs are done or failed (or the timeout passes); returns their states"""
+        deadline = time.monotonic() + timeout
+        with self._done:
+            while True:
+                pending = [job_id for job_id in job_ids
+                           if job_id in self.jobs and self.jobs[job_id]['status'] in ('queued', 'processing')]
+                remaining = deadline - time.monotonic()
+                if not pending or remaining <= 0:
+                    break
+                self._done.wait(remaining)
+        return [self.job(job_id) for job_id in job_ids]
+
+    def stats(self):
+        with self._lock:
+            totals = dict(self.totals)
+            queued_bytes = self.queued_bytes
+        return {
+            'running': self.running(),
+            'queues': {stage: {'depth': stage_queue.qsize(), 'capacity': self.queue_size,
+                               'workers': self.workers[stage]}
+                       for stage, stage_queue in self.queues.items()},
+            'queued_bytes': queued_bytes,
+            'max_queued_bytes': self.max_queued_bytes,
+            'parse_bytes_per_second': round(self.parse_rate) if self.parse_rate else None,
+            'totals': totals
+        }
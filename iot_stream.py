@@ -0,0 +1,473 @@
+"""
+Sliding-window aggregates for the IoT reading stream.
+
+A WindowAggregate keeps the readings of the last ``window`` seconds as a
+short run of fixed-width time buckets, each holding a count and per-field
+sum / min / max. The window's running count and sums are updated as readings
+arrive and whole buckets expire, so adding a reading and summarizing the
+window both cost the same however many readings have been seen. Memory is
+bounded by the number of buckets, not by the reading rate.
+
+Buckets also carry a QuantileSketch per field, so summaries report
+percentiles. Every piece (bucket stats and sketches) is mergeable, which
+lets edge nodes pre-aggregate readings and ship only the summaries.
+"""
+
+import math
+from collections import deque
+
+import numpy as np
+
+
+def numeric_fields(data):
+    """The numeric (non-boolean) values of a reading's data dict"""
+    return {
+        field: value for field, value in data.items()
+        if isinstance(value, (int, float)) and not isinstance(value, bool)
+    }
+
+
+class QuantileSketch:
+    """Mergeable quantile sketch with relative error ALPHA (DDSketch-style log buckets)
+
+    A value v is counted in bucket ceil(log|v| / log GAMMA), kept as the
+    signed code 2 * bucket (+1 for negatives). Two sketches merge by adding
+    bucket counts, so per-bucket, per-window and per-edge sketches combine
+    into exactly the sketch of all their readings.
+    """
+
+    __slots__ = ('bins', 'count')
+
+    ALPHA = 0.01
+    GAMMA = (1 + ALPHA) / (1 - ALPHA)
+    LOG_GAMMA = math.log(GAMMA)
+    # |v| below MIN counts as zero; bucket numbers are clamped to +-LIMIT
+    MIN = 1e-9
+    LIMIT = 4095
+
+    def __init__(self, bins=None):
+        self.bins = bins if bins is not None else {}
+        self.count = sum(self.bins.values())
+
+    @classmethod
+    def code(cls, value):
+        magnitude = abs(value)
+        if magnitude < cls.MIN:
+            return 2 * math.ceil(math.log(cls.MIN) / cls.LOG_GAMMA)
+        bucket = max(-cls.LIMIT, min(cls.LIMIT, math.ceil(math.log(magnitude) / cls.LOG_GAMMA)))
+        return 2 * bucket + (value < 0)
+
+    @classmethod
+    def codes(cls, values):
+        """``code`` for a float array"""
+        magnitude = np.abs(values)
+        buckets = np.clip(np.ceil(np.log(np.maximum(magnitude, cls.MIN)) / cls.LOG_GAMMA), -cls.LIMIT, cls.LIMIT)
+        return 2 * buckets.astype(np.int64) + ((values < 0) & (magnitude >= cls.MIN))
+
+    @classmethod
+    def value(cls, code):
+        """Representative value of a bucket code (within ALPHA of every value in it)"""
+        bucket, negative = code >> 1, code & 1
+        value = 2 * cls.GAMMA ** bucket / (cls.GAMMA + 1)
+        if value < cls.MIN:
+            return 0.0
+        return -value if negative else value
+
+    def add(self, value, count=1):
+        code = self.code(value)
+        self.bins[code] = self.bins.get(code, 0) + count
+        self.count += count
+
+    def merge(self, other):
+        bins = self.bins
+        for code, count in other.bins.items():
+            bins[code] = bins.get(code, 0) + count
+        self.count += other.count
+
+    def quantiles(self, qs=(0.5, 0.9, 0.99)):
+        """Estimated values at each quantile in ``qs`` (ascending)"""
+        if not self.count:
+            return [None] * len(qs)
+        ordered = sorted((self.value(code), count) for code, count in self.bins.items())
+        results = []
+        seen = 0
+        position = 0
+        for q in qs:
+            rank = q * (self.count - 1)
+            while seen + ordered[position][1] <= rank:
+                seen += ordered[position][1]
+                position += 1
+            results.append(round(ordered[position][0], 4))
+        return results
+
+    def to_dict(self):
+        return {str(code): count for code, count in self.bins.items()}
+
+    @classmethod
+    def from_dict(cls, bins):
+        """Sketch from ``to_dict`` output; ValueError for codes no value can produce"""
+        sketch = cls({int(code): int(count) for code, count in bins.items()})
+        if any(not -2 * cls.LIMIT <= code <= 2 * cls.LIMIT + 1 for code in sketch.bins):
+            raise ValueError(f'Sketch bucket codes must be within +-{2 * cls.LIMIT + 1}')
+        return sketch
+
+
+def merge_sketches(target, sketches):
+    """Merge {field: QuantileSketch} into ``target`` (copying sketches it does not have yet)"""
+    for field, sketch in sketches.items():
+        mine = target.get(field)
+        if mine is None:
+            target[field] = QuantileSketch(dict(sketch.bins))
+        else:
+            mine.merge(sketch)
+
+
+class WindowAggregate:
+    """Count and per-field mean/min/max over a sliding time window"""
+
+    __slots__ = ('window', 'width', 'span', 'buckets', 'count', 'sums')
+
+    def __init__(self, window=300, buckets=30):
+        self.window = window
+        self.width = window / buckets
+        self.span = buckets
+        # [bucket key, count, {field: [sum, count, min, max]}, {field: QuantileSketch}], oldest first
+        self.buckets = deque()
+        self.count = 0
+        # field -> [sum, count] over the whole window
+        self.sums = {}
+
+    def _expire(self, key):
+        buckets = self.buckets
+        while buckets and buckets[0][0] <= key - self.span:
+            _, count, fields, _ = buckets.popleft()
+            self.count -= count
+            for field, stats in fields.items():
+                total = self.sums[field]
+                total[0] -= stats[0]
+                total[1] -= stats[1]
+                if total[1] == 0:
+                    del self.sums[field]
+
+    def _bucket(self, key):
+        buckets = self.buckets
+        if buckets and buckets[-1][0] == key:
+            return buckets[-1]
+        if not buckets or buckets[-1][0] < key:
+            bucket = [key, 0, {}, {}]
+            buckets.append(bucket)
+            return bucket
+        # Late reading: drop it if it is already out of the window, otherwise
+        # find or insert its bucket
+        if key <= buckets[-1][0] - self.span:
+            return None
+        position = len(buckets)
+        while position and buckets[position - 1][0] > key:
+            position -= 1
+        if position and buckets[position - 1][0] == key:
+            return buckets[position - 1]
+        bucket = [key, 0, {}, {}]
+        buckets.insert(position, bucket)
+        return bucket
+
+    def add(self, timestamp, fields):
+        """Add one reading at ``timestamp`` whose numeric values are ``fields``"""
+        key = int(timestamp // self.width)
+        buckets = self.buckets
+        if buckets and buckets[-1][0] == key:
+            bucket = buckets[-1]
+        else:
+            if not buckets or key > buckets[-1][0]:
+                self._expire(key)
+            bucket = self._bucket(key)
+            if bucket is None:
+                return
+        bucket[1] += 1
+        self.count += 1
+        bucket_fields = bucket[2]
+        sketches = bucket[3]
+        sums = self.sums
+        for field, value in fields.items():
+            stats = bucket_fields.get(field)
+            if stats is None:
+                bucket_fields[field] = [value, 1, value, value]
+                sketches[field] = QuantileSketch()
+            else:
+                stats[0] += value
+                stats[1] += 1
+                if value < stats[2]:
+                    stats[2] = value
+                elif value > stats[3]:
+                    stats[3] = value
+            sketches[field].add(value)
+            total = sums.get(field)
+            if total is None:
+                sums[field] = [value, 1]
+            else:
+                total[0] += value
+                total[1] += 1
+
+    def merge(self, key, count, fields, sketches=None):
+        """Add pre-aggregated readings: ``count`` readings in bucket ``key``
+        with ``fields`` mapping field -> (sum, count, min, max) and optional
+        ``sketches`` mapping field -> QuantileSketch"""
+        buckets = self.buckets
+        if not buckets or key > buckets[-1][0]:
+            self._expire(key)
+        bucket = self._bucket(key)
+        if bucket is None:
+            return
+        bucket[1] += count
+        self.count += count
+        bucket_fields = bucket[2]
+        sums = self.sums
+        for field, (total, present, low, high) in fields.items():
+            stats = bucket_fields.get(field)
+            if stats is None:
+                bucket_fields[field] = [total, present, low, high]
+            else:
+                stats[0] += total
+                stats[1] += present
+                stats[2] = min(stats[2], low)
+                stats[3] = max(stats[3], high)
+            running = sums.get(field)
+            if running is None:
+                sums[field] = [total, present]
+            else:
+                running[0] += total
+                running[1] += present
+        if sketches:
+            merge_sketches(bucket[3], sketches)
+
+    def summary(self, now):
+        """Window count, rate and per-field mean/min/max as of ``now``"""
+        self._expire(int(now // self.width))
+        fields = {}
+        for field, (total, count) in self.sums.items():
+            present = [bucket[2][field] for bucket in self.buckets if field in bucket[2]]
+            fields[field] = {
+                'count': count,
+                'mean': round(total / count, 4),
+                'min': min(stats[2] for stats in present),
+                'max': max(stats[3] for stats in present)
+            }
+            sketch = QuantileSketch()
+            for bucket in self.buckets:
+                if field in bucket[3]:
+                    sketch.merge(bucket[3][field])
+            if sketch.count:
+                fields[field]['p50'], fields[field]['p90'], fields[field]['p99'] = sketch.quantiles()
+        return {
+            'window_seconds': self.window,
+            'count': self.count,
+            'rate_per_second': round(self.count / self.window, 4),
+            'fields': fields
+        }
+
+
+def _cells(groups, keys):
+    """(cells, cell of each reading, readings per cell, span, base) of (group, key) pairs"""
+    base = int(keys.min())
+    span = int(keys.max()) - base + 1
+    cells, inverse, counts = np.unique(groups.astype(np.int64) * span + (keys - base),
+                                       return_inverse=True, return_counts=True)
+    return cells, inverse, counts, span, base
+
+
+def bucket_cells(groups, keys, columns):
+    """Aggregate a batch of readings per (group, bucket key)
+
+    ``groups`` and ``keys`` are integer arrays with one entry per reading and
+    ``columns`` maps field -> (reading positions, values). Returns arrays
+    (groups, keys, counts, {field: (sum, count, min, max)}) with one entry
+    per distinct (group, key) cell.
+    """
+    if not len(keys):
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty, {}
+    cells, inverse, counts, span, base = _cells(groups, keys)
+    return cells // span, cells % span + base, counts, _cell_stats(inverse, len(cells), columns)
+
+
+def _cell_stats(inverse, size, columns):
+    stats = {}
+    for field, (positions, values) in columns.items():
+        cell = inverse[positions]
+        low = np.full(size, np.inf)
+        high = np.full(size, -np.inf)
+        np.minimum.at(low, cell, values)
+        np.maximum.at(high, cell, values)
+        stats[field] = (np.bincount(cell, weights=values, minlength=size),
+                        np.bincount(cell, minlength=size), low, high)
+    return stats
+
+
+def cell_sketches(cell, values, size):
+    """A QuantileSketch per cell (None where a cell has no values) from each value's cell number"""
+    # (cell, bucket code) pairs packed into one int; codes fit in 14 bits
+    pairs, counts = np.unique(cell.astype(np.int64) * 16384 + QuantileSketch.codes(values) + 8192,
+                              return_counts=True)
+    sketches = [None] * size
+    for pair, count in zip(pairs.tolist(), counts.tolist()):
+        sketch = sketches[pair >> 14]
+        if sketch is None:
+            sketch = sketches[pair >> 14] = QuantileSketch()
+        sketch.bins[(pair & 16383) - 8192] = count
+        sketch.count += count
+    return sketches
+
+
+def bucket_stats(groups, keys, columns, sketches=False):
+    """``bucket_cells`` as (group, key, count, {field: (sum, count, min, max)}) tuples for
+    WindowAggregate.merge, plus a {field: QuantileSketch} fifth item with ``sketches``"""
+    if not len(keys):
+        return
+    cells, inverse, counts, span, base = _cells(groups, keys)
+    size = len(cells)
+    stats = [(field, *(column.tolist() for column in columns_))
+             for field, columns_ in _cell_stats(inverse, size, columns).items()]
+    field_sketches = {field: cell_sketches(inverse[positions], values, size)
+                      for field, (positions, values) in columns.items()} if sketches else None
+    for i, (cell, count) in enumerate(zip(cells.tolist(), counts.tolist())):
+        fields = {
+            field: (total[i], present[i], low[i], high[i])
+            for field, total, present, low, high in stats if present[i]
+        }
+        if sketches:
+            yield cell // span, cell % span + base, count, fields, {
+                field: cell_sketch[i] for field, cell_sketch in field_sketches.items() if cell_sketch[i] is not None
+            }
+        else:
+            yield cell // span, cell % span + base, count, fields
+
+
+class WindowTable:
+    """Sliding windows for many sensors at once, one NumPy row per sensor
+
+    Bucket ``key`` lives in ring slot ``key % buckets``. A slot holding an
+    older key is cleared when a newer key lands in it, and summaries ignore
+    slots outside the window, so rows never need to be expired. A whole
+    batch updates the table with a few array operations.
+    """
+
+    def __init__(self, window=300, buckets=5, capacity=64):
+        self.window = window
+        self.width = window / buckets
+        self.span = buckets
+        self.keys = np.full((capacity, buckets), -1, dtype=np.int64)
+        self.counts = np.zeros((capacity, buckets), dtype=np.int64)
+        # field -> [capacity, buckets, 4] of (sum, count, min, max)
+        self.fields = {}
+
+    def _grow(self, rows):
+        capacity = len(self.keys)
+        if rows < capacity:
+            return
+        size = max(rows + 1, 2 * capacity)
+
+        def grown(array, fill):
+            bigger = np.full((size,) + array.shape[1:], fill, dtype=array.dtype)
+            bigger[:capacity] = array
+            return bigger
+
+        self.keys = grown(self.keys, -1)
+        self.counts = grown(self.counts, 0)
+        for field, array in self.fields.items():
+            self.fields[field] = grown(array, 0)
+
+    def _field(self, field):
+        array = self.fields.get(field)
+        if array is None:
+            array = self.fields[field] = np.zeros((len(self.keys), self.span, 4))
+            array[..., 2] = np.inf
+            array[..., 3] = -np.inf
+        return array
+
+    def reset(self, row):
+        """Forget everything recorded for ``row``"""
+        self._grow(row)
+        self.keys[row] = -1
+        self.counts[row] = 0
+
+    def add(self, row, timestamp, fields):
+        """Add one reading for ``row``"""
+        key = int(timestamp // self.width)
+        self._grow(row)
+        slot = key % self.span
+        stored = self.keys[row, slot]
+        if stored > key:
+            return
+        if stored != key:
+            self.keys[row, slot] = key
+            self.counts[row, slot] = 0
+            for array in self.fields.values():
+                array[row, slot] = (0, 0, np.inf, -np.inf)
+        self.counts[row, slot] += 1
+        for field, value in fields.items():
+            stats = self._field(field)[row, slot]
+            stats[0] += value
+            stats[1] += 1
+            if value < stats[2]:
+                stats[2] = value
+            if value > stats[3]:
+                stats[3] = value
+
+    def merge(self, rows, keys, counts, fields):
+        """Add aggregated cells; (rows, keys) pairs must be distinct, as from ``bucket_cells``"""
+        if not len(rows):
+            return
+        self._grow(int(rows.max()))
+        slots = keys % self.span
+        stored = self.keys[rows, slots]
+        # A slot holding a newer key means this cell is already out of the window
+        live = stored <= keys
+        if not live.all():
+            rows, keys, slots, stored, counts = rows[live], keys[live], slots[live], stored[live], counts[live]
+            fields = {field: tuple(stat[live] for stat in stats) for field, stats in fields.items()}
+        arrays = [self._field(field) for field in fields]
+
+        stale = stored != keys
+        if stale.any():
+            stale_rows, stale_slots = rows[stale], slots[stale]
+            self.keys[stale_rows, stale_slots] = keys[stale]
+            self.counts[stale_rows, stale_slots] = 0
+            for array in self.fields.values():
+                array[stale_rows, stale_slots] = (0, 0, np.inf, -np.inf)
+
+        self.counts[rows, slots] += counts
+        for array, (total, present, low, high) in zip(arrays, fields.values()):
+            cells = array[rows, slots]
+            cells[:, 0] += total
+            cells[:, 1] += present
+            np.minimum(cells[:, 2], low, out=cells[:, 2])
+            np.maximum(cells[:, 3], high, out=cells[:, 3])
+            array[rows, slots] = cells
+
+    def summary(self, row, now):
+        """Same shape as WindowAggregate.summary for one row"""
+        count = 0
+        fields = {}
+        if row < len(self.keys):
+            live = self.keys[row] > int(now // self.width) - self.span
+            count = int(self.counts[row, live].sum())
+            for field, array in self.fields.items():
+                cells = array[row, live]
+                present = int(cells[:, 1].sum())
+                if present:
+                    fields[field] = {
+                        'count': present,
+                        'mean': round(float(cells[:, 0].sum()) / present, 4),
+                        'min': _number(cells[:, 2].min()),
+                        'max': _number(cells[:, 3].max())
+                    }
+        return {
+            'window_seconds': self.window,
+            'count': count,
+            'rate_per_second': round(count / self.window, 4),
+            'fields': fields
+        }
+
+
+def _number(value):
+    value = float(value)
+    return int(value) if value.is_integer() else value
@@ -0,0 +1,457 @@
+"""
+Compressed per-sensor time series for IoT readings.
+
+Each sensor's readings are buffered column-wise (timestamps plus one float
+column per numeric field) and sealed into a compressed chunk every
+``chunk_size`` points:
+
+    timestamps   millisecond ints, stored as the first value, the first
+                 delta and the delta-of-deltas, in the narrowest integer
+                 width that holds them (regular sensors give runs of 0s)
+    values       XOR of each float's bits with the previous value's,
+                 byte-plane shuffled so the shared sign/exponent bytes line
+                 up (lossless), or, for fields given a ``precision`` step,
+                 quantized ints stored as narrow deltas
+    missing      a presence bitmap when a field is absent from some readings
+
+The chunk is then zlib-compressed. A chunk's time range is kept in an
+in-memory index, so range reads only decode the chunks they overlap.
+Rollups (1 min / 5 min / 1 h count, mean, min, max) are computed from the
+decoded points when they are read.
+
+Chunks stay in RAM, or are appended to daily segment files when a
+``directory`` is given (``series-YYYYMMDD.log``; the index is rebuilt by
+scanning record headers on open). Old chunks are dropped by ``retention``
+(seconds) and by a ``max_bytes`` budget, oldest first; whole segment files
+are deleted once none of their chunks are live.
+"""
+
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+
+import numpy as np
+
+from iot_stream import bucket_cells
+
+ROLLUPS = (60, 300, 3600)
+INT_WIDTHS = (np.dtype('<i1'), np.dtype('<i2'), np.dtype('<i4'), np.dtype('<i8'))
+# points, first timestamp (ms), first delta (ms), delta-of-delta width code, field count
+CHUNK_HEADER = struct.Struct('<IqqBH')
+# name length, encoding, precision step, present count
+FIELD_HEADER = struct.Struct('<HBdI')
+QUANTIZED_HEADER = struct.Struct('<qB')
+# sensor id length, chunk length, first / last timestamp (s), points
+RECORD_HEADER = struct.Struct('<HIddI')
+XOR, QUANTIZED = 0, 1
+
+
+def _pack_ints(values):
+    """(width code, bytes) of ints in the narrowest signed width that holds them"""
+    if not len(values):
+        return 0, b''
+    low, high = int(values.min()), int(values.max())
+    for code, dtype in enumerate(INT_WIDTHS):
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return code, values.astype(dtype).tobytes()
+
+
+def _unpack_ints(data, offset, code, count):
+    dtype = INT_WIDTHS[code]
+    values = np.frombuffer(data, dtype=dtype, count=count, offset=offset).astype(np.int64)
+    return values, offset + count * dtype.itemsize
+
+
+def encode_chunk(timestamps, fields, precision=None):
+    """Compressed chunk of ``timestamps`` (seconds) and ``fields`` (name -> float array, NaN = missing)"""
+    count = len(timestamps)
+    ms = np.round(np.asarray(timestamps) * 1000).astype(np.int64)
+    deltas = np.diff(ms)
+    first_delta = int(deltas[0]) if len(deltas) else 0
+    width, dod = _pack_ints(np.diff(deltas))
+    parts = [CHUNK_HEADER.pack(count, int(ms[0]) if count else 0, first_delta, width, len(fields)), dod]
+
+    for name, values in fields.items():
+        present = ~np.isnan(values)
+        values = values[present]
+        step = (precision or {}).get(name, (precision or {}).get(None, 0))
+        encoding = XOR
+        if step and len(values) and np.abs(values).max() / step < 2 ** 52:
+            encoding = QUANTIZED
+        name = name.encode()
+        parts.append(FIELD_HEADER.pack(len(name), encoding, step or 0, len(values)))
+        parts.append(name)
+        if len(values) < count:
+            parts.append(np.packbits(present).tobytes())
+        if encoding == QUANTIZED:
+            quantized = np.round(values / step).astype(np.int64)
+            delta_width, packed = _pack_ints(np.diff(quantized))
+            parts.append(QUANTIZED_HEADER.pack(int(quantized[0]), delta_width))
+            parts.append(packed)
+        else:
+            bits = values.astype('<f8').view('<u8')
+            xored = bits.copy()
+            xored[1:] ^= bits[:-1]
+            parts.append(xored.view(np.uint8).reshape(-1, 8).T.tobytes())
+    return zlib.compress(b''.join(parts))
+
+
+def decode_chunk(blob, wanted=None):
+    """(timestamps in seconds, {field: float array}) of an encoded chunk; ``wanted`` limits the fields"""
+    data = zlib.decompress(blob)
+    count, first, first_delta, width, field_count = CHUNK_HEADER.unpack_from(data)
+    offset = CHUNK_HEADER.size
+    dod, offset = _unpack_ints(data, offset, width, max(0, count - 2))
+    deltas = first_delta + np.concatenate(([0], np.cumsum(dod))) if count > 1 else np.zeros(0, dtype=np.int64)
+    ms = first + np.concatenate(([0], np.cumsum(deltas)))[:count]
+
+    fields = {}
+    for _ in range(field_count):
+        name_length, encoding, step, present_count = FIELD_HEADER.unpack_from(data, offset)
+        offset += FIELD_HEADER.size
+        name = bytes(data[offset:offset + name_length]).decode()
+        offset += name_length
+        present = None
+        if present_count < count:
+            present = np.unpackbits(np.frombuffer(data, np.uint8, (count + 7) // 8, offset), count=count).astype(bool)
+            offset += (count + 7) // 8
+        if encoding == QUANTIZED:
+            start, delta_width = QUANTIZED_HEADER.unpack_from(data, offset)
+            offset += QUANTIZED_HEADER.size
+            steps, offset = _unpack_ints(data, offset, delta_width, max(0, present_count - 1))
+            values = (start + np.concatenate(([0], np.cumsum(steps)))[:present_count]) * step
+        else:
+            planes = np.frombuffer(data, np.uint8, present_count * 8, offset).reshape(8, present_count)
+            offset += present_count * 8
+            values = np.bitwise_xor.accumulate(planes.T.copy().view('<u8').ravel()).view('<f8')
+        if wanted is not None and name not in wanted:
+            continue
+        if present is not None:
+            column = np.full(count, np.nan)
+            column[present] = values
+            values = column
+        fields[name] = values
+    return ms / 1000.0, fields
+
+
+class _Chunk:
+    __slots__ = ('sensor_id', 'start', 'end', 'points', 'size', 'blob', 'segment', 'offset')
+
+    def __init__(self, sensor_id, start, end, points, size, blob=None, segment=None, offset=0):
+        self.sensor_id = sensor_id
+        self.start = start
+        self.end = end
+        self.points = points
+        self.size = size
+        self.blob = blob
+        self.segment = segment
+        self.offset = offset
+
+
+class _Head:
+    """Open (not yet sealed) columns of one sensor, grown as points arrive"""
+
+    __slots__ = ('timestamps', 'fields', 'count')
+
+    def __init__(self):
+        self.timestamps = np.empty(16)
+        self.fields = {}
+        self.count = 0
+
+    def reserve(self, count):
+        capacity = len(self.timestamps)
+        if count <= capacity:
+            return
+        size = max(count, 2 * capacity)
+        timestamps = np.empty(size)
+        timestamps[:capacity] = self.timestamps
+        self.timestamps = timestamps
+        for field, values in self.fields.items():
+            grown = np.full(size, np.nan)
+            grown[:capacity] = values
+            self.fields[field] = grown
+
+    def column(self, field):
+        values = self.fields.get(field)
+        if values is None:
+            values = self.fields[field] = np.full(len(self.timestamps), np.nan)
+        return values
+
+
+class SensorSeriesStore:
+    """Per-sensor compressed time series with range reads and rollups"""
+
+    def __init__(self, directory=None, chunk_size=1024, precision=None, retention=None, max_bytes=None):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        # field -> quantization step (None key: default step); lossless otherwise
+        self.precision = precision or {}
+        self.retention = retention
+        self.max_bytes = max_bytes
+        self.heads = {}
+        self.chunks = {}
+        # Every live chunk, in the order sealed, for retention and the byte budget
+        self._order = deque()
+        self.bytes = 0
+        self.points = 0
+        self._segment_chunks = {}
+        self._files = {}
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._load()
+
+    # -- writes ------------------------------------------------------------
+
+    def append(self, sensor_id, timestamp, fields):
+        """Add one reading; ``fields`` maps numeric field -> value"""
+        with self._lock:
+            head = self._head(sensor_id)
+            row = head.count
+            head.reserve(row + 1)
+            head.timestamps[row] = timestamp
+            for field, value in fields.items():
+                head.column(field)[row] = value
+            head.count += 1
+            if head.count == self.chunk_size:
+                self._seal(sensor_id, head)
+
+    def append_batch(self, sensor_ids, timestamps, columns):
+        """Add a batch: ``sensor_ids`` and ``timestamps`` per reading, ``columns``
+        mapping field -> (reading positions, values) as in IoTDataProcessor"""
+        if not len(timestamps):
+            return
+        names, groups = np.unique(np.asarray(sensor_ids), return_inverse=True)
+        order = np.argsort(groups, kind='stable')
+        bounds = np.searchsorted(groups[order], np.arange(len(names) + 1))
+        # Dense columns in batch order, NaN where a reading lacks the field
+        dense = {}
+        for field, (positions, values) in columns.items():
+            column = np.full(len(timestamps), np.nan)
+            column[positions] = values
+            dense[field] = column[order]
+        ordered = np.asarray(timestamps, dtype=np.float64)[order]
+
+        with self._lock:
+            for group, sensor_id in enumerate(names.tolist()):
+                begin, end = int(bounds[group]), int(bounds[group + 1])
+                head = self._head(sensor_id)
+                while begin < end:
+                    take = min(end - begin, self.chunk_size - head.count)
+                    row = head.count
+                    head.reserve(row + take)
+                    head.timestamps[row:row + take] = ordered[begin:begin + take]
+                    for field, column in dense.items():
+                        part = column[begin:begin + take]
+                        if head.fields.get(field) is not None or not np.isnan(part).all():
+                            head.column(field)[row:row + take] = part
+                    head.count += take
+                    begin += take
+                    if head.count == self.chunk_size:
+                        head = self._seal(sensor_id, head)
+
+    def _head(self, sensor_id):
+        head = self.heads.get(sensor_id)
+        if head is None:
+            head = self.heads[sensor_id] = _Head()
+        return head
+
+    def _seal(self, sensor_id, head):
+        count = head.count
+        if count:
+            timestamps = head.timestamps[:count]
+            blob = encode_chunk(timestamps, {field: values[:count] for field, values in head.fields.items()},
+                                self.precision)
+            chunk = _Chunk(sensor_id, float(timestamps.min()), float(timestamps.max()), count, len(blob))
+            if self.directory:
+                self._write(chunk, blob)
+            else:
+                chunk.blob = blob
+            self._add_chunk(chunk)
+            self._expire()
+        head = self.heads[sensor_id] = _Head()
+        return head
+
+    def _add_chunk(self, chunk):
+        self.chunks.setdefault(chunk.sensor_id, []).append(chunk)
+        self._order.append(chunk)
+        self.bytes += chunk.size
+        self.points += chunk.points
+        if chunk.segment is not None:
+            self._segment_chunks[chunk.segment] = self._segment_chunks.get(chunk.segment, 0) + 1
+
+    def _expire(self, now=None):
+        cutoff = (time.time() if now is None else now) - self.retention if self.retention else None
+        while self._order and ((cutoff is not None and self._order[0].end < cutoff)
+                               or (self.max_bytes and self.bytes > self.max_bytes)):
+            chunk = self._order.popleft()
+            sensor_chunks = self.chunks[chunk.sensor_id]
+            sensor_chunks.remove(chunk)
+            if not sensor_chunks:
+                del self.chunks[chunk.sensor_id]
+            self.bytes -= chunk.size
+            self.points -= chunk.points
+            if chunk.segment is not None:
+                self._segment_chunks[chunk.segment] -= 1
+                if not self._segment_chunks[chunk.segment] and chunk.segment != self._current_segment():
+                    self._drop_segment(chunk.segment)
+
+    def flush(self):
+        """Seal every open head (e.g. before shutdown, so disk stores keep them)"""
+        with self._lock:
+            for sensor_id, head in list(self.heads.items()):
+                if head.count:
+                    self._seal(sensor_id, head)
+
+    # -- segment files -----------------------------------------------------
+
+    def _current_segment(self):
+        return time.strftime('%Y%m%d', time.gmtime())
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, f'series-{segment}.log')
+
+    def _file(self, segment):
+        f = self._files.get(segment)
+        if f is None:
+            f = self._files[segment] = open(self._segment_path(segment), 'a+b')
+        return f
+
+    def _write(self, chunk, blob):
+        segment = time.strftime('%Y%m%d', time.gmtime(chunk.start))
+        f = self._file(segment)
+        sensor = chunk.sensor_id.encode()
+        # One append per record; the offset is taken after the write so
+        # workers sharing a directory can append to the same segment
+        f.write(RECORD_HEADER.pack(len(sensor), len(blob), chunk.start, chunk.end, chunk.points) + sensor + blob)
+        f.flush()
+        chunk.segment = segment
+        chunk.offset = f.tell() - len(blob)
+
+    def _read_blob(self, chunk):
+        if chunk.blob is not None:
+            return chunk.blob
+        return os.pread(self._file(chunk.segment).fileno(), chunk.size, chunk.offset)
+
+    def _drop_segment(self, segment):
+        f = self._files.pop(segment, None)
+        if f is not None:
+            f.close()
+        del self._segment_chunks[segment]
+        try:
+            os.remove(self._segment_path(segment))
+        except FileNotFoundError:
+            pass
+
+    def _load(self):
+        """Rebuild the chunk index from the record headers of every segment file"""
+        for name in sorted(os.listdir(self.directory)):
+            if not (name.startswith('series-') and name.endswith('.log')):
+                continue
+            segment = name[len('series-'):-len('.log')]
+            path = self._segment_path(segment)
+            size = os.path.getsize(path)
+            with open(path, 'rb') as f:
+                offset = 0
+                while offset + RECORD_HEADER.size <= size:
+                    sensor_length, length, start, end, points = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+                    if offset + RECORD_HEADER.size + sensor_length + length > size:
+                        break
+                    sensor_id = f.read(sensor_length).decode()
+                    data_offset = offset + RECORD_HEADER.size + sensor_length
+                    self._add_chunk(_Chunk(sensor_id, start, end, points, length,
+                                           segment=segment, offset=data_offset))
+                    offset = data_offset + length
+                    f.seek(offset)
+            if offset < size:
+                # A record cut short by a crash; the next append overwrites it
+                os.truncate(path, offset)
+        self._order = deque(sorted(self._order, key=lambda chunk: chunk.end))
+        for chunks in self.chunks.values():
+            chunks.sort(key=lambda chunk: chunk.start)
+        self._expire()
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            for f in self._files.values():
+                f.close()
+            self._files = {}
+
+    # -- reads -------------------------------------------------------------
+
+    def read(self, sensor_id, start=None, end=None, fields=None):
+        """Points of one sensor in [start, end] as (timestamps, {field: values}), oldest first"""
+        start = -np.inf if start is None else start
+        end = np.inf if end is None else end
+        wanted = set(fields) if fields is not None else None
+        parts = []
+        with self._lock:
+            for chunk in self.chunks.get(sensor_id, ()):
+                if chunk.end >= start and chunk.start <= end:
+                    parts.append(decode_chunk(self._read_blob(chunk), wanted))
+            head = self.heads.get(sensor_id)
+            if head is not None and head.count:
+                # Sealed timestamps are whole milliseconds; match them
+                parts.append((np.round(head.timestamps[:head.count] * 1000) / 1000,
+                               {field: values[:head.count].copy() for field, values in head.fields.items()
+                                if wanted is None or field in wanted}))
+        if not parts:
+            return np.zeros(0), {}
+
+        names = sorted(set().union(*(part[1] for part in parts)))
+        timestamps = np.concatenate([part[0] for part in parts])
+        columns = {name: np.concatenate([part[1].get(name, np.full(len(part[0]), np.nan)) for part in parts])
+                   for name in names}
+        keep = np.flatnonzero((timestamps >= start) & (timestamps <= end))
+        # Late readings can make a chunk's points slightly out of order
+        keep = keep[np.argsort(timestamps[keep], kind='stable')]
+        return timestamps[keep], {name: values[keep] for name, values in columns.items()}
+
+    def rollup(self, sensor_id, resolution, start=None, end=None, fields=None):
+        """Per-``resolution`` (60 / 300 / 3600 s) buckets of count and per-field mean/min/max"""
+        if resolution not in ROLLUPS:
+            raise ValueError(f'resolution must be one of {ROLLUPS}')
+        timestamps, columns = self.read(sensor_id, start, end, fields)
+        if not len(timestamps):
+            return []
+        keys = np.floor(timestamps / resolution).astype(np.int64)
+        present = {field: np.flatnonzero(~np.isnan(values)) for field, values in columns.items()}
+        _, cell_keys, counts, stats = bucket_cells(
+            np.zeros(len(keys), dtype=np.int64), keys,
+            {field: (positions, columns[field][positions]) for field, positions in present.items()})
+        stats = {field: [column.tolist() for column in field_stats] for field, field_stats in stats.items()}
+        buckets = []
+        for i, (key, count) in enumerate(zip(cell_keys.tolist(), counts.tolist())):
+            buckets.append({
+                'timestamp': key * resolution,
+                'count': count,
+                'fields': {
+                    field: {'count': int(present_count[i]), 'mean': round(total[i] / present_count[i], 4),
+                            'min': low[i], 'max': high[i]}
+                    for field, (total, present_count, low, high) in stats.items() if present_count[i]
+                }
+            })
+        return buckets
+
+    def stats(self):
+        with self._lock:
+            open_points = sum(head.count for head in self.heads.values())
+            return {
+                'storage': 'disk' if self.directory else 'memory',
+                'sensors': len(set(self.chunks) | {sensor for sensor, head in self.heads.items() if head.count}),
+                'chunks': len(self._order),
+                'chunk_size': self.chunk_size,
+                'sealed_points': self.points,
+                'open_points': open_points,
+                'compressed_bytes': self.bytes,
+                'bytes_per_point': round(self.bytes / self.points, 2) if self.points else None,
+                'oldest': self._order[0].start if self._order else None,
+                'segments': sorted(self._segment_chunks),
+                'retention_seconds': self.retention,
+                'max_bytes': self.max_bytes
+            }
@@ -0,0 +1,111 @@
+"""
+Lazy dependency loading and startup timing for the transport optimizer.
+
+Heavy libraries (folium, scikit-learn, scipy, networkx, geopy) are only needed
+by a few endpoints, so they are imported on first use instead of when app.py
+is imported. Every lazy import and startup phase is timed so that cold start
+and worker respawn cost can be inspected at runtime.
+"""
+
+import importlib
+import importlib.util
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+_lock = threading.RLock()
+_import_timings = {}
+_phase_timings = {}
+
+
+def lazy_import(module_name):
+    """Import a module on first use and record how long the import took"""
+    module = sys.modules.get(module_name)
+    if module is not None:
+        return module
+
+    with _lock:
+        module = sys.modules.get(module_name)
+        if module is None:
+            start = time.perf_counter()
+            module = importlib.import_module(module_name)
+            _import_timings[module_name] = time.perf_counter() - start
+    return module
+
+
+def is_available(module_name):
+    """Check whether a top-level module is installed without importing it"""
+    try:
+        return importlib.util.find_spec(module_name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+@contextmanager
+def startup_phase(name):
+    """Time a named startup phase (data loading, model warmup, ...)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        with _lock:
+            _phase_timings[name] = time.perf_counter() - start
+
+
+def startup_report():
+    """Summarize lazy import and startup phase timings for this process"""
+    with _lock:
+        imports = sorted(_import_timings.items(), key=lambda x: x[1], reverse=True)
+        phases = list(_phase_timings.items())
+
+    return {
+        'imports': [
+            {'module': name, 'seconds': round(seconds, 4)}
+            for name, seconds in imports
+        ],
+        'phases': [
+            {'phase': name, 'seconds': round(seconds, 4)}
+            for name, seconds in phases
+        ],
+        'total_import_seconds': round(sum(s for _, s in imports), 4),
+        'total_phase_seconds': round(sum(s for _, s in phases), 4)
+    }
+
+
+def measure_cold_start(module_name='app', top=15):
+    """Import a module in a fresh interpreter and break the time down per package
+
+    Uses ``python -X importtime`` so the numbers reflect a real cold start,
+    the same cost a respawned worker pays before it can serve requests.
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module_name}'],
+        capture_output=True, text=True
+    )
+
+    packages = {}
+    total_us = 0
+    for line in result.stderr.splitlines():
+        # Format: "import time: <self us> | <cumulative us> | <module>"
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3:
+            continue
+        self_us = int(fields[0])
+        package = fields[2].strip().split('.')[0]
+        packages[package] = packages.get(package, 0) + self_us
+        total_us += self_us
+
+    breakdown = sorted(packages.items(), key=lambda x: x[1], reverse=True)[:top]
+    return {
+        'module': module_name,
+        'ok': result.returncode == 0,
+        'total_seconds': round(total_us / 1e6, 4),
+        'packages': [
+            {'package': package, 'seconds': round(us / 1e6, 4)}
+            for package, us in breakdown
+        ]
+    }
@@ -0,0 +1,171 @@
+"""
+Ordered leaderboard index for the gamification engine.
+
+Users are kept in an indexable skip list ordered by points, highest first;
+equal scores rank whoever reached the score first higher. Every link stores
+its width (how many entries it skips), so finding a user's rank or the entry
+at a given rank walks O(log n) links instead of sorting all profiles:
+
+    update(user_id, points)     O(log n)  insert or move a user
+    rank(user_id)               O(log n)  1-based position
+    top(limit, offset)          O(log n + limit)
+    around(user_id, radius)     O(log n + radius)
+"""
+
+import random
+import threading
+
+# Levels grow with probability P, so MAX_LEVEL links cover 1 / P ** MAX_LEVEL users
+MAX_LEVEL = 16
+P = 0.25
+
+
+class _Node:
+    __slots__ = ('key', 'user_id', 'next', 'width')
+
+    def __init__(self, key, user_id, level):
+        self.key = key
+        self.user_id = user_id
+        self.next = [None] * level
+        self.width = [1] * level
+
+
+class Leaderboard:
+    """Users ordered by points (highest first); updates and rank queries in O(log n)"""
+
+    def __init__(self, seed=None):
+        self._random = random.Random(seed)
+        self._tail = _Node((float('inf'), 0), None, 0)
+        self._head = _Node(None, None, MAX_LEVEL)
+        self._head.next = [self._tail] * MAX_LEVEL
+        # user_id -> (-points, sequence) sort key
+        self._keys = {}
+        self._sequence = 0
+        # Levels in use; head links above them skip the whole list
+        self._height = 1
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, user_id):
+        return user_id in self._keys
+
+    def points(self, user_id):
+        return -self._keys[user_id][0]
+
+    # -- updates -----------------------------------------------------------
+
+    def update(self, user_id, points):
+        """Insert ``user_id`` with ``points``, or move it if it is already ranked"""
+        with self._lock:
+            key = self._keys.get(user_id)
+            if key is not None:
+                if key[0] == -points:
+                    return
+                self._unlink(key)
+            self._sequence += 1
+            key = self._keys[user_id] = (-points, self._sequence)
+            self._link(key, user_id)
+
+    def remove(self, user_id):
+        with self._lock:
+            self._unlink(self._keys.pop(user_id))
+
+    def _level(self):
+        level = 1
+        while level < MAX_LEVEL and self._random.random() < P:
+            level += 1
+        return level
+
+    def _link(self, key, user_id):
+        head = self._head
+        chain = [head] * MAX_LEVEL
+        steps = [0] * MAX_LEVEL
+        node = head
+        for level in reversed(range(self._height)):
+            while node.next[level].key < key:
+                steps[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+
+        new = _Node(key, user_id, self._level())
+        for level in range(self._height, len(new.next)):
+            # len(self._keys) already counts the new user
+            head.width[level] = len(self._keys)
+        self._height = max(self._height, len(new.next))
+        skipped = 0
+        for level in range(len(new.next)):
+            previous = chain[level]
+            new.next[level] = previous.next[level]
+            previous.next[level] = new
+            new.width[level] = previous.width[level] - skipped
+            previous.width[level] = skipped + 1
+            skipped += steps[level]
+        for level in range(len(new.next), self._height):
+            chain[level].width[level] += 1
+
+    def _unlink(self, key):
+        chain = [None] * MAX_LEVEL
+        node = self._head
+        for level in reversed(range(self._height)):
+            while node.next[level].key < key:
+                node = node.next[level]
+            chain[level] = node
+
+        target = chain[0].next[0]
+        for level in range(len(target.next)):
+            previous = chain[level]
+            previous.width[level] += target.width[level] - 1
+            previous.next[level] = target.next[level]
+        for level in range(len(target.next), self._height):
+            chain[level].width[level] -= 1
+
+    # -- queries -----------------------------------------------------------
+
+    def rank(self, user_id):
+        """1-based position of ``user_id``; KeyError if it is not ranked"""
+        with self._lock:
+            return self._rank(user_id)
+
+    def _rank(self, user_id):
+        key = self._keys.get(user_id)
+        if key is None:
+            raise KeyError(f'Unknown user {user_id}')
+        position = 0
+        node = self._head
+        for level in reversed(range(self._height)):
+            while node.next[level].key <= key:
+                position += node.width[level]
+                node = node.next[level]
+        return position
+
+    def _entries(self, start, count):
+        """(rank, user_id, points) of up to ``count`` users from 0-based position ``start``"""
+        entries = []
+        if start >= len(self._keys) or count <= 0:
+            return entries
+        node = self._head
+        remaining = start + 1
+        for level in reversed(range(self._height)):
+            while node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        position = start + 1
+        while node is not self._tail and len(entries) < count:
+            entries.append((position, node.user_id, -node.key[0]))
+            node = node.next[0]
+            position += 1
+        return entries
+
+    def top(self, limit=10, offset=0):
+        """The ``limit`` users ranked after the first ``offset``"""
+        with self._lock:
+            return self._entries(max(offset, 0), limit)
+
+    def around(self, user_id, radius=5):
+        """``user_id`` with up to ``radius`` users ranked directly above and below it"""
+        with self._lock:
+            position = self._rank(user_id)
+            start = max(position - 1 - radius, 0)
+            return self._entries(start, position - 1 - start + radius + 1)
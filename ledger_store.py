@@ -0,0 +1,445 @@
+"""
+Append-only on-disk storage for the blockchain ledger.
+
+Blocks are written as length-prefixed JSON records into numbered segment
+files that roll over at a fixed size. Two fixed-width files index them::
+
+    headers.bin   one 144-byte record per block (header fields, hash, location
+                  of the JSON record, first transaction number and count)
+    txindex.bin   one 20-byte record per transaction (64-bit id key, block
+                  height, position in the block)
+
+A header record is written last, so it acts as the commit marker: anything
+past the last complete header (a half-written block after a crash) is
+ignored and overwritten by the next append. Opening a store reads the two
+index files in bulk instead of parsing every block, and lookups by
+transaction id or block hash go through sorted uint64 keys plus a small
+dict of recent additions.
+
+Several processes can share one directory: appends are serialized with an
+exclusive ``flock`` and rejected with ``LedgerConflict`` if another process
+extended the chain first, and readers pick up new blocks by checking the
+size of ``headers.bin``.
+"""
+
+import hashlib
+import json
+import os
+import struct
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: single process only
+    fcntl = None
+
+HEADER_RECORD = struct.Struct('<dIQ32s32s32sIQIQI')
+HEADER_DTYPE = np.dtype([
+    ('timestamp', '<f8'),
+    ('difficulty', '<u4'),
+    ('nonce', '<u8'),
+    ('hash', 'u1', (32,)),
+    ('previous_hash', 'u1', (32,)),
+    ('merkle_root', 'u1', (32,)),
+    ('segment', '<u4'),
+    ('offset', '<u8'),
+    ('length', '<u4'),
+    ('tx_start', '<u8'),
+    ('tx_count', '<u4')
+])
+TX_DTYPE = np.dtype([('key', '<u8'), ('height', '<u8'), ('position', '<u4')])
+RECORD_LENGTH = struct.Struct('<I')
+POSITION_BITS = 24
+
+assert HEADER_DTYPE.itemsize == HEADER_RECORD.size
+
+
+def segment_path(directory, segment):
+    return os.path.join(directory, f'segment-{segment:06d}.log')
+
+
+def read_headers(directory, start, stop):
+    """Header records [start, stop) straight from a store directory"""
+    with open(os.path.join(directory, 'headers.bin'), 'rb') as f:
+        f.seek(start * HEADER_DTYPE.itemsize)
+        data = f.read((stop - start) * HEADER_DTYPE.itemsize)
+    return np.frombuffer(data, dtype=HEADER_DTYPE)
+
+
+def read_block_records(records, segment_fd):
+    """Decode the blocks behind header records, reading each segment's span in one call"""
+    blocks = []
+    i = 0
+    while i < len(records):
+        segment = records['segment'][i]
+        j = i
+        while j + 1 < len(records) and records['segment'][j + 1] == segment:
+            j += 1
+        begin = int(records['offset'][i])
+        end = int(records['offset'][j]) + int(records['length'][j])
+        data = os.pread(segment_fd(int(segment)), end - begin, begin)
+        for offset, length in zip(records['offset'][i:j + 1].tolist(), records['length'][i:j + 1].tolist()):
+            blocks.append(json.loads(data[offset - begin:offset - begin + length]))
+        i = j + 1
+    return blocks
+
+
+class LedgerConflict(Exception):
+    """The block does not extend the current tip (another writer got there first)"""
+
+
+def transaction_key(transaction_id):
+    """64-bit lookup key of a transaction id"""
+    return int.from_bytes(hashlib.blake2b(transaction_id.encode(), digest_size=8).digest(), 'little')
+
+
+def hash_key(block_hash):
+    """64-bit lookup key of a block hash (its first 8 bytes)"""
+    return int.from_bytes(bytes.fromhex(block_hash.rjust(64, '0'))[:8], 'little')
+
+
+class _KeyIndex:
+    """uint64 key -> uint64 values as sorted arrays plus a dict of recent additions
+
+    Keys may collide, so lookups return every candidate and callers confirm
+    the match against the stored block. Writers are serialized by the store;
+    readers take no lock, so the sorted arrays and the recent dict are
+    published together as one tuple and a merge replaces all three at once.
+    """
+
+    def __init__(self, merge_threshold=65536):
+        self._state = (np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.uint64), {})
+        self.merge_threshold = merge_threshold
+
+    def __len__(self):
+        keys, _, recent = self._state
+        return len(keys) + sum(len(values) for values in list(recent.values()))
+
+    def extend(self, keys, values):
+        if len(keys) >= self.merge_threshold:
+            self._merge(keys, values)
+            return
+        recent = self._state[2]
+        for key, value in zip(keys.tolist(), values.tolist()):
+            recent.setdefault(key, []).append(value)
+        if len(recent) >= self.merge_threshold:
+            self._merge()
+
+    def _merge(self, keys=None, values=None):
+        sorted_keys, sorted_values, recent = self._state
+        parts_k = [sorted_keys]
+        parts_v = [sorted_values]
+        if recent:
+            pairs = [(key, value) for key, values_ in recent.items() for value in values_]
+            parts_k.append(np.array([key for key, _ in pairs], dtype=np.uint64))
+            parts_v.append(np.array([value for _, value in pairs], dtype=np.uint64))
+        if keys is not None:
+            parts_k.append(np.asarray(keys, dtype=np.uint64))
+            parts_v.append(np.asarray(values, dtype=np.uint64))
+        keys = np.concatenate(parts_k)
+        order = np.argsort(keys, kind='stable')
+        self._state = (keys[order], np.concatenate(parts_v)[order], {})
+
+    def get(self, key):
+        keys, values, recent = self._state
+        found = list(recent.get(key, ()))
+        start = np.searchsorted(keys, np.uint64(key), side='left')
+        stop = np.searchsorted(keys, np.uint64(key), side='right')
+        found.extend(values[start:stop].tolist())
+        return found
+
+
+class LedgerStore:
+    """Segmented append-only block log with transaction and block-hash indexes"""
+
+    def __init__(self, directory, segment_size=64 * 1024 * 1024, sync=False, cache_blocks=1024):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.sync = sync
+        os.makedirs(directory, exist_ok=True)
+
+        flags = os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0)
+        self._headers_fd = os.open(os.path.join(directory, 'headers.bin'), flags, 0o644)
+        self._tx_fd = os.open(os.path.join(directory, 'txindex.bin'), flags, 0o644)
+        self._segment_fds = {}
+        self._thread_lock = threading.RLock()
+        self._lock_fd = None
+        self._lock_pid = None
+
+        self._headers = np.empty(1024, dtype=HEADER_DTYPE)
+        self.count = 0
+        self.transaction_count = 0
+        self._tx_index = _KeyIndex()
+        self._hash_index = _KeyIndex()
+        self.read_block = lru_cache(maxsize=cache_blocks)(self._read_block)
+
+        with self._locked(exclusive=True):
+            if self._file_size(self._headers_fd) == 0 and os.path.exists(self._segment_path(0)):
+                self._rebuild_from_segments()
+            self._load_new()
+            # Drop a partially written header or index tail left by a crash
+            os.ftruncate(self._headers_fd, self.count * HEADER_DTYPE.itemsize)
+            os.ftruncate(self._tx_fd, self.transaction_count * TX_DTYPE.itemsize)
+
+    # -- files and locking -------------------------------------------------
+
+    def _segment_path(self, segment):
+        return segment_path(self.directory, segment)
+
+    def _segment_fd(self, segment):
+        fd = self._segment_fds.get(segment)
+        if fd is None:
+            flags = os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0)
+            fd = self._segment_fds[segment] = os.open(self._segment_path(segment), flags, 0o644)
+        return fd
+
+    @staticmethod
+    def _file_size(fd):
+        return os.fstat(fd).st_size
+
+    @contextmanager
+    def _locked(self, exclusive):
+        with self._thread_lock:
+            if fcntl is None:
+                yield
+                return
+            # flock belongs to the open file, which forked children share,
+            # so every process opens the lock file itself
+            if self._lock_pid != os.getpid():
+                self._lock_fd = os.open(os.path.join(self.directory, 'LOCK'), os.O_RDWR | os.O_CREAT, 0o644)
+                self._lock_pid = os.getpid()
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    # -- loading -----------------------------------------------------------
+
+    def refresh(self):
+        """Pick up blocks appended by other processes; cheap when nothing changed"""
+        if self._file_size(self._headers_fd) < (self.count + 1) * HEADER_DTYPE.itemsize:
+            return False
+        with self._locked(exclusive=False):
+            return self._load_new()
+
+    def _load_new(self):
+        committed = self._file_size(self._headers_fd) // HEADER_DTYPE.itemsize
+        if committed <= self.count:
+            return False
+
+        start = self.count
+        size = (committed - start) * HEADER_DTYPE.itemsize
+        records = np.frombuffer(os.pread(self._headers_fd, size, start * HEADER_DTYPE.itemsize), dtype=HEADER_DTYPE)
+
+        tx_start = self.transaction_count
+        tx_end = int(records['tx_start'][-1]) + int(records['tx_count'][-1])
+        tx_records = np.frombuffer(
+            os.pread(self._tx_fd, (tx_end - tx_start) * TX_DTYPE.itemsize, tx_start * TX_DTYPE.itemsize),
+            dtype=TX_DTYPE)
+        if len(tx_records) != tx_end - tx_start:
+            raise IOError('Transaction index is shorter than the block headers it belongs to')
+
+        self._add_records(records, tx_records)
+        return True
+
+    def _add_records(self, records, tx_records):
+        start = self.count
+        needed = start + len(records)
+        if needed > len(self._headers):
+            grown = np.empty(max(needed, 2 * len(self._headers)), dtype=HEADER_DTYPE)
+            grown[:start] = self._headers[:start]
+            self._headers = grown
+        self._headers[start:needed] = records
+
+        hash_keys = np.ascontiguousarray(records['hash'][:, :8]).view('<u8').ravel()
+        self._hash_index.extend(hash_keys, np.arange(start, needed, dtype=np.uint64))
+        if len(tx_records):
+            locations = (tx_records['height'] << np.uint64(POSITION_BITS)) | tx_records['position'].astype(np.uint64)
+            self._tx_index.extend(tx_records['key'], locations)
+
+        self.count = needed
+        self.transaction_count += len(tx_records)
+
+    def _rebuild_from_segments(self):
+        """Recreate headers.bin and txindex.bin by scanning the segment files"""
+        os.ftruncate(self._tx_fd, 0)
+        segment = 0
+        while os.path.exists(self._segment_path(segment)):
+            fd = self._segment_fd(segment)
+            data = os.pread(fd, self._file_size(fd), 0)
+            offset = 0
+            while offset + RECORD_LENGTH.size <= len(data):
+                (length,) = RECORD_LENGTH.unpack_from(data, offset)
+                payload = data[offset + RECORD_LENGTH.size:offset + RECORD_LENGTH.size + length]
+                if length == 0 or len(payload) < length:
+                    return
+                try:
+                    block = json.loads(payload)
+                except ValueError:
+                    return
+                if block['index'] != self.count:
+                    return
+                self._write_block_indexes(block, segment, offset + RECORD_LENGTH.size, length)
+                offset += RECORD_LENGTH.size + length
+            segment += 1
+
+    # -- writing -----------------------------------------------------------
+
+    def append_block(self, block):
+        """Append a block that extends the current tip; returns its height"""
+        payload = json.dumps(block, separators=(',', ':')).encode()
+        if len(block['transactions']) >= 1 << POSITION_BITS:
+            raise ValueError('Too many transactions in one block')
+
+        with self._locked(exclusive=True):
+            self._load_new()
+            if block['index'] != self.count or (self.count and block['previous_hash'] != self.tip_hash()):
+                raise LedgerConflict(f"Block {block['index']} does not extend height {self.count}")
+
+            segment, offset = 0, 0
+            if self.count:
+                last = self._headers[self.count - 1]
+                segment, offset = int(last['segment']), int(last['offset']) + int(last['length'])
+                if offset + RECORD_LENGTH.size + len(payload) > self.segment_size:
+                    segment, offset = segment + 1, 0
+
+            fd = self._segment_fd(segment)
+            os.pwrite(fd, RECORD_LENGTH.pack(len(payload)) + payload, offset)
+            if self.sync:
+                os.fsync(fd)
+            self._write_block_indexes(block, segment, offset + RECORD_LENGTH.size, len(payload))
+        return block['index']
+
+    def _write_block_indexes(self, block, segment, offset, length):
+        height = self.count
+        transactions = block['transactions']
+        tx_records = np.zeros(len(transactions), dtype=TX_DTYPE)
+        tx_records['key'] = [transaction_key(tx['id']) for tx in transactions]
+        tx_records['height'] = height
+        tx_records['position'] = np.arange(len(transactions))
+
+        header = HEADER_RECORD.pack(
+            block['timestamp'],
+            block.get('difficulty', 0),
+            block['nonce'],
+            bytes.fromhex(block['hash']),
+            bytes.fromhex(block['previous_hash'].rjust(64, '0')),
+            bytes.fromhex(block['merkle_root']),
+            segment,
+            offset,
+            length,
+            self.transaction_count,
+            len(transactions)
+        )
+
+        # The header goes last: it is what makes the block visible
+        os.pwrite(self._tx_fd, tx_records.tobytes(), self.transaction_count * TX_DTYPE.itemsize)
+        os.pwrite(self._headers_fd, header, height * HEADER_DTYPE.itemsize)
+        if self.sync:
+            os.fsync(self._tx_fd)
+            os.fsync(self._headers_fd)
+
+        self._add_records(np.frombuffer(header, dtype=HEADER_DTYPE), tx_records)
+
+    # -- reading -----------------------------------------------------------
+
+    def headers(self, start=0, stop=None):
+        """Header records of blocks [start, stop) as a structured array view"""
+        stop = self.count if stop is None else min(stop, self.count)
+        return self._headers[start:stop]
+
+    def tip_hash(self):
+        return self._headers[self.count - 1]['hash'].tobytes().hex() if self.count else None
+
+    def _read_block(self, height):
+        # Cached: returned blocks are shared and must not be modified
+        record = self._headers[height]
+        data = os.pread(self._segment_fd(int(record['segment'])), int(record['length']), int(record['offset']))
+        return json.loads(data)
+
+    def read_blocks(self, start, stop):
+        """Blocks [start, stop)"""
+        return read_block_records(self.headers(start, stop), self._segment_fd)
+
+    def find_transaction(self, transaction_id):
+        """(block height, position, transaction) or None"""
+        self.refresh()
+        for location in self._tx_index.get(transaction_key(transaction_id)):
+            height, position = location >> POSITION_BITS, location & ((1 << POSITION_BITS) - 1)
+            if height >= self.count:
+                continue
+            transaction = self.read_block(height)['transactions'][position]
+            if transaction['id'] == transaction_id:
+                return height, position, transaction
+        return None
+
+    def find_block(self, block_hash):
+        """Height of the block with this hash, or None"""
+        self.refresh()
+        for height in self._hash_index.get(hash_key(block_hash)):
+            if height < self.count and self._headers[height]['hash'].tobytes().hex() == block_hash:
+                return height
+        return None
+
+    def chain(self):
+        return LedgerChain(self)
+
+    def stats(self):
+        self.refresh()
+        segments = int(self._headers[self.count - 1]['segment']) + 1 if self.count else 0
+        return {
+            'directory': self.directory,
+            'blocks': self.count,
+            'transactions': self.transaction_count,
+            'segments': segments,
+            'bytes': sum(self._file_size(self._segment_fd(s)) for s in range(segments))
+                     + self._file_size(self._headers_fd) + self._file_size(self._tx_fd)
+        }
+
+    def close(self):
+        for fd in [self._headers_fd, self._tx_fd, *self._segment_fds.values()]:
+            os.close(fd)
+        self._segment_fds = {}
+        if self._lock_fd is not None and self._lock_pid == os.getpid():
+            os.close(self._lock_fd)
+        self._lock_fd = None
+
+
+class LedgerChain:
+    """List-like view of a LedgerStore, so the ledger can use it in place of a list"""
+
+    def __init__(self, store):
+        self.store = store
+
+    def __len__(self):
+        self.store.refresh()
+        return self.store.count
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __getitem__(self, item):
+        count = len(self)
+        if isinstance(item, slice):
+            start, stop, step = item.indices(count)
+            if step < 0:
+                return [self[i] for i in range(start, stop, step)]
+            return self.store.read_blocks(start, stop)[::step] if start < stop else []
+        if item < 0:
+            item += count
+        if not 0 <= item < count:
+            raise IndexError('block index out of range')
+        return self.store.read_block(item)
+
+    def __iter__(self):
+        count = len(self)
+        for start in range(0, count, 256):
+            yield from self.store.read_blocks(start, min(start + 256, count))
+
+    def append(self, block):
+        self.store.append_block(block)
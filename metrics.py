@@ -0,0 +1,413 @@
+"""
+Lightweight Prometheus-style metrics for the transport optimization server.
+
+Counters, gauges and histograms live in a process-wide registry and are
+rendered in the Prometheus text exposition format on ``/metrics``. Updating
+a metric is a dict lookup plus an addition under a per-metric lock, so it can
+sit on the request hot path.
+
+In the multi-process production server every worker periodically writes a
+snapshot of its registry to a shared directory; ``/metrics`` merges those
+snapshots with the live values of the worker that serves the scrape, so the
+numbers cover all workers whichever one Prometheus happens to hit. Snapshots
+of exited workers are removed, so their last values stop being counted.
+"""
+
+import bisect
+import os
+import pickle
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def remove_process_snapshot(directory, pid):
+    """Delete the snapshot an exited worker left in the multi-process directory"""
+    try:
+        os.remove(os.path.join(directory, f'{pid}.metrics'))
+    except FileNotFoundError:
+        pass
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if not self.labelnames:
+            return ()
+        return tuple(labels.get(name, '') for name in self.labelnames)
+
+    def snapshot(self):
+        with self._lock:
+            return {key: self._copy(value) for key, value in self._values.items()}
+
+    def _copy(self, value):
+        return value
+
+    def render(self, values):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for key in sorted(values):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(values[key])}')
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def total(self):
+        with self._lock:
+            return sum(self._values.values())
+
+    @staticmethod
+    def merge(a, b):
+        return a + b
+
+
+class Gauge(Counter):
+    """Value that can go up and down (in-flight requests, queue depth, ...)"""
+    kind = 'gauge'
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """Distribution of observations in fixed cumulative buckets"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [per-bucket counts (last one is +Inf), sum, count]
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _copy(self, value):
+        return [list(value[0]), value[1], value[2]]
+
+    @staticmethod
+    def merge(a, b):
+        return [[x + y for x, y in zip(a[0], b[0])], a[1] + b[1], a[2] + b[2]]
+
+    def summary(self, values=None):
+        """Count, sum and approximate p50/p95 across all label sets"""
+        values = self.snapshot() if values is None else values
+        counts = [0] * (len(self.buckets) + 1)
+        total = 0.0
+        count = 0
+        for bucket_counts, bucket_sum, bucket_count in values.values():
+            counts = [x + y for x, y in zip(counts, bucket_counts)]
+            total += bucket_sum
+            count += bucket_count
+
+        def quantile(q):
+            if not count:
+                return None
+            target = q * count
+            running = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                running += bucket_count
+                if running >= target:
+                    return bound if bound != float('inf') else self.buckets[-1]
+            return self.buckets[-1]
+
+        return {
+            'count': count,
+            'sum': round(total, 6),
+            'avg': round(total / count, 6) if count else None,
+            'p50': quantile(0.5),
+            'p95': quantile(0.95)
+        }
+
+    def render(self, values):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        bounds = self.buckets + (float('inf'),)
+        for key in sorted(values):
+            bucket_counts, total, count = values[key]
+            cumulative = 0
+            for bound, bucket_count in zip(bounds, bucket_counts):
+                cumulative += bucket_count
+                label = _format_labels(self.labelnames, key, ('le', _format_value(bound)))
+                lines.append(f'{self.name}_bucket{label} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class MetricsRegistry:
+    """Collection of metrics rendered together"""
+
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+        self.multiprocess_dir = None
+
+    def _register(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def snapshot(self):
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def reset(self):
+        """Clear all values (forked workers must not re-count the master's warmup)"""
+        for metric in self.metrics.values():
+            with metric._lock:
+                metric._values.clear()
+
+    def enable_multiprocess(self, directory, interval=5.0):
+        """Periodically write this process's values where sibling workers can merge them"""
+        os.makedirs(directory, exist_ok=True)
+        self.multiprocess_dir = directory
+        path = os.path.join(directory, f'{os.getpid()}.metrics')
+
+        def flush_forever():
+            while True:
+                self._write_snapshot(path)
+                time.sleep(interval)
+
+        threading.Thread(target=flush_forever, daemon=True).start()
+
+    def _write_snapshot(self, path):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def collect(self):
+        """Merged values for every metric (all workers in multi-process mode)"""
+        merged = self.snapshot()
+        if self.multiprocess_dir is None:
+            return merged
+
+        own_file = f'{os.getpid()}.metrics'
+        for filename in os.listdir(self.multiprocess_dir):
+            if not filename.endswith('.metrics') or filename == own_file:
+                continue
+            try:
+                pid = int(filename[:-len('.metrics')])
+            except ValueError:
+                continue
+            if not _process_alive(pid):
+                # A worker that died without its supervisor cleaning up
+                remove_process_snapshot(self.multiprocess_dir, pid)
+                continue
+            try:
+                with open(os.path.join(self.multiprocess_dir, filename), 'rb') as f:
+                    other = pickle.load(f)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                continue
+
+            for name, values in other.items():
+                metric = self.metrics.get(name)
+                if metric is None:
+                    continue
+                target = merged.setdefault(name, {})
+                for key, value in values.items():
+                    target[key] = metric.merge(target[key], value) if key in target else value
+        return merged
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        values = self.collect()
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.extend(metric.render(values.get(name, {})))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+# HTTP server metrics
+HTTP_REQUESTS = REGISTRY.counter(
+    'http_requests_total', 'HTTP requests by endpoint, method and status code',
+    ['endpoint', 'method', 'status'])
+HTTP_ERRORS = REGISTRY.counter(
+    'http_request_errors_total', 'Requests that failed (5xx, unhandled exception or handler-reported error)',
+    ['endpoint'])
+HTTP_LATENCY = REGISTRY.histogram(
+    'http_request_duration_seconds', 'Request latency by endpoint', ['endpoint'])
+HTTP_IN_FLIGHT = REGISTRY.gauge(
+    'http_requests_in_flight', 'Requests currently being handled')
+
+# Pipeline and advanced feature metrics
+PIPELINE_STAGE_SECONDS = REGISTRY.histogram(
+    'transport_pipeline_stage_seconds', 'Duration of optimizer pipeline stages', ['stage'])
+ROUTES_OPTIMIZED = REGISTRY.counter(
+    'transport_routes_optimized_total', 'Routes processed by optimize_routes')
+TWIN_TICK_SECONDS = REGISTRY.histogram(
+    'digital_twin_tick_seconds', 'Compute time of one digital twin simulation tick')
+IOT_READINGS = REGISTRY.counter(
+    'iot_readings_total', 'Sensor readings ingested', ['sensor_type'])
+IOT_READINGS_REJECTED = REGISTRY.counter(
+    'iot_readings_rejected_total', 'Sensor readings rejected by batch ingest', ['reason'])
+ANOMALIES_DETECTED = REGISTRY.counter(
+    'anomalies_detected_total', 'Anomaly alerts raised by the streaming detector', ['scope'])
+DEMAND_MODEL_SWAPS = REGISTRY.counter(
+    'demand_model_swaps_total', 'Online-trained demand models swapped in after beating the served model')
+DEMAND_MODEL_ERROR = REGISTRY.gauge(
+    'demand_model_validation_mae', 'Mean absolute error on held-out live hours', ['model'])
+IOT_EDGE_CELLS = REGISTRY.counter(
+    'iot_edge_cells_total', 'Pre-aggregated summary cells merged from edge devices')
+IOT_INGEST_THROTTLED = REGISTRY.counter(
+    'iot_ingest_throttled_total', 'Ingest requests refused with 429 because the pipeline was full')
+IOT_PIPELINE_QUEUE_DEPTH = REGISTRY.gauge(
+    'iot_pipeline_queue_depth', 'Work items waiting in each IoT ingest pipeline stage', ['stage'])
+IOT_PIPELINE_QUEUED_BYTES = REGISTRY.gauge(
+    'iot_pipeline_queued_bytes', 'Raw request bytes waiting to be parsed')
+IOT_PIPELINE_STAGE_SECONDS = REGISTRY.histogram(
+    'iot_pipeline_stage_seconds', 'Time per work item in each IoT ingest pipeline stage', ['stage'])
+BLOCKCHAIN_MINING_SECONDS = REGISTRY.histogram(
+    'blockchain_mining_seconds', 'Proof-of-work time per mined block',
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0))
+BLOCKCHAIN_BLOCKS = REGISTRY.counter(
+    'blockchain_blocks_mined_total', 'Blocks added to the ledger')
+BLOCKCHAIN_VERIFIED_HEIGHT = REGISTRY.gauge(
+    'blockchain_verified_height', 'Number of leading blocks that passed the last verification')
+
+
+def timed_stage(stage):
+    """Decorator recording the duration of a pipeline stage"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                PIPELINE_STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+        return wrapper
+    return decorator
+
+
+def instrument_flask(app):
+    """Record per-endpoint counts, latency, in-flight requests and errors"""
+    from flask import g, request
+
+    @app.before_request
+    def _metrics_start():
+        g._metrics_start = time.perf_counter()
+        HTTP_IN_FLIGHT.inc()
+
+    @app.after_request
+    def _metrics_record(response):
+        start = g.pop('_metrics_start', None)
+        if start is None:
+            return response
+
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        HTTP_LATENCY.observe(time.perf_counter() - start, endpoint=endpoint)
+        HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+
+        # Most handlers report failures as {"status": "error"} with HTTP 200
+        # and flag them with mark_request_failed()
+        if response.status_code >= 500 or g.pop('request_failed', False):
+            HTTP_ERRORS.inc(endpoint=endpoint)
+        return response
+
+    @app.teardown_request
+    def _metrics_finish(exc):
+        # Unhandled exceptions still pass through after_request as a 500
+        HTTP_IN_FLIGHT.dec()
+
+
+def mark_request_failed():
+    """Count the current request as failed whatever its status code"""
+    from flask import g
+    g.request_failed = True
+
+
+def server_summary():
+    """Compact request statistics for dashboards"""
+    values = REGISTRY.collect()
+    return {
+        'requests_total': sum(values.get(HTTP_REQUESTS.name, {}).values()),
+        'errors_total': sum(values.get(HTTP_ERRORS.name, {}).values()),
+        'in_flight': sum(values.get(HTTP_IN_FLIGHT.name, {}).values()),
+        'latency': HTTP_LATENCY.summary(values.get(HTTP_LATENCY.name, {}))
+    }
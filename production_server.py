@@ -0,0 +1,438 @@
+"""
+Multi-process production server for the Advanced AI Transport System.
+
+The master process preloads app.py once (optimizer data, demand models,
+templates and lazy imports are all warmed up by replaying a few requests),
+freezes the heap and then forks N worker processes that share the preloaded
+data copy-on-write. Numeric network arrays are moved into a versioned
+shared-memory store (see shared_store.py) so they stay shared even after
+a worker reloads data and publishes a new version. All workers accept
+connections from a single listening socket and are respawned by the master
+if they die.
+
+Each worker holds its own copy of the mutable in-memory state: digital twin,
+IoT processor, gamification profiles, pending ledger transactions and the
+online demand model. So that every client sees one copy, worker 0 owns that
+state. It also listens on a private Unix socket, and the other workers
+forward the endpoints in STATEFUL_PREFIXES to it. Background services
+(block miner, IoT pipeline, demand trainer) run in worker 0 only.
+
+Socket.IO events are relayed between workers through a message queue. Any
+URL supported by Flask-SocketIO (``redis://``, ``amqp://``, ...) can be used;
+by default a small local broker process is started as a stand-in so the
+whole setup can be run and tested on one machine without extra services.
+Clients should use the websocket transport, since the long-polling transport
+needs sticky sessions that a shared listening socket cannot provide.
+
+POSIX only (relies on ``os.fork``).
+"""
+
+import gc
+import http.client
+import os
+import random
+import secrets
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+import socketio as python_socketio
+from werkzeug.serving import make_server
+
+import metrics
+from shared_store import SharedArrayStore
+
+LOCAL_QUEUE_SCHEME = 'local://'
+LOCAL_QUEUE_KEY_ENV = 'LOCAL_MQ_AUTHKEY'
+
+# Requests replayed before forking so that lazy imports, template compilation
+# and model training happen once in the master instead of per worker
+WARMUP_PATHS = [
+    '/',
+    '/complete',
+    '/api/optimization_results',
+    '/api/network_map',
+    '/api/insights',
+    '/api/demand_analysis',
+    '/api/analytics/predict_demand',
+    '/api/advanced_dashboard'
+]
+
+
+# Endpoints served from worker memory that is not shared between processes;
+# every worker forwards them to the state owner (worker 0)
+STATEFUL_PREFIXES = (
+    '/api/digital_twin',
+    '/api/iot',
+    '/api/blockchain',
+    '/api/gamification',
+    '/api/analytics',
+    '/api/advanced_dashboard'
+)
+# How long a forwarded request waits for a respawning state owner
+OWNER_WAIT_SECONDS = 10.0
+_HOP_BY_HOP = {'connection', 'keep-alive', 'transfer-encoding', 'te', 'trailer', 'upgrade',
+               'proxy-authenticate', 'proxy-authorization'}
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class StateOwnerProxy:
+    """WSGI middleware forwarding stateful endpoints to the worker that owns the state"""
+
+    def __init__(self, app, owner_path, prefixes=STATEFUL_PREFIXES, timeout=300):
+        self.app = app
+        self.owner_path = owner_path
+        self.prefixes = tuple(prefixes)
+        self.timeout = timeout
+
+    def __call__(self, environ, start_response):
+        if not environ.get('PATH_INFO', '').startswith(self.prefixes):
+            return self.app(environ, start_response)
+
+        path = environ.get('SCRIPT_NAME', '') + environ.get('PATH_INFO', '')
+        if environ.get('QUERY_STRING'):
+            path += '?' + environ['QUERY_STRING']
+        headers = {key[5:].replace('_', '-').title(): value
+                   for key, value in environ.items() if key.startswith('HTTP_')}
+        headers = {key: value for key, value in headers.items() if key.lower() not in _HOP_BY_HOP}
+        if environ.get('CONTENT_TYPE'):
+            headers['Content-Type'] = environ['CONTENT_TYPE']
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+        body = environ['wsgi.input'].read(length) if length else None
+        if body is not None:
+            headers['Content-Length'] = str(len(body))
+        forwarded = headers.get('X-Forwarded-For')
+        client = environ.get('REMOTE_ADDR', '')
+        headers['X-Forwarded-For'] = f'{forwarded}, {client}' if forwarded else client
+
+        deadline = time.monotonic() + OWNER_WAIT_SECONDS
+        while True:
+            connection = _UnixHTTPConnection(self.owner_path, timeout=self.timeout)
+            try:
+                connection.request(environ['REQUEST_METHOD'], path, body=body, headers=headers)
+                response = connection.getresponse()
+                break
+            except (ConnectionRefusedError, FileNotFoundError):
+                # The owner is being respawned; its socket is kept open by the master
+                connection.close()
+                if time.monotonic() > deadline:
+                    start_response('503 Service Unavailable', [('Content-Type', 'application/json'),
+                                                              ('Retry-After', '5')])
+                    return [b'{"status":"error","message":"State owner worker unavailable"}']
+                time.sleep(0.1)
+
+        start_response(f'{response.status} {response.reason}',
+                       [(key, value) for key, value in response.getheaders() if key.lower() not in _HOP_BY_HOP])
+        return self._stream(connection, response)
+
+    @staticmethod
+    def _stream(connection, response):
+        try:
+            while True:
+                chunk = response.read(65536)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            connection.close()
+
+
+def _local_queue_authkey():
+    """Shared secret for the local broker, inherited by forked workers"""
+    key = os.environ.get(LOCAL_QUEUE_KEY_ENV)
+    if key is None:
+        key = secrets.token_hex(16)
+        os.environ[LOCAL_QUEUE_KEY_ENV] = key
+    return key.encode()
+
+
+def _parse_local_url(url):
+    host, port = url[len(LOCAL_QUEUE_SCHEME):].rstrip('/').rsplit(':', 1)
+    return host, int(port)
+
+
+class LocalMessageBroker:
+    """Fan-out broker that relays every message to all connected workers"""
+
+    def __init__(self, listener):
+        self.listener = listener
+        self.connections = []
+        self.lock = threading.Lock()
+
+    def serve_forever(self):
+        while True:
+            try:
+                conn = self.listener.accept()
+            except Exception:
+                continue
+            with self.lock:
+                self.connections.append(conn)
+            threading.Thread(target=self._relay, args=(conn,), daemon=True).start()
+
+    def _relay(self, conn):
+        while True:
+            try:
+                message = conn.recv_bytes()
+            except (EOFError, OSError):
+                break
+
+            with self.lock:
+                for other in list(self.connections):
+                    try:
+                        other.send_bytes(message)
+                    except OSError:
+                        self.connections.remove(other)
+
+        with self.lock:
+            if conn in self.connections:
+                self.connections.remove(conn)
+        conn.close()
+
+
+def start_local_broker(host='127.0.0.1', port=0):
+    """Fork a local broker process and return (pid, message queue URL)"""
+    listener = Listener((host, port), authkey=_local_queue_authkey())
+    address = listener.address
+
+    pid = os.fork()
+    if pid == 0:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        try:
+            LocalMessageBroker(listener).serve_forever()
+        finally:
+            os._exit(0)
+
+    listener.close()
+    return pid, f"{LOCAL_QUEUE_SCHEME}{address[0]}:{address[1]}"
+
+
+class LocalPubSubManager(python_socketio.PubSubManager):
+    """Socket.IO client manager backed by the local broker process
+
+    Usage::
+
+        url = 'local://127.0.0.1:6000'
+        server = socketio.Server(client_manager=LocalPubSubManager(url))
+    """
+    name = 'local'
+
+    def __init__(self, url, channel='flask-socketio', write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.address = _parse_local_url(url)
+        self.conn = None
+        self.send_lock = threading.Lock()
+
+    def _connect(self):
+        self.conn = Client(self.address, authkey=_local_queue_authkey())
+        return self.conn
+
+    def _publish(self, data):
+        with self.send_lock:
+            for attempt in range(2):
+                try:
+                    conn = self.conn or self._connect()
+                    conn.send((self.channel, data))
+                    return
+                except OSError:
+                    self.conn = None
+                    if attempt:
+                        raise
+
+    def _listen(self):
+        # A dedicated connection for receiving so that publishers never block
+        # behind a listener waiting in recv()
+        conn = None
+        while True:
+            try:
+                if conn is None:
+                    conn = Client(self.address, authkey=_local_queue_authkey())
+                channel, data = conn.recv()
+            except (EOFError, OSError):
+                conn = None
+                time.sleep(1)
+                continue
+            if channel == self.channel:
+                yield data
+
+
+def configure_message_queue(socketio, url):
+    """Attach a message queue client manager to an existing Flask-SocketIO instance
+
+    Must run in each worker after fork and before the first Socket.IO
+    connection, since the manager starts its listener thread lazily.
+    """
+    channel = 'flask-socketio'
+    if url.startswith(LOCAL_QUEUE_SCHEME):
+        manager = LocalPubSubManager(url, channel=channel)
+    elif url.startswith(('redis://', 'rediss://')):
+        manager = python_socketio.RedisManager(url, channel=channel)
+    elif url.startswith('kafka://'):
+        manager = python_socketio.KafkaManager(url, channel=channel)
+    elif url.startswith('zmq'):
+        manager = python_socketio.ZmqManager(url, channel=channel)
+    else:
+        manager = python_socketio.KombuManager(url, channel=channel)
+
+    server = socketio.server
+    manager.set_server(server)
+    server.manager = manager
+    server.manager_initialized = False
+    return manager
+
+
+def preload(warmup=True, store=None):
+    """Import and warm up the application in the master process"""
+    import app as app_module
+
+    app_module.startup()
+    app_module.preload_optimizer()
+    if store is not None:
+        # Network arrays move into shared memory; workers inherit the mapping
+        app_module.use_shared_store(store)
+
+    if warmup:
+        client = app_module.app.test_client()
+        for path in WARMUP_PATHS:
+            client.get(path)
+
+    # Threads started during warmup would not survive the fork; workers
+    # start their own on the first request
+    app_module.stop_background_services()
+
+    return app_module
+
+
+def _run_worker(app_module, sock, host, port, message_queue, metrics_dir, owner_sock, owner_path):
+    """Worker process body: serve requests from the shared socket
+
+    The state owner also serves forwarded requests on ``owner_sock``; other
+    workers forward stateful endpoints to ``owner_path``.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    # Forked workers would otherwise produce identical "random" simulations
+    random.seed()
+    np.random.seed()
+    gc.enable()
+
+    # Warmup requests were counted in the master; each worker reports only
+    # its own traffic and /metrics merges all workers
+    metrics.REGISTRY.reset()
+    metrics.REGISTRY.enable_multiprocess(metrics_dir)
+
+    configure_message_queue(app_module.socketio, message_queue)
+    # Only the state owner runs the miner, IoT pipeline and demand trainer
+    app_module.owns_state = owner_sock is not None
+    if owner_sock is not None:
+        owner = make_server(f'unix://{owner_path}', 0, app_module.app, threaded=True, fd=owner_sock.fileno())
+        threading.Thread(target=owner.serve_forever, daemon=True).start()
+    else:
+        app_module.app.wsgi_app = StateOwnerProxy(app_module.app.wsgi_app, owner_path)
+    server = make_server(host, port, app_module.app, threaded=True, fd=sock.fileno())
+    server.serve_forever()
+
+
+def serve(host='0.0.0.0', port=5000, workers=None, message_queue=None, warmup=True):
+    """Preload the app, fork workers and supervise them until interrupted"""
+    if not hasattr(os, 'fork'):
+        raise RuntimeError('Production mode needs os.fork(); use "python app.py" on this platform')
+
+    workers = workers or os.cpu_count() or 1
+    message_queue = message_queue or os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+
+    broker_pid = None
+    if message_queue is None:
+        broker_pid, message_queue = start_local_broker()
+
+    # Keep the collector from touching (and so un-sharing) preloaded objects,
+    # as recommended for gc.freeze()
+    gc.disable()
+    started = time.perf_counter()
+    store = SharedArrayStore.create()
+    app_module = preload(warmup=warmup, store=store)
+    print(f"✅ Preloaded application in {time.perf_counter() - started:.2f}s")
+
+    sock = socket.create_server((host, port), backlog=socket.SOMAXCONN)
+    sock.set_inheritable(True)
+    metrics_dir = tempfile.mkdtemp(prefix='transport-metrics-')
+    # Private socket of the state owner (worker 0); opened here so it
+    # survives the owner being respawned
+    owner_dir = tempfile.mkdtemp(prefix='transport-owner-')
+    owner_path = os.path.join(owner_dir, 'owner.sock')
+    owner_sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    owner_sock.bind(owner_path)
+    owner_sock.listen(socket.SOMAXCONN)
+    owner_sock.set_inheritable(True)
+
+    gc.freeze()
+
+    children = {}
+
+    def spawn(worker_id):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _run_worker(app_module, sock, host, port, message_queue, metrics_dir,
+                            owner_sock if worker_id == 0 else None, owner_path)
+            finally:
+                os._exit(0)
+        children[pid] = worker_id
+        return pid
+
+    for worker_id in range(workers):
+        spawn(worker_id)
+    gc.enable()
+
+    print(f"🚀 Serving on http://{host}:{port} with {workers} workers (message queue: {message_queue})")
+
+    stopping = False
+
+    def shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children) + ([broker_pid] if broker_pid else []):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+
+        worker_id = children.pop(pid, None)
+        # The exited worker's in-flight requests and gauges must not stay in /metrics
+        metrics.remove_process_snapshot(metrics_dir, pid)
+        if worker_id is not None and not stopping:
+            print(f"⚠️  Worker {worker_id} (pid {pid}) exited, respawning")
+            spawn(worker_id)
+
+    sock.close()
+    owner_sock.close()
+    store.destroy()
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    shutil.rmtree(owner_dir, ignore_errors=True)
+    return 0
@@ -0,0 +1,199 @@
+"""
+Opt-in cProfile hook for diagnosing slow endpoints under real traffic.
+
+A request is profiled when it carries an ``X-Profile: 1`` header from an
+admin, when profiling has been switched on through the admin endpoint, or
+when it falls into a random 1-in-N sample. Profiles are kept in a bounded
+on-disk ring (oldest removed first) and can be listed and downloaded as
+pstats files or plain-text summaries.
+
+Admin access needs the ``X-Admin-Token`` header to match the ``ADMIN_TOKEN``
+environment variable. Without a configured token admin access is disabled,
+unless ``ADMIN_ALLOW_LOOPBACK=1`` opts in to trusting loopback clients
+(never behind a local reverse proxy, where every client is loopback).
+"""
+
+import cProfile
+import io
+import itertools
+import json
+import os
+import pstats
+import random
+import re
+import tempfile
+import threading
+import time
+
+PROFILE_ID_PATTERN = re.compile(r'^[0-9]+-[0-9]+-[0-9]+$')
+LOOPBACK_ADDRESSES = ('127.0.0.1', '::1')
+
+
+def admin_authorized(request, token=None, allow_loopback=None):
+    """Check a request against the admin token (or opted-in loopback if none is set)"""
+    token = token if token is not None else os.environ.get('ADMIN_TOKEN')
+    if token:
+        return request.headers.get('X-Admin-Token') == token
+    if allow_loopback is None:
+        allow_loopback = os.environ.get('ADMIN_ALLOW_LOOPBACK') == '1'
+    return allow_loopback and request.remote_addr in LOOPBACK_ADDRESSES
+
+
+class ProfileStore:
+    """Bounded on-disk ring of cProfile results"""
+
+    def __init__(self, directory=None, max_profiles=50):
+        self.directory = directory or os.path.join(tempfile.gettempdir(), 'transport-profiles')
+        self.max_profiles = max_profiles
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, profile_id, extension):
+        if not PROFILE_ID_PATTERN.match(profile_id):
+            raise ValueError(f'Invalid profile id: {profile_id}')
+        return os.path.join(self.directory, f'{profile_id}.{extension}')
+
+    def save(self, profile, meta):
+        """Write a profile and its metadata, then drop the oldest beyond the limit"""
+        profile_id = f'{int(time.time() * 1000)}-{os.getpid()}-{next(self._counter)}'
+        meta = dict(meta, id=profile_id)
+
+        profile.dump_stats(self._path(profile_id, 'prof'))
+        with open(self._path(profile_id, 'json'), 'w') as f:
+            json.dump(meta, f)
+
+        self._prune()
+        return profile_id
+
+    def _prune(self):
+        with self._lock:
+            ids = self._ids()
+            for profile_id in ids[:-self.max_profiles] if len(ids) > self.max_profiles else []:
+                for extension in ('prof', 'json'):
+                    try:
+                        os.remove(self._path(profile_id, extension))
+                    except FileNotFoundError:
+                        pass
+
+    def _ids(self):
+        # Ids start with a millisecond timestamp, so sorting orders by age
+        ids = [name[:-5] for name in os.listdir(self.directory) if name.endswith('.json')]
+        return sorted(ids, key=lambda profile_id: tuple(int(part) for part in profile_id.split('-')))
+
+    def list(self):
+        """Metadata of stored profiles, newest first"""
+        profiles = []
+        for profile_id in reversed(self._ids()):
+            try:
+                with open(self._path(profile_id, 'json')) as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return profiles
+
+    def profile_path(self, profile_id):
+        """Path of the pstats file, or None if it is not (or no longer) stored"""
+        path = self._path(profile_id, 'prof')
+        return path if os.path.exists(path) else None
+
+    def text_report(self, profile_id, sort='cumulative', limit=40):
+        """Human-readable pstats summary of a stored profile"""
+        path = self.profile_path(profile_id)
+        if path is None:
+            return None
+        output = io.StringIO()
+        stats = pstats.Stats(path, stream=output)
+        stats.strip_dirs().sort_stats(sort).print_stats(limit)
+        return output.getvalue()
+
+
+class RequestProfiler:
+    """Decides which requests to profile and records them in a ProfileStore"""
+
+    def __init__(self, store, enabled=False, sample_every=0, path_prefix=''):
+        self.store = store
+        self.enabled = enabled
+        self.sample_every = sample_every
+        self.path_prefix = path_prefix
+        # Only one cProfile instance can be active at a time (Python 3.12+
+        # enforces this interpreter-wide), so overlapping requests are skipped
+        self._active = threading.Lock()
+
+    def configure(self, enabled=None, sample_every=None, path_prefix=None):
+        """Admin toggle: profile every matching request and/or a 1-in-N sample"""
+        if enabled is not None:
+            self.enabled = bool(enabled)
+        if sample_every is not None:
+            self.sample_every = max(0, int(sample_every))
+        if path_prefix is not None:
+            self.path_prefix = path_prefix
+        return self.status()
+
+    def status(self):
+        return {
+            'enabled': self.enabled,
+            'sample_every': self.sample_every,
+            'path_prefix': self.path_prefix,
+            'directory': self.store.directory,
+            'max_profiles': self.store.max_profiles
+        }
+
+    def should_profile(self, request):
+        if request.headers.get('X-Profile') == '1':
+            return admin_authorized(request)
+        if not request.path.startswith(self.path_prefix):
+            return False
+        if self.enabled:
+            return True
+        return self.sample_every > 0 and random.random() * self.sample_every < 1
+
+    def instrument_flask(self, app):
+        """Register request hooks that wrap selected requests in cProfile"""
+        from flask import g, request
+
+        @app.before_request
+        def _profile_start():
+            if not (self.enabled or self.sample_every or 'X-Profile' in request.headers):
+                return
+            if not self.should_profile(request) or not self._active.acquire(blocking=False):
+                return
+
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiling tool is already active
+                self._active.release()
+                return
+            g._request_profile = (profile, time.perf_counter())
+
+        @app.after_request
+        def _profile_finish(response):
+            state = g.pop('_request_profile', None)
+            if state is None:
+                return response
+
+            profile, start = state
+            profile.disable()
+            self._active.release()
+
+            profile_id = self.store.save(profile, {
+                'path': request.path,
+                'method': request.method,
+                'endpoint': request.url_rule.rule if request.url_rule is not None else None,
+                'status': response.status_code,
+                'duration_seconds': round(time.perf_counter() - start, 6),
+                'timestamp': time.time(),
+                'pid': os.getpid()
+            })
+            response.headers['X-Profile-Id'] = profile_id
+            return response
+
+        @app.teardown_request
+        def _profile_abort(exc):
+            # after_request is skipped if the response could not be built
+            state = g.pop('_request_profile', None)
+            if state is not None:
+                state[0].disable()
+                self._active.release()
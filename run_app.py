@@ -9,9 +9,12 @@ with all features enabled and ready for demonstration.
 
 import os
 import sys
+import argparse
 import subprocess
 import time
 
+from lazy_imports import is_available, measure_cold_start
+
 def print_banner():
     """Print the application banner"""
     banner = """
@@ -28,22 +31,30 @@ def print_banner():
 """
     print(banner)
 
+# pip distribution name -> importable module name
+REQUIRED_PACKAGES = {
+    'flask': 'flask',
+    'flask-socketio': 'flask_socketio',
+    'pandas': 'pandas',
+    'numpy': 'numpy',
+    'folium': 'folium',
+    'scikit-learn': 'sklearn',
+    'networkx': 'networkx',
+    'geopy': 'geopy'
+}
+
 def check_dependencies():
     """Check if all required dependencies are installed"""
     print("🔍 Checking dependencies...")
     
-    required_packages = [
-        'flask', 'pandas', 'numpy', 'plotly', 'folium', 
-        'scikit-learn', 'ortools', 'networkx', 'geopy'
-    ]
-    
     missing_packages = []
     
-    for package in required_packages:
-        try:
-            __import__(package)
+    # find_spec locates packages without importing them, so the check
+    # does not pay the import cost of every heavy dependency up front
+    for package, module_name in REQUIRED_PACKAGES.items():
+        if is_available(module_name):
             print(f"   ✅ {package}")
-        except ImportError:
+        else:
             missing_packages.append(package)
             print(f"   ❌ {package}")
     
@@ -57,10 +68,25 @@ def check_dependencies():
     
     return True
 
-def start_application():
+def print_startup_report():
+    """Print a cold start import breakdown for app.py"""
+    print("⏱️  Measuring cold start of app.py...")
+    report = measure_cold_start('app')
+    
+    if not report['ok']:
+        print("❌ Importing app.py failed")
+        return False
+    
+    print(f"   Total import time: {report['total_seconds']:.3f}s")
+    for entry in report['packages']:
+        print(f"   {entry['package']:<24} {entry['seconds']:.3f}s")
+    
+    return True
+
+def start_application(host='0.0.0.0', port=5000):
     """Start the Flask application"""
     print("\n🚀 Starting Advanced AI Transport System...")
-    print("🌐 Server will be available at: http://localhost:5000")
+    print(f"🌐 Server will be available at: http://localhost:{port}")
     print("📱 Access from any device on your network")
     print("\n" + "="*80)
     print("DEMO READY - All Advanced Features Available:")
@@ -75,7 +101,7 @@ def start_application():
     print("🚌 Route Optimization        - AI-powered transport planning")
     print("="*80)
     print("\n💡 Quick Start:")
-    print("   1. Open browser to http://localhost:5000")
+    print(f"   1. Open browser to http://localhost:{port}")
     print("   2. Click 'Initialize AI System'")
     print("   3. Explore all advanced features!")
     print("\n🎊 Ready to win Ghana AI Hackathon 2024! 🎊")
@@ -83,8 +109,9 @@ def start_application():
     
     # Import and run the main app
     try:
-        from app import app
-        app.run(host='0.0.0.0', port=5000, debug=False)
+        from app import app, startup
+        startup()
+        app.run(host=host, port=port, debug=False)
     except Exception as e:
         print(f"❌ Error starting application: {e}")
         return False
@@ -93,8 +120,31 @@ def start_application():
 
 def main():
     """Main execution function"""
+    parser = argparse.ArgumentParser(description='Advanced AI Transport System launcher')
+    parser.add_argument('--startup-report', action='store_true',
+                        help='print the cold start import breakdown and exit')
+    parser.add_argument('--production', action='store_true',
+                        help='preload the app once and serve it from multiple worker processes; '
+                             'live state (twin, IoT, gamification, ledger queue) is kept in worker 0 '
+                             'and other workers forward those endpoints to it')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of worker processes in production mode (default: CPU count)')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--message-queue', default=None,
+                        help='Socket.IO message queue URL shared by workers '
+                             '(default: a local broker process)')
+    args = parser.parse_args()
+    
     print_banner()
     
+    if args.startup_report:
+        sys.exit(0 if print_startup_report() else 1)
+    
+    if args.production:
+        from production_server import serve
+        sys.exit(serve(args.host, args.port, args.workers, args.message_queue))
+    
     print("🔧 Production System Check...")
     
     # Check if we're in the right directory
@@ -117,7 +167,7 @@ def main():
     print("\n" + "="*80)
     input("Press ENTER to start the Advanced AI Transport System...")
     
-    if start_application():
+    if start_application(args.host, args.port):
         print("✅ Application started successfully!")
     else:
         print("❌ Failed to start application")
@@ -0,0 +1,229 @@
+"""
+Shared-memory data plane for network arrays used by every worker process.
+
+A store is one small manifest segment plus one data segment per published
+version. Publishing packs a dict of NumPy arrays into a fresh segment and
+then rewrites the manifest under a sequence lock, so readers either see the
+old version or the new one, never a mix. Readers attach to a version with
+read-only zero-copy views, which means memory use stays flat no matter how
+many worker processes read the data.
+
+Manifest layout (little endian)::
+
+    [0:8]   sequence number, odd while a writer is updating it
+    [8:16]  current version (0 = nothing published yet)
+    [16:20] length of the JSON description that follows
+    [20:]   JSON: {"version", "segment", "published", "arrays": [[key, dtype, shape, offset], ...]}
+"""
+
+import json
+import multiprocessing
+import os
+import struct
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+MANIFEST_SIZE = 64 * 1024
+HEADER = struct.Struct('<QQI')
+ALIGNMENT = 64
+
+
+def _open_segment(name, untrack=False):
+    """Attach to an existing segment
+
+    Forked workers share their parent's resource tracker, so attaching there
+    is harmless. An unrelated process has its own tracker that would unlink
+    the segment when the process exits, so ``untrack`` opts out of it.
+    """
+    if not untrack:
+        return shared_memory.SharedMemory(name=name)
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 has no track argument
+        segment = shared_memory.SharedMemory(name=name)
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(segment._name, 'shared_memory')
+        return segment
+
+
+def _unlink_segment(name):
+    try:
+        segment = _open_segment(name)
+    except FileNotFoundError:
+        return
+    segment.close()
+    segment.unlink()
+
+
+class _SegmentBuffer(np.ndarray):
+    """Byte view over a segment that keeps the segment open while any view of it lives"""
+    segment = None
+
+
+class SharedSnapshot:
+    """One published version of the store, exposed as read-only array views"""
+
+    def __init__(self, version, segment, arrays, published):
+        self.version = version
+        self.segment = segment
+        self.arrays = arrays
+        self.published = published
+
+    def group(self, prefix):
+        """Arrays whose key starts with ``prefix.``, keyed by the remainder"""
+        prefix = prefix + '.'
+        return {
+            key[len(prefix):]: array
+            for key, array in self.arrays.items()
+            if key.startswith(prefix)
+        }
+
+
+class SharedArrayStore:
+    """Versioned NumPy arrays in shared memory with an atomic manifest switch"""
+
+    def __init__(self, name, manifest, lock=None, owner=False, untrack=False, keep_versions=2):
+        self.name = name
+        self.manifest = manifest
+        self.lock = lock or multiprocessing.Lock()
+        self.owner = owner
+        self.untrack = untrack
+        self.keep_versions = keep_versions
+        self._snapshot = None
+
+    @classmethod
+    def create(cls, name=None, keep_versions=2):
+        """Create a new store; call before forking so workers inherit the lock"""
+        name = name or f"tx{os.getpid()}"
+        manifest = shared_memory.SharedMemory(name=f"{name}_m", create=True, size=MANIFEST_SIZE)
+        HEADER.pack_into(manifest.buf, 0, 0, 0, 0)
+        return cls(name, manifest, owner=True, keep_versions=keep_versions)
+
+    @classmethod
+    def attach_existing(cls, name):
+        """Attach to a store created by another (non-parent) process"""
+        return cls(name, _open_segment(f"{name}_m", untrack=True), untrack=True)
+
+    def current_version(self):
+        """Cheap check of the latest published version number"""
+        return HEADER.unpack_from(self.manifest.buf, 0)[1]
+
+    def _read_manifest(self):
+        while True:
+            seq_before, version, length = HEADER.unpack_from(self.manifest.buf, 0)
+            if seq_before % 2:
+                time.sleep(0)
+                continue
+            payload = bytes(self.manifest.buf[HEADER.size:HEADER.size + length])
+            seq_after = HEADER.unpack_from(self.manifest.buf, 0)[0]
+            if seq_before == seq_after:
+                return version, (json.loads(payload) if length else None)
+
+    def publish(self, arrays):
+        """Copy arrays into a new versioned segment and switch readers to it"""
+        layout = []
+        offset = 0
+        prepared = {}
+        for key, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            prepared[key] = array
+            layout.append([key, array.dtype.str, list(array.shape), offset])
+            offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+
+        with self.lock:
+            version = self.current_version() + 1
+            segment_name = f"{self.name}_v{version}"
+            segment = shared_memory.SharedMemory(name=segment_name, create=True, size=max(offset, 1))
+            for key, dtype, shape, start in layout:
+                array = prepared[key]
+                target = np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf, offset=start)
+                target[...] = array
+                del target
+
+            description = json.dumps({
+                'version': version,
+                'segment': segment_name,
+                'published': time.time(),
+                'arrays': layout
+            }).encode()
+            if HEADER.size + len(description) > MANIFEST_SIZE:
+                segment.close()
+                segment.unlink()
+                raise ValueError('Too many arrays for the shared-memory manifest')
+
+            # Sequence lock: odd while the manifest is being rewritten
+            sequence = HEADER.unpack_from(self.manifest.buf, 0)[0]
+            struct.pack_into('<Q', self.manifest.buf, 0, sequence + 1)
+            self.manifest.buf[HEADER.size:HEADER.size + len(description)] = description
+            struct.pack_into('<QI', self.manifest.buf, 8, version, len(description))
+            struct.pack_into('<Q', self.manifest.buf, 0, sequence + 2)
+
+            # The publisher's own handle is only needed while copying. Readers
+            # that still map an older version keep their mapping after unlink,
+            # so only the name of the version falling out of the window goes
+            segment.close()
+            if version > self.keep_versions:
+                _unlink_segment(f"{self.name}_v{version - self.keep_versions}")
+
+        return version
+
+    def attach(self):
+        """Return the latest snapshot, reusing the cached one if unchanged"""
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == self.current_version():
+            return snapshot
+
+        version, description = self._read_manifest()
+        if description is None:
+            return None
+
+        segment = _open_segment(description['segment'], untrack=self.untrack)
+        raw = np.ndarray(segment.size, dtype=np.uint8, buffer=segment.buf).view(_SegmentBuffer)
+        raw.segment = segment
+        raw.flags.writeable = False
+
+        arrays = {}
+        for key, dtype, shape, offset in description['arrays']:
+            dtype = np.dtype(dtype)
+            nbytes = int(np.prod(shape)) * dtype.itemsize
+            arrays[key] = np.asarray(raw[offset:offset + nbytes]).view(dtype).reshape(shape)
+
+        snapshot = SharedSnapshot(version, segment, arrays, description['published'])
+        self._snapshot = snapshot
+        return snapshot
+
+    def stats(self):
+        """Manifest summary for monitoring"""
+        version, description = self._read_manifest()
+        if description is None:
+            return {'name': self.name, 'version': 0, 'arrays': 0, 'bytes': 0}
+        return {
+            'name': self.name,
+            'version': version,
+            'segment': description['segment'],
+            'published': description['published'],
+            'arrays': len(description['arrays']),
+            'bytes': sum(
+                int(np.prod(shape)) * np.dtype(dtype).itemsize
+                for _, dtype, shape, _ in description['arrays']
+            )
+        }
+
+    def destroy(self):
+        """Unlink the manifest and the retained versions (owner process only)"""
+        if not self.owner:
+            return
+
+        version = self.current_version()
+        for old in range(max(1, version - self.keep_versions + 1), version + 1):
+            _unlink_segment(f"{self.name}_v{old}")
+
+        self._snapshot = None
+        self.manifest.close()
+        try:
+            self.manifest.unlink()
+        except FileNotFoundError:
+            pass
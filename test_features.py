@@ -8,11 +8,14 @@ import requests
 import json
 import time
 
-def test_feature(url, name, expected_status=200):
-    """Test a single feature endpoint"""
+def test_feature(url, name, expected_status=200, payload=None):
+    """Test a single feature endpoint (POSTs ``payload`` when one is given)"""
     try:
         print(f"Testing {name}...")
-        response = requests.get(url, timeout=10)
+        if payload is None:
+            response = requests.get(url, timeout=10)
+        else:
+            response = requests.post(url, json=payload, timeout=10)
         if response.status_code == expected_status:
             print(f"✅ {name}: SUCCESS")
             return True
@@ -34,21 +37,52 @@ def main():
         (f"{base_url}/", "Main Dashboard"),
         (f"{base_url}/api/advanced_dashboard", "Advanced Dashboard API"),
         (f"{base_url}/api/blockchain/status", "Blockchain Status"),
+        (f"{base_url}/api/blockchain/mining", "Blockchain Mining Config"),
+        (f"{base_url}/api/blockchain/blocks", "Blockchain Blocks"),
+        (f"{base_url}/api/blockchain/verify", "Blockchain Verification"),
         (f"{base_url}/api/digital_twin/status", "Digital Twin Status"),
+        (f"{base_url}/api/digital_twin/simulate_day", "Digital Twin Day Simulation"),
+        (f"{base_url}/api/digital_twin/simulate_day", "Digital Twin What-If Scenario", 200,
+         {"headway_minutes": 8, "vehicle_capacity": 80, "demand_scale": 1.2,
+          "start_hour": 5, "end_hour": 23, "seed": 1}),
+        (f"{base_url}/api/digital_twin/forecast", "Digital Twin Congestion Forecast"),
+        (f"{base_url}/api/digital_twin/history", "Digital Twin History"),
         (f"{base_url}/api/iot/data", "IoT Data API"),
+        (f"{base_url}/api/iot/summary", "IoT Window Summary"),
+        (f"{base_url}/api/iot/pipeline", "IoT Ingest Pipeline"),
+        (f"{base_url}/api/iot/series", "IoT Sensor History Store"),
+        (f"{base_url}/api/iot/edge", "IoT Edge Devices"),
+        (f"{base_url}/api/iot/edge/register", "IoT Edge Register", 200,
+         {"edge_id": "EDGE_TEST", "sensors": ["IOT_000"]}),
+        # Invalid cells are counted as rejections, not merged (huge sketch
+        # code, infinite count, NaN total, infinite max)
+        (f"{base_url}/api/iot/edge/summary", "IoT Edge Summary Validation", 200,
+         {"edge_id": "EDGE_TEST", "width": 10, "cells": [
+             {"sensor_id": "IOT_000", "start": 0, "count": 1, "fields": {"value": [1.0, 1, 1.0, 1.0]},
+              "sketches": {"value": {"100000": 1}}},
+             {"sensor_id": "IOT_000", "start": 0, "count": float("inf"), "fields": {}},
+             {"sensor_id": "IOT_000", "start": 0, "count": 1, "fields": {"value": [float("nan"), 1, 1.0, 1.0]}},
+             {"sensor_id": "IOT_000", "start": 0, "count": 1, "fields": {"value": [1.0, 1, 1.0, float("inf")]}}]}),
         (f"{base_url}/api/social_impact/metrics", "Social Impact API"),
         (f"{base_url}/api/gamification/status", "Gamification API"),
+        (f"{base_url}/api/gamification/leaderboard?limit=5", "Gamification Leaderboard"),
+        (f"{base_url}/api/gamification/rank/user_1?radius=2", "Gamification Rank"),
         (f"{base_url}/api/voice/status", "Voice Assistant API"),
         (f"{base_url}/api/analytics/overview", "Analytics API"),
+        (f"{base_url}/api/analytics/anomalies/stats", "Streaming Anomaly Detector"),
+        (f"{base_url}/api/analytics/demand_model", "Online Demand Model"),
+        (f"{base_url}/api/analytics/features", "Stop Feature Store"),
         (f"{base_url}/optimize", "Route Optimization"),  # Now expects 200
+        (f"{base_url}/api/system/startup", "Startup Report"),
+        (f"{base_url}/api/system/shared_data", "Shared Data Plane"),
+        (f"{base_url}/metrics", "Prometheus Metrics"),
     ]
     
     passed = 0
     total = len(tests)
     
     for url, name, *args in tests:
-        expected_status = args[0] if args else 200
-        if test_feature(url, name, expected_status):
+        if test_feature(url, name, *args):
             passed += 1
         time.sleep(0.5)  # Small delay between tests
     